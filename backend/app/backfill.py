@@ -0,0 +1,158 @@
+"""Bring documents stored before the document registry and the typed bill fields up to date.
+
+Two kinds of existing documents are missing from ``/api/aggregate`` and from
+duplicate detection:
+
+- chunks stored before documents were registered (no ``fingerprint``): they
+  are grouped into documents, by source and tagger metadata, over runs of
+  consecutive ``_id`` (a document's chunks were inserted together). Each group
+  gets a registry entry with a content hash of its stored text and the
+  normalized-text hash ingestion uses, and its chunks get that ``fingerprint``;
+- registry entries without typed bill fields (ingested before they were
+  extracted).
+
+Bill fields already in the chunks' metadata are extracted right away with
+``extract_bill_fields``. Documents still without them are queued for the
+deferred tagging back-fill, which every ready API worker runs, so the LLM tags
+them like a ``TAGGING_MODE=deferred`` ingestion. Re-running is safe.
+
+Run from ``backend/``::
+
+    python -m app.backfill status     # count what is left to back-fill
+    python -m app.backfill run
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from pymongo.errors import DuplicateKeyError
+
+from .bill_fields import BILL_FIELDS_SCHEMA, extract_bill_fields
+from .fingerprint import content_hash, text_hash
+from .quantization import WITHOUT_EMBEDDING_PROJECTION
+
+# Chunks stored before documents were registered
+UNREGISTERED = {"fingerprint": {"$exists": False}}
+# Registered documents with no typed bill field that were never tagged by the back-fill
+UNTYPED = {"status": "done", "tagging": {"$exists": False}, **{f: {"$exists": False} for f in BILL_FIELDS_SCHEMA}}
+
+
+def _group_key(chunk: Dict[str, Any]) -> tuple:
+    return (chunk.get("source"), chunk.get("title"), tuple(chunk.get("keywords") or ()))
+
+
+def unregistered_documents(collection, batch_size: int = 500) -> Iterator[List[Dict[str, Any]]]:
+    """Chunks without a ``fingerprint``, grouped into documents (consecutive, same source and tagger metadata)."""
+    cursor = collection.find(UNREGISTERED, WITHOUT_EMBEDDING_PROJECTION).sort("_id", 1).batch_size(batch_size)
+    group: List[Dict[str, Any]] = []
+    for chunk in cursor:
+        if group and _group_key(chunk) != _group_key(group[-1]):
+            yield group
+            group = []
+        group.append(chunk)
+    if group:
+        yield group
+
+
+def _tagging(text: str, head_chars: int) -> Dict[str, Any]:
+    return {"tagging": "pending", "tag_head": text[:head_chars]}
+
+
+def register(collection, registry, chunks: List[Dict[str, Any]], head_chars: int) -> str:
+    """Register one document made of ``chunks``; returns ``registered``, ``resumed`` or ``duplicate``."""
+    text = "\n\n".join(c.get("text") or "" for c in chunks)
+    # the uploaded bytes are gone: hash the stored text, salted with the first chunk id so a
+    # re-run finds its own entry while the same text stored twice still clashes on text_hash
+    fingerprint = content_hash(str(chunks[0]["_id"]).encode("ascii") + text.encode("utf-8"))
+    fields = extract_bill_fields(chunks[0])
+    entry = {
+        "content_hash": fingerprint,
+        "text_hash": text_hash(text),
+        "source": chunks[0].get("source"),
+        "status": "done",
+        "chunk_count": len(chunks),
+        "ingested_at": chunks[0]["_id"].generation_time.replace(tzinfo=None),
+        "backfilled": True,
+        **(fields or _tagging(text, head_chars)),
+    }
+    outcome = "registered"
+    try:
+        registry.insert_one(entry)
+    except DuplicateKeyError:
+        existing = registry.find_one({"content_hash": fingerprint}, {"backfilled": 1})
+        if existing is None or not existing.get("backfilled"):
+            # the same text is stored twice: left as it is, reported
+            return "duplicate"
+        # an earlier run registered it but stopped before marking the chunks
+        outcome = "resumed"
+    collection.update_many({"_id": {"$in": [c["_id"] for c in chunks]}}, {"$set": {"fingerprint": fingerprint}})
+    return outcome
+
+
+def fill_bill_fields(collection, registry, entry: Dict[str, Any], head_chars: int) -> str:
+    """Type the bill fields of a registered document from its chunks, else queue it for tagging."""
+    chunks = list(collection.find({"fingerprint": entry["content_hash"]}, WITHOUT_EMBEDDING_PROJECTION).sort("_id", 1))
+    if not chunks:
+        return "missing"
+    fields = extract_bill_fields(chunks[0])
+    update = fields or _tagging("\n\n".join(c.get("text") or "" for c in chunks), head_chars)
+    registry.update_one({"_id": entry["_id"]}, {"$set": update})
+    return "typed" if fields else "queued"
+
+
+def status(collection, registry) -> Dict[str, int]:
+    return {
+        "unregistered_chunks": collection.count_documents(UNREGISTERED),
+        "untyped_documents": registry.count_documents(UNTYPED),
+        "tagging_pending": registry.count_documents({"tagging": {"$in": ["pending", "running"]}}),
+    }
+
+
+def run(collection, registry, head_chars: int = 4000, batch_size: int = 500) -> Dict[str, Any]:
+    """Register unregistered chunks, then type or queue every untyped document; returns counts and duplicates."""
+    counts = {"registered": 0, "resumed": 0, "duplicate": 0, "typed": 0, "queued": 0, "missing": 0}
+    duplicates: List[str] = []
+    for chunks in unregistered_documents(collection, batch_size):
+        outcome = register(collection, registry, chunks, head_chars)
+        counts[outcome] += 1
+        if outcome == "duplicate":
+            duplicates.extend(str(c["_id"]) for c in chunks)
+    for entry in list(registry.find(UNTYPED, {"content_hash": 1})):
+        counts[fill_bill_fields(collection, registry, entry, head_chars)] += 1
+    return {**counts, "duplicate_chunk_ids": duplicates}
+
+
+def _database():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    uri = os.getenv("MONGO_DB_URI")
+    if not uri:
+        raise RuntimeError("MONGO_DB_URI is required in environment")
+    client = MongoClient(uri)
+    db = client[os.getenv("MONGO_DB", "bills_db")]
+    return db[os.getenv("MONGO_COLLECTION", "bills_collection")], db[os.getenv("REGISTRY_COLLECTION", "ingested_documents")]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.backfill", description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="count unregistered chunks and untyped documents")
+    rn = sub.add_parser("run", help="register unregistered chunks and type or queue untyped documents")
+    rn.add_argument("--batch-size", type=int, default=500)
+    rn.add_argument("--head-chars", type=int, default=int(os.getenv("TAG_HEAD_CHARS", "4000")), help="text sent to the tagger")
+    args = parser.parse_args(argv)
+
+    collection, registry = _database()
+    if args.command == "status":
+        print(json.dumps(status(collection, registry), indent=2))
+        return 0
+    print(json.dumps(run(collection, registry, head_chars=args.head_chars, batch_size=args.batch_size), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""Coalescing of concurrent query embeddings into single provider calls."""
+import asyncio
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from .metrics import REGISTRY, current_trace
+
+BATCH_SIZE = REGISTRY.histogram(
+    "baai_embedding_batch_size",
+    "Query embeddings sent per coalesced provider call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+BATCH_WAIT_SECONDS = REGISTRY.histogram(
+    "baai_embedding_batch_wait_seconds",
+    "Delay a query embedding spent waiting for its batch to be sent",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+
+
+class EmbeddingBatcher(Embeddings):
+    """Collect ``aembed_query`` calls arriving within ``window_ms`` into one ``aembed_documents`` call.
+
+    A batch is sent when the window after its first query closes or when it
+    reaches ``max_batch`` texts, whichever comes first; identical texts in a
+    batch are embedded once. Document embeddings (already batched by the
+    caller) and the sync API go straight to the wrapped provider. A window of
+    0 disables coalescing.
+    """
+
+    def __init__(self, inner: Embeddings, window_ms: float = 5.0, max_batch: int = 64):
+        self.inner = inner
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        # (text, future, enqueued at) waiting for the next flush
+        self._pending: List[Tuple[str, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sending: Set[asyncio.Task] = set()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.inner.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.inner.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.window == 0:
+            return await self.inner.aembed_query(text)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        enqueued = time.perf_counter()
+        self._pending.append((text, future, enqueued))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        vector, sent_at = await future
+        t = current_trace()
+        if t is not None:
+            t.add("embed_queue", sent_at - enqueued)
+        return vector
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # keep a reference until done so the task is not garbage collected mid-flight
+            task = asyncio.ensure_future(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future, float]]) -> None:
+        sent_at = time.perf_counter()
+        texts: List[str] = []
+        positions: Dict[str, int] = {}
+        for text, _, enqueued in batch:
+            BATCH_WAIT_SECONDS.observe(sent_at - enqueued)
+            if text not in positions:
+                positions[text] = len(texts)
+                texts.append(text)
+        BATCH_SIZE.observe(len(texts))
+        try:
+            vectors = await self.inner.aembed_documents(texts)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for text, future, _ in batch:
+            if not future.done():
+                future.set_result((vectors[positions[text]], sent_at))
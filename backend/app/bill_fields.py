@@ -0,0 +1,118 @@
+"""Typed bill fields extracted at ingestion time, for aggregation without the LLM."""
+import re
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+
+# Added to the metadata tagger schema; none are required since not every document is a bill
+BILL_FIELDS_SCHEMA = {
+    "vendor": {"type": "string", "description": "Name of the company or person that issued the bill"},
+    "bill_date": {"type": "string", "description": "Date the bill was issued, as YYYY-MM-DD"},
+    "due_date": {"type": "string", "description": "Payment due date, as YYYY-MM-DD"},
+    "total_amount": {"type": "number", "description": "Total amount due, as a plain number without currency symbols"},
+    "currency": {"type": "string", "description": "ISO 4217 currency code of the total amount, e.g. USD or PHP"},
+    "account_number": {"type": "string", "description": "Customer or account number the bill is for"},
+}
+
+_DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%m/%d/%Y", "%d/%m/%Y", "%B %d, %Y", "%b %d, %Y", "%d %B %Y", "%d %b %Y")
+_CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "₱": "PHP", "¥": "JPY"}
+# Active ISO 4217 codes; anything else the tagger returns is not stored as a currency
+_ISO_CURRENCIES = frozenset(
+    """
+    AED AFN ALL AMD ANG AOA ARS AUD AWG AZN BAM BBD BDT BGN BHD BIF BMD BND BOB BRL BSD BTN BWP BYN BZD
+    CAD CDF CHF CLP CNY COP CRC CUP CVE CZK DJF DKK DOP DZD EGP ERN ETB EUR FJD FKP GBP GEL GHS GIP GMD
+    GNF GTQ GYD HKD HNL HTG HUF IDR ILS INR IQD IRR ISK JMD JOD JPY KES KGS KHR KMF KPW KRW KWD KYD KZT
+    LAK LBP LKR LRD LSL LYD MAD MDL MGA MKD MMK MNT MOP MRU MUR MVR MWK MXN MYR MZN NAD NGN NIO NOK NPR
+    NZD OMR PAB PEN PGK PHP PKR PLN PYG QAR RON RSD RUB RWF SAR SBD SCR SDG SEK SGD SHP SLE SOS SRD SSP
+    STN SVC SYP SZL THB TJS TMT TND TOP TRY TTD TWD TZS UAH UGX USD UYU UZS VES VND VUV WST XAF XCD XOF
+    XPF YER ZAR ZMW ZWL
+    """.split()
+)
+# Currency names the tagger may return instead of a code (lower-case, singular); bare names follow the symbols above
+_CURRENCY_NAMES = {
+    "dollar": "USD",
+    "us dollar": "USD",
+    "u.s. dollar": "USD",
+    "united states dollar": "USD",
+    "canadian dollar": "CAD",
+    "australian dollar": "AUD",
+    "singapore dollar": "SGD",
+    "hong kong dollar": "HKD",
+    "new zealand dollar": "NZD",
+    "euro": "EUR",
+    "pound": "GBP",
+    "pound sterling": "GBP",
+    "british pound": "GBP",
+    "peso": "PHP",
+    "philippine peso": "PHP",
+    "mexican peso": "MXN",
+    "yen": "JPY",
+    "japanese yen": "JPY",
+    "yuan": "CNY",
+    "renminbi": "CNY",
+    "rupee": "INR",
+    "indian rupee": "INR",
+    "swiss franc": "CHF",
+    "won": "KRW",
+    "south korean won": "KRW",
+}
+_NUMBER = re.compile(r"-?\d[\d,]*(?:\.\d+)?")
+
+
+def parse_date(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, datetime.min.time())
+    if not isinstance(value, str) or not value.strip():
+        return None
+    text = value.strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def parse_amount(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    match = _NUMBER.search(value)
+    return float(match.group(0).replace(",", "")) if match else None
+
+
+def parse_currency(value: Any, amount_text: Any = None) -> Optional[str]:
+    """ISO 4217 code from a code, symbol or currency name (else from the symbol in ``amount_text``); None if unknown."""
+    if isinstance(value, str) and value.strip():
+        text = value.strip()
+        if text in _CURRENCY_SYMBOLS:
+            return _CURRENCY_SYMBOLS[text]
+        if text.upper() in _ISO_CURRENCIES:
+            return text.upper()
+        name = " ".join(text.lower().split())
+        code = _CURRENCY_NAMES.get(name) or _CURRENCY_NAMES.get(name[:-1] if name.endswith("s") else name)
+        if code:
+            return code
+    if isinstance(amount_text, str):
+        for symbol, code in _CURRENCY_SYMBOLS.items():
+            if symbol in amount_text:
+                return code
+    return None
+
+
+def extract_bill_fields(tags: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn the tagger's raw output into typed, top-level bill fields (missing ones are omitted)."""
+    fields = {
+        "vendor": str(tags.get("vendor") or "").strip() or None,
+        "bill_date": parse_date(tags.get("bill_date")),
+        "due_date": parse_date(tags.get("due_date")),
+        "total_amount": parse_amount(tags.get("total_amount")),
+        "currency": parse_currency(tags.get("currency"), tags.get("total_amount")),
+        "account_number": str(tags["account_number"]).strip() if tags.get("account_number") else None,
+    }
+    return {k: v for k, v in fields.items() if v is not None}
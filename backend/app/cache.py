@@ -0,0 +1,418 @@
+"""Caches shared by the ingestion and query paths."""
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+from bson.binary import Binary
+from langchain_core.embeddings import Embeddings
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU mapping with a fixed number of entries."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max(0, max_entries)
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different copies of a text share a cache entry."""
+    return " ".join((text or "").split())
+
+
+class CachedEmbeddings(Embeddings):
+    """Content-addressed embedding cache in front of another ``Embeddings``.
+
+    Keys are a SHA-256 of the model name and the normalized text. Lookups go
+    to an in-memory LRU first, then to an optional MongoDB collection that
+    persists vectors across restarts and workers; only the remaining misses
+    are sent to the wrapped provider, in a single batch.
+
+    The async methods use ``async_collection`` (the same collection through an
+    async driver) for the persistent tier, and the provider's async API.
+    """
+
+    def __init__(
+        self,
+        inner: Embeddings,
+        model: str,
+        collection=None,
+        async_collection=None,
+        memory_entries: int = 10000,
+        persistent_entries: int = 200000,
+        trim_every: int = 500,
+    ):
+        self.inner = inner
+        self.model = model
+        self.memory = LRUCache(memory_entries)
+        self.collection = collection
+        self.async_collection = async_collection
+        self.persistent_entries = persistent_entries
+        self.trim_every = max(1, trim_every)
+        self._writes_since_trim = 0
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "persistent_evictions": 0,
+            "persistent_errors": 0,
+            "provider_calls": 0,
+            "provider_inputs": 0,
+        }
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += n
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["memory_entries"] = len(self.memory)
+        stats["memory_evictions"] = self.memory.evictions
+        lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["persistent_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    # --- persistent tier (best effort: failures only cost a provider call) ---
+    def _persistent_get(self, keys: List[str]) -> Dict[str, List[float]]:
+        if self.collection is None or not keys:
+            return {}
+        try:
+            found = {}
+            for d in self.collection.find({"_id": {"$in": keys}}, {"vector": 1}):
+                found[d["_id"]] = np.frombuffer(d["vector"], dtype=np.float32).tolist()
+            if found:
+                self.collection.update_many({"_id": {"$in": list(found)}}, {"$set": {"last_used": datetime.utcnow()}})
+            return found
+        except Exception:
+            self._count("persistent_errors")
+            return {}
+
+    def _persistent_put(self, items: Dict[str, List[float]]) -> None:
+        if self.collection is None or not items:
+            return
+        try:
+            self.collection.bulk_write(self._upserts(items), ordered=False)
+        except Exception:
+            self._count("persistent_errors")
+            return
+        if self._note_writes(len(items)):
+            self._trim()
+
+    def _upserts(self, items: Dict[str, List[float]]) -> List[UpdateOne]:
+        now = datetime.utcnow()
+        return [
+            UpdateOne(
+                {"_id": k},
+                {"$set": {"model": self.model, "vector": Binary(np.asarray(v, dtype=np.float32).tobytes()), "last_used": now}},
+                upsert=True,
+            )
+            for k, v in items.items()
+        ]
+
+    def _note_writes(self, n: int) -> bool:
+        """Count persistent writes; True when it is time to trim."""
+        with self._lock:
+            self._writes_since_trim += n
+            if self._writes_since_trim < self.trim_every:
+                return False
+            self._writes_since_trim = 0
+            return True
+
+    async def _apersistent_get(self, keys: List[str]) -> Dict[str, List[float]]:
+        if not keys:
+            return {}
+        if self.async_collection is None:
+            # no async driver configured: use the sync tier off the event loop
+            return await asyncio.to_thread(self._persistent_get, keys) if self.collection is not None else {}
+        try:
+            found = {}
+            async for d in self.async_collection.find({"_id": {"$in": keys}}, {"vector": 1}):
+                found[d["_id"]] = np.frombuffer(d["vector"], dtype=np.float32).tolist()
+            if found:
+                await self.async_collection.update_many(
+                    {"_id": {"$in": list(found)}}, {"$set": {"last_used": datetime.utcnow()}}
+                )
+            return found
+        except Exception:
+            self._count("persistent_errors")
+            return {}
+
+    async def _apersistent_put(self, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+        if self.async_collection is None:
+            if self.collection is not None:
+                await asyncio.to_thread(self._persistent_put, items)
+            return
+        try:
+            await self.async_collection.bulk_write(self._upserts(items), ordered=False)
+        except Exception:
+            self._count("persistent_errors")
+            return
+        if self._note_writes(len(items)) and self.collection is not None:
+            await asyncio.to_thread(self._trim)
+
+    def _trim(self) -> None:
+        """Evict the least recently used persistent entries above ``persistent_entries``."""
+        try:
+            excess = self.collection.estimated_document_count() - self.persistent_entries
+            if excess <= 0:
+                return
+            old = [d["_id"] for d in self.collection.find({}, {"_id": 1}).sort("last_used", ASCENDING).limit(excess)]
+            if old:
+                self.collection.delete_many({"_id": {"$in": old}})
+                self._count("persistent_evictions", len(old))
+        except Exception:
+            self._count("persistent_errors")
+
+    # --- Embeddings interface ---
+    def _memory_lookup(self, texts: List[str]):
+        """Return (vectors with gaps, positions missing from memory by key)."""
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        pending: Dict[str, List[int]] = {}
+        for i, t in enumerate(texts):
+            k = self.key(t)
+            v = self.memory.get(k)
+            if v is not None:
+                vectors[i] = list(v)
+                self._count("memory_hits")
+            else:
+                pending.setdefault(k, []).append(i)
+        return vectors, pending
+
+    def _lookup(self, texts: List[str]):
+        """Return (vectors with gaps, positions still missing by key, {key: text} to embed)."""
+        vectors, pending = self._memory_lookup(texts)
+        return self._apply_persisted(texts, vectors, pending, self._persistent_get(list(pending)))
+
+    async def _alookup(self, texts: List[str]):
+        vectors, pending = self._memory_lookup(texts)
+        return self._apply_persisted(texts, vectors, pending, await self._apersistent_get(list(pending)))
+
+    def _apply_persisted(self, texts: List[str], vectors, pending, persisted: Dict[str, List[float]]):
+        for k, v in persisted.items():
+            self.memory.put(k, v)
+            for i in pending.pop(k):
+                vectors[i] = list(v)
+                self._count("persistent_hits")
+        misses = {k: texts[idxs[0]] for k, idxs in pending.items()}
+        self._count("misses", sum(len(idxs) for idxs in pending.values()))
+        return vectors, pending, misses
+
+    def _fill_memory(self, vectors, pending, computed: Dict[str, List[float]]) -> List[List[float]]:
+        for k, v in computed.items():
+            self.memory.put(k, v)
+            for i in pending[k]:
+                vectors[i] = list(v)
+        return vectors
+
+    def _fill(self, vectors, pending, computed: Dict[str, List[float]]) -> List[List[float]]:
+        self._persistent_put(computed)
+        return self._fill_memory(vectors, pending, computed)
+
+    async def _afill(self, vectors, pending, computed: Dict[str, List[float]]) -> List[List[float]]:
+        await self._apersistent_put(computed)
+        return self._fill_memory(vectors, pending, computed)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, pending, misses = self._lookup(texts)
+        if not misses:
+            return vectors
+        miss_keys = list(misses)
+        self._count("provider_calls")
+        self._count("provider_inputs", len(miss_keys))
+        fresh = self.inner.embed_documents([misses[k] for k in miss_keys])
+        return self._fill(vectors, pending, dict(zip(miss_keys, fresh)))
+
+    def embed_query(self, text: str) -> List[float]:
+        vectors, pending, misses = self._lookup([text])
+        if not misses:
+            return vectors[0]
+        (k, t), = misses.items()
+        self._count("provider_calls")
+        self._count("provider_inputs")
+        return self._fill(vectors, pending, {k: self.inner.embed_query(t)})[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, pending, misses = await self._alookup(texts)
+        if not misses:
+            return vectors
+        miss_keys = list(misses)
+        self._count("provider_calls")
+        self._count("provider_inputs", len(miss_keys))
+        fresh = await self.inner.aembed_documents([misses[k] for k in miss_keys])
+        return await self._afill(vectors, pending, dict(zip(miss_keys, fresh)))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vectors, pending, misses = await self._alookup([text])
+        if not misses:
+            return vectors[0]
+        (k, t), = misses.items()
+        self._count("provider_calls")
+        self._count("provider_inputs")
+        return (await self._afill(vectors, pending, {k: await self.inner.aembed_query(t)}))[0]
+
+
+class AnswerCache:
+    """TTL + LRU cache of generated answers, invalidated wholesale by generation.
+
+    Keys combine the current generation, the normalized question, the ids of
+    the retrieved documents and ``top_k``. ``invalidate()`` starts a new
+    generation so answers computed against older data are never served.
+
+    Once ``attach(store, async_store)`` is given a MongoDB collection, the
+    generation is a counter document shared by every worker process: an
+    invalidation anywhere reaches the other workers on their next ``sync()``,
+    which reads the counter at most every ``sync_seconds``.
+    """
+
+    GENERATION_ID = "answer_cache_generation"
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600.0, sync_seconds: float = 1.0):
+        self._entries = LRUCache(max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.sync_seconds = sync_seconds
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._store = None
+        self._async_store = None
+        self._synced_at = float("-inf")
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "expired": 0, "invalidations": 0, "sync_errors": 0}
+
+    def attach(self, store, async_store) -> None:
+        """Share the generation through the MongoDB collection ``store`` (``async_store``: the same, async driver)."""
+        self._store = store
+        self._async_store = async_store
+        self._synced_at = float("-inf")
+
+    def key(self, question: str, doc_ids: List[Any], top_k: int) -> tuple:
+        return (self.generation, normalize_text(question).lower(), tuple(str(i) for i in doc_ids), top_k)
+
+    def get(self, key: tuple) -> Optional[str]:
+        entry = self._entries.get(key)
+        with self._lock:
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            answer, expires_at = entry
+            if time.monotonic() >= expires_at:
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return answer
+
+    def put(self, key: tuple, answer: str) -> None:
+        if key[0] != self.generation:
+            # computed against data that changed while the answer was generated
+            return
+        self._entries.put(key, (answer, time.monotonic() + self.ttl_seconds))
+
+    def _advance(self, shared: Optional[int], invalidated: bool) -> None:
+        """Move to the shared generation (or past ours on invalidation) and drop older answers."""
+        with self._lock:
+            generation = max(self.generation + int(invalidated), shared or 0)
+            if generation == self.generation:
+                return
+            self.generation = generation
+            if invalidated:
+                self.stats["invalidations"] += 1
+        self._entries.clear()
+
+    def _sync_error(self) -> None:
+        with self._lock:
+            self.stats["sync_errors"] += 1
+
+    @staticmethod
+    def _generation_of(record: Optional[Dict[str, Any]]) -> Optional[int]:
+        return record.get("generation") if record else None
+
+    def invalidate(self) -> None:
+        """Start a new generation here and, with a store, for every worker (blocking: call it off the event loop)."""
+        shared = None
+        if self._store is not None:
+            try:
+                shared = self._generation_of(
+                    self._store.find_one_and_update(
+                        {"_id": self.GENERATION_ID}, {"$inc": {"generation": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+                    )
+                )
+            except Exception:
+                self._sync_error()
+        self._advance(shared, True)
+
+    async def ainvalidate(self) -> None:
+        """``invalidate()`` for the event loop."""
+        shared = None
+        if self._async_store is not None:
+            try:
+                shared = self._generation_of(
+                    await self._async_store.find_one_and_update(
+                        {"_id": self.GENERATION_ID}, {"$inc": {"generation": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+                    )
+                )
+            except Exception:
+                self._sync_error()
+        self._advance(shared, True)
+
+    async def sync(self) -> None:
+        """Adopt invalidations made by other workers (reads the shared counter at most every ``sync_seconds``)."""
+        if self._async_store is None or time.monotonic() - self._synced_at < self.sync_seconds:
+            return
+        self._synced_at = time.monotonic()
+        try:
+            shared = self._generation_of(await self._async_store.find_one({"_id": self.GENERATION_ID}))
+        except Exception:
+            self._sync_error()
+            return
+        self._advance(shared, False)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["generation"] = self.generation
+        stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
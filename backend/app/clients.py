@@ -0,0 +1,126 @@
+"""Construction of the external clients (MongoDB, OpenAI) with explicit pool settings.
+
+LangChain's OpenAI integration is imported inside the builders so importing
+the app stays cheap; the clients are created by the app's lifespan handler.
+"""
+import os
+from typing import Any, Dict, Optional
+
+# MongoDB connection pool (per worker process)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+# HTTP keep-alive pool shared by the OpenAI embeddings and chat clients
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+# Retries of a failed OpenAI request (429, 5xx, connection errors), with jittered exponential backoff
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_BACKOFF_BASE_SECONDS = float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "0.5"))
+OPENAI_BACKOFF_MAX_SECONDS = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "30"))
+# Budgets of this worker's OpenAI traffic (0: only the limits OpenAI reports are honoured)
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "0"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "0"))
+# Share of the budgets ingestion/tagging leave free for queries
+OPENAI_BULK_RESERVE = float(os.getenv("OPENAI_BULK_RESERVE", "0.2"))
+# Requests awaiting a response at once (0: no cap) and waiting for admission before new ones are refused
+OPENAI_MAX_IN_FLIGHT = int(os.getenv("OPENAI_MAX_IN_FLIGHT", str(OPENAI_MAX_CONNECTIONS)))
+OPENAI_MAX_QUEUE = int(os.getenv("OPENAI_MAX_QUEUE", "256"))
+# How long a query's / an ingestion's OpenAI request may wait for admission before it is shed (503)
+OPENAI_QUERY_MAX_WAIT_SECONDS = float(os.getenv("OPENAI_QUERY_MAX_WAIT_SECONDS", "10"))
+OPENAI_BULK_MAX_WAIT_SECONDS = float(os.getenv("OPENAI_BULK_MAX_WAIT_SECONDS", "120"))
+
+
+def mongo_options() -> Dict[str, Any]:
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    }
+
+
+def mongo_client(uri: str):
+    from pymongo import MongoClient
+
+    return MongoClient(uri, **mongo_options())
+
+
+def async_mongo_client(uri: str):
+    """PyMongo's native asyncio client, for request handlers (the sync client serves worker threads)."""
+    from pymongo import AsyncMongoClient
+
+    return AsyncMongoClient(uri, **mongo_options())
+
+
+def openai_scheduler():
+    """The RateScheduler every OpenAI request of this worker goes through (see scheduler.py)."""
+    from .scheduler import BULK, INTERACTIVE, RateScheduler
+
+    return RateScheduler(
+        rpm=OPENAI_RPM,
+        tpm=OPENAI_TPM,
+        max_in_flight=OPENAI_MAX_IN_FLIGHT,
+        max_queue=OPENAI_MAX_QUEUE,
+        max_wait={INTERACTIVE: OPENAI_QUERY_MAX_WAIT_SECONDS, BULK: OPENAI_BULK_MAX_WAIT_SECONDS},
+        bulk_reserve=OPENAI_BULK_RESERVE,
+        max_retries=OPENAI_MAX_RETRIES,
+        backoff_base=OPENAI_BACKOFF_BASE_SECONDS,
+        backoff_max=OPENAI_BACKOFF_MAX_SECONDS,
+    )
+
+
+class OpenAIHttpClients:
+    """One sync and one async httpx client with bounded keep-alive pools, shared by all OpenAI clients.
+
+    Their transports send every request through ``scheduler`` (budgets,
+    priorities, retries), so the OpenAI SDK's own retries are turned off.
+    """
+
+    def __init__(self, scheduler=None):
+        import httpx
+
+        from .scheduler import AsyncScheduledTransport, ScheduledTransport
+
+        self.scheduler = scheduler or openai_scheduler()
+        limits = httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(OPENAI_TIMEOUT, connect=10.0)
+        self.sync = httpx.Client(transport=ScheduledTransport(httpx.HTTPTransport(limits=limits), self.scheduler), timeout=timeout)
+        self.async_ = httpx.AsyncClient(
+            transport=AsyncScheduledTransport(httpx.AsyncHTTPTransport(limits=limits), self.scheduler), timeout=timeout
+        )
+
+    def kwargs(self) -> Dict[str, Any]:
+        return {
+            "http_client": self.sync,
+            "http_async_client": self.async_,
+            "timeout": OPENAI_TIMEOUT,
+            "max_retries": 0,
+        }
+
+    async def aclose(self) -> None:
+        self.sync.close()
+        await self.async_.aclose()
+
+
+def openai_embeddings(model: str, batch_size: int, http: Optional[OpenAIHttpClients] = None):
+    from langchain_openai import OpenAIEmbeddings
+
+    return OpenAIEmbeddings(model=model, chunk_size=batch_size, **(http.kwargs() if http else {}))
+
+
+def chat_model(model: str, callbacks=None, http: Optional[OpenAIHttpClients] = None):
+    from langchain_openai import ChatOpenAI
+
+    # stream_usage reports token counts for streamed answers too
+    return ChatOpenAI(
+        temperature=0, model_name=model, stream_usage=True, callbacks=callbacks, **(http.kwargs() if http else {})
+    )
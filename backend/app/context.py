@@ -0,0 +1,312 @@
+"""Token-budgeted assembly of the LLM context from retrieved chunks.
+
+Retrieval returns a candidate pool larger than ``top_k``. From it, near-
+duplicate chunks are dropped, a diverse ``top_k`` is chosen with maximal
+marginal relevance (MMR) over the embeddings already in the vector index, and
+each chosen chunk is trimmed to the passages that share the most terms with
+the question until the token budget is spent.
+"""
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+import numpy as np
+
+from .fingerprint import normalize_for_hash
+from .lexical_index import tokenize as identifier_tokens
+from .logs import get_logger, log_event
+from .metrics import REGISTRY
+
+CONTEXT_TOKENS = REGISTRY.histogram(
+    "baai_context_tokens",
+    "Tokens of retrieved text placed in the prompt",
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768),
+)
+
+logger = get_logger("baai.context")
+
+_WORD = re.compile(r"[a-z0-9]+")
+_PARAGRAPH = re.compile(r"\n\s*\n")
+_SENTENCE = re.compile(r"(?<=[.!?;:])\s+|\n")
+_STOPWORDS = {
+    "the", "and", "for", "are", "was", "what", "which", "who", "whom", "this", "that", "these", "those",
+    "with", "from", "how", "much", "many", "when", "where", "why", "does", "did", "have", "has", "had",
+    "any", "all", "our", "your", "their", "there", "about", "into", "than", "then", "them", "they",
+    "can", "could", "should", "would", "will", "not", "but", "per", "its", "is", "of", "to", "in",
+}
+# separator between non-adjacent passages kept from one chunk
+ELLIPSIS = " [...] "
+
+
+class TokenCounter:
+    """Count and truncate text in the chat model's tokens (tiktoken).
+
+    ``load()`` reads the encoding, which may download its BPE file, so call
+    it off the event loop at startup; otherwise it is loaded on first use. If
+    tiktoken or its encoding file is unavailable (e.g. offline without a
+    cached file), counts fall back to ~4 characters per token.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self._encoding = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self) -> bool:
+        """Load the encoding now (blocking); True if exact counts are available."""
+        return self._get_encoding() is not None
+
+    def _get_encoding(self):
+        if self._loaded:
+            return self._encoding
+        with self._lock:
+            if self._loaded:
+                return self._encoding
+            try:
+                import tiktoken
+
+                try:
+                    self._encoding = tiktoken.encoding_for_model(self.model)
+                except KeyError:
+                    self._encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                log_event(logger, "tokenizer_unavailable", level=logging.WARNING, model=self.model, error=str(e))
+            self._loaded = True
+        return self._encoding
+
+    @property
+    def exact(self) -> bool:
+        return self._get_encoding() is not None
+
+    def count(self, text: str) -> int:
+        encoding = self._get_encoding()
+        if encoding is None:
+            return len(text) // 4 + 1 if text else 0
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Return the longest prefix of ``text`` that fits in ``max_tokens``."""
+        if max_tokens <= 0:
+            return ""
+        encoding = self._get_encoding()
+        if encoding is None:
+            return text[: max_tokens * 4]
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+@dataclass
+class Context:
+    """The chunks chosen for the prompt and the (possibly trimmed) text used for each."""
+
+    docs: List[Dict[str, Any]] = field(default_factory=list)
+    texts: List[str] = field(default_factory=list)
+    tokens: int = 0
+    budget: int = 0
+    candidates: int = 0
+    duplicates: int = 0
+    trimmed: int = 0
+
+    def render(self) -> str:
+        return "\n\n".join(f"{i + 1}. {text}" for i, text in enumerate(self.texts))
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "tokens": self.tokens,
+            "budget": self.budget,
+            "candidates": self.candidates,
+            "selected": len(self.docs),
+            "near_duplicates": self.duplicates,
+            "trimmed": self.trimmed,
+        }
+
+
+def question_terms(question: str) -> Set[str]:
+    """Content words and identifier tokens of the question, used to rank passages."""
+    words = {w for w in _WORD.findall((question or "").lower()) if len(w) >= 3 and w not in _STOPWORDS}
+    return words | identifier_tokens(question)
+
+
+def _passage_terms(passage: str) -> Set[str]:
+    return set(_WORD.findall(passage.lower())) | identifier_tokens(passage)
+
+
+def split_passages(text: str, counter: TokenCounter, max_tokens: int) -> List[str]:
+    """Split ``text`` into paragraphs, breaking paragraphs longer than ``max_tokens`` into sentence runs."""
+    passages: List[str] = []
+    for paragraph in _PARAGRAPH.split(text or ""):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if counter.count(paragraph) <= max_tokens:
+            passages.append(paragraph)
+            continue
+        run: List[str] = []
+        run_tokens = 0
+        for sentence in _SENTENCE.split(paragraph):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            tokens = counter.count(sentence)
+            if run and run_tokens + tokens > max_tokens:
+                passages.append(" ".join(run))
+                run, run_tokens = [], 0
+            run.append(sentence)
+            run_tokens += tokens
+        if run:
+            passages.append(" ".join(run))
+    return passages
+
+
+def mmr_order(query: Optional[np.ndarray], vectors: np.ndarray, k: int, lambda_: float) -> List[int]:
+    """Pick ``k`` row indices by maximal marginal relevance.
+
+    Each step takes the row maximizing ``lambda * sim(query, row) - (1 - lambda)
+    * max sim(row, picked)``. Rows are L2-normalized, so dot products are
+    cosines. Without a query vector, the rows' order stands in for relevance.
+    """
+    n = vectors.shape[0]
+    if n == 0:
+        return []
+    if query is not None:
+        q = np.asarray(query, dtype=np.float32).ravel()
+        q_norm = np.linalg.norm(q)
+        relevance = vectors @ (q / q_norm) if q_norm else np.zeros(n, dtype=np.float32)
+    else:
+        relevance = np.linspace(1.0, 0.0, n, dtype=np.float32)
+    similarity = vectors @ vectors.T
+    picked: List[int] = []
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(min(k, n)):
+        scores = lambda_ * relevance - (1 - lambda_) * (redundancy if picked else 0.0)
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return picked
+
+
+class ContextBuilder:
+    """Select and trim retrieved chunks to fit a token budget."""
+
+    def __init__(
+        self,
+        counter: TokenCounter,
+        max_tokens: int = 3000,
+        mmr_lambda: float = 0.7,
+        duplicate_similarity: float = 0.97,
+        passage_tokens: int = 120,
+        min_doc_tokens: int = 64,
+    ):
+        self.counter = counter
+        self.max_tokens = max_tokens
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_similarity = duplicate_similarity
+        self.passage_tokens = passage_tokens
+        self.min_doc_tokens = min_doc_tokens
+
+    def _drop_duplicates(self, docs: List[Dict[str, Any]], vectors: Optional[np.ndarray]) -> List[int]:
+        """Indices of ``docs`` to keep: the first of each normalized-text or near-identical-embedding group."""
+        keep: List[int] = []
+        seen_text: Set[str] = set()
+        for i, d in enumerate(docs):
+            key = normalize_for_hash(d.get("text") or "")
+            if key in seen_text:
+                continue
+            if vectors is not None and keep and float(np.max(vectors[keep] @ vectors[i])) >= self.duplicate_similarity:
+                continue
+            seen_text.add(key)
+            keep.append(i)
+        return keep
+
+    def _trim(self, text: str, terms: Set[str], max_tokens: int, used: Set[str]) -> str:
+        """Keep the passages of ``text`` that share the most terms with the question, in document order.
+
+        Passages sharing no term are only used when none does (then the chunk's
+        beginning is kept). Passages already placed in the context
+        (overlapping chunks repeat text) are skipped.
+        """
+        passages = split_passages(text, self.counter, min(self.passage_tokens, max_tokens))
+        ranked = []
+        for position, passage in enumerate(passages):
+            key = normalize_for_hash(passage)
+            if key in used:
+                continue
+            ranked.append((-len(terms & _passage_terms(passage)), position, passage, key))
+        ranked.sort()
+        if ranked and ranked[0][0] < 0:
+            ranked = [r for r in ranked if r[0] < 0]
+        chosen = []
+        remaining = max_tokens
+        for _, position, passage, key in ranked:
+            tokens = self.counter.count(passage) + (self.counter.count(ELLIPSIS) if chosen else 0)
+            if tokens <= remaining:
+                chosen.append((position, passage, key))
+                remaining -= tokens
+        if not chosen and ranked:
+            # a single passage bigger than the allowance: keep its beginning
+            _, position, passage, key = ranked[0]
+            chosen.append((position, self.counter.truncate(passage, max_tokens), key))
+        chosen.sort()
+        parts: List[str] = []
+        previous = None
+        for position, passage, key in chosen:
+            used.add(key)
+            if parts and position != previous + 1:
+                parts.append(ELLIPSIS)
+            elif parts:
+                parts.append("\n")
+            parts.append(passage)
+            previous = position
+        return "".join(parts)
+
+    def build(
+        self,
+        question: str,
+        docs: List[Dict[str, Any]],
+        top_k: int,
+        query: Optional[Sequence[float]] = None,
+        vectors: Optional[np.ndarray] = None,
+    ) -> Context:
+        """Build the context for ``question`` from ``docs`` (best first).
+
+        ``vectors`` are the normalized embeddings of ``docs`` (row per doc), or
+        None when some are not indexed; then MMR and embedding de-duplication
+        are skipped and retrieval order is kept.
+        """
+        ctx = Context(budget=self.max_tokens, candidates=len(docs))
+        keep = self._drop_duplicates(docs, vectors)
+        ctx.duplicates = len(docs) - len(keep)
+        if vectors is not None and len(keep) > top_k:
+            order = [keep[i] for i in mmr_order(query, vectors[keep], top_k, self.mmr_lambda)]
+        else:
+            order = keep[:top_k]
+        terms = question_terms(question)
+        used: Set[str] = set()
+        remaining = self.max_tokens
+        for n, i in enumerate(order):
+            if remaining < self.min_doc_tokens:
+                break
+            text = docs[i].get("text") or ""
+            # an even share of what is left, so later chunks are not starved by an early long one
+            allowance = max(self.min_doc_tokens, remaining // (len(order) - n))
+            tokens = self.counter.count(text)
+            if tokens > allowance:
+                text = self._trim(text, terms, allowance, used)
+                tokens = self.counter.count(text)
+                ctx.trimmed += 1
+            else:
+                used.update(normalize_for_hash(p) for p in split_passages(text, self.counter, self.passage_tokens))
+            if not text:
+                continue
+            ctx.docs.append(docs[i])
+            ctx.texts.append(text)
+            ctx.tokens += tokens
+            remaining -= tokens
+        CONTEXT_TOKENS.observe(ctx.tokens)
+        return ctx
@@ -0,0 +1,50 @@
+"""Content fingerprints used to skip documents and pages that were already ingested."""
+import hashlib
+import re
+
+
+# Running page markers ("Page 2 of 5") differ between otherwise identical pages
+_PAGE_MARKER = re.compile(r"\bpage\s+\d+(\s+of\s+\d+)?\b")
+
+
+def content_hash(data: bytes) -> str:
+    """SHA-256 of the raw uploaded bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def normalize_for_hash(text: str) -> str:
+    """Lower-case, drop page markers and collapse whitespace so near-duplicates hash equal."""
+    return " ".join(_PAGE_MARKER.sub(" ", (text or "").lower()).split())
+
+
+class TextFingerprint:
+    """Incremental normalized-text hash that also remembers which parts were already seen.
+
+    ``add(text)`` returns False for a part (page or chunk) whose normalized
+    text was already added, so callers can skip near-duplicates inside one
+    document; only new parts contribute to ``hexdigest()``.
+    """
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self._seen = set()
+
+    def add(self, text: str) -> bool:
+        normalized = normalize_for_hash(text)
+        key = hashlib.sha256(normalized.encode("utf-8")).digest()
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        self._hash.update(normalized.encode("utf-8"))
+        self._hash.update(b"\n")
+        return True
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    """Normalized-text hash of a whole text, as ``TextFingerprint`` gives for a single part."""
+    fp = TextFingerprint()
+    fp.add(text)
+    return fp.hexdigest()
@@ -0,0 +1,222 @@
+"""Background ingestion jobs run on a bounded worker pool.
+
+Job state is kept in memory by the worker process that runs the job and,
+once ``attach(store)`` is given a MongoDB collection, written through to it,
+so ``GET /api/jobs/{id}`` answers from any worker process.
+"""
+import asyncio
+import contextvars
+import threading
+import logging
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from .logs import get_logger, log_event
+
+logger = get_logger("baai.jobs")
+
+
+# Progress stages reported by the ingestion pipeline, in order
+STAGES = ("parsed", "tagged", "embedded", "stored")
+
+
+class QueueFull(Exception):
+    """Raised when the job queue already holds ``max_pending`` unfinished jobs and calls."""
+
+
+@dataclass
+class Job:
+    id: str
+    filename: Optional[str] = None
+    status: str = "queued"  # queued -> running -> done | failed
+    stage: Optional[str] = None  # last completed entry of STAGES
+    stages: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    updated_at: datetime = field(default_factory=datetime.utcnow)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_record(self) -> Dict[str, Any]:
+        """The job as a MongoDB document."""
+        return {
+            "_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "stages": list(self.stages),
+            "error": self.error,
+            "result": self.result,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "Job":
+        fields = {k: v for k, v in record.items() if k != "_id"}
+        return cls(id=record["_id"], **fields)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "stages": list(self.stages),
+            # a finished job may skip stages (e.g. "tagged" with deferred tagging)
+            "progress": 1.0 if self.status == "done" else len(self.stages) / len(STAGES),
+            "error": self.error,
+            "result": self.result,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class JobQueue:
+    """Run ingestion callables on a fixed-size thread pool and keep their status.
+
+    ``submit(fn, ...)`` calls ``fn(*args, progress=callback)`` on a worker;
+    ``callback(stage)`` records pipeline progress. The number of unfinished
+    jobs and ``run`` calls (of this process) is capped at ``max_pending``, and only the most
+    recent ``retain`` finished jobs are remembered in memory; with a store,
+    older ones are still found there until its TTL index expires them.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 100, retain: int = 1000):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self.max_pending = max_pending
+        self.retain = retain
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._store = None
+        # unfinished run() calls, and every unfinished future (jobs too) to wait for on shutdown
+        self._calls: Set[Future] = set()
+        self._futures: Set[Future] = set()
+
+    def attach(self, store) -> None:
+        """Write job state through to the MongoDB collection ``store`` (shared by every worker process)."""
+        self._store = store
+
+    def _save(self, record: Dict[str, Any]) -> None:
+        """Persist a job record (best effort: a failed write never fails the ingestion)."""
+        if self._store is None:
+            return
+        try:
+            self._store.replace_one({"_id": record["_id"]}, record, upsert=True)
+        except Exception as e:
+            log_event(logger, "job_save_failed", level=logging.WARNING, job_id=record["_id"], error=str(e))
+
+    def _update(self, job: Job, **changes: Any) -> None:
+        with self._lock:
+            for k, v in changes.items():
+                setattr(job, k, v)
+            job.updated_at = datetime.utcnow()
+            record = job.to_record()
+        self._save(record)
+
+    def _progress(self, job: Job, stage: str) -> None:
+        with self._lock:
+            job.stage = stage
+            if stage not in job.stages:
+                job.stages.append(stage)
+            job.updated_at = datetime.utcnow()
+            record = job.to_record()
+        self._save(record)
+
+    def _run(self, job: Job, fn: Callable[..., Dict[str, Any]], args: tuple) -> None:
+        self._update(job, status="running")
+        try:
+            result = fn(*args, progress=lambda stage: self._progress(job, stage))
+            self._update(job, status="done", result=result)
+        except Exception as e:
+            log_event(logger, "job_failed", job_id=job.id, source=job.filename, error=str(e))
+            self._update(job, status="failed", error=str(e))
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs beyond ``retain``. Caller holds the lock."""
+        finished = [jid for jid, j in self._jobs.items() if j.finished]
+        for jid in finished[: max(0, len(finished) - self.retain)]:
+            del self._jobs[jid]
+
+    def _pending(self) -> int:
+        """Unfinished jobs plus ``run`` calls. Caller holds the lock."""
+        jobs = sum(1 for j in self._jobs.values() if not j.finished)
+        return jobs + len(self._calls)
+
+    def _admit(self) -> None:
+        """Raise ``QueueFull`` at ``max_pending``. Caller holds the lock."""
+        if self._pending() >= self.max_pending:
+            raise QueueFull(f"{self.max_pending} ingestion jobs already pending")
+
+    def _untrack(self, future: Future) -> None:
+        with self._lock:
+            self._calls.discard(future)
+            self._futures.discard(future)
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending()
+
+    def submit(self, fn: Callable[..., Dict[str, Any]], *args: Any, filename: Optional[str] = None) -> Job:
+        """Queue a job; with a store this writes to MongoDB, so call it off the event loop."""
+        job = Job(id=uuid.uuid4().hex, filename=filename)
+        with self._lock:
+            self._admit()
+            self._prune()
+            self._jobs[job.id] = job
+            record = job.to_record()
+        # stored before it runs, so a poll that reaches another worker finds it
+        self._save(record)
+        future = self._executor.submit(self._run, job, fn, args)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._untrack)
+        return job
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run ``fn(*args)`` on the worker pool and await its result (no job record).
+
+        For ingestion requests that answer synchronously but must not hold a
+        thread of the web server's pool while they work. Counts against
+        ``max_pending`` like a job, so raises ``QueueFull`` too.
+        """
+        ctx = contextvars.copy_context()
+        with self._lock:
+            self._admit()
+            future = self._executor.submit(ctx.run, fn, *args)
+            self._calls.add(future)
+            self._futures.add(future)
+        future.add_done_callback(self._untrack)
+        return await asyncio.wrap_future(future)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """The job from this process's memory, else from the store (e.g. run by another worker)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or self._store is None:
+            return job
+        record = self._store.find_one({"_id": job_id})
+        return Job.from_record(record) if record is not None else None
+
+    def shutdown(self, timeout: float = 30.0) -> None:
+        """Drop queued work, wait up to ``timeout`` seconds for running work, and mark unfinished jobs failed.
+
+        Call it before closing the store's client, so the final job states are written.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            futures = list(self._futures)
+        _, running = wait(futures, timeout=timeout)
+        if running:
+            log_event(logger, "jobs_interrupted", level=logging.WARNING, running=len(running))
+        with self._lock:
+            unfinished = [j for j in self._jobs.values() if not j.finished]
+        for job in unfinished:
+            self._update(job, status="failed", error="interrupted by server shutdown")
@@ -0,0 +1,97 @@
+"""Lightweight inverted index of identifier-like tokens in chunk text.
+
+Only tokens that contain a digit (invoice, account and reference numbers,
+amounts, dates) are indexed, which keeps the postings small while making
+exact bill-number lookups answerable without an embedding call.
+"""
+import re
+import threading
+from typing import Any, Dict, Iterable, Optional, Set
+
+# Runs of letters/digits joined by common identifier separators
+_TOKEN = re.compile(r"[A-Za-z0-9]+(?:[-/.#_][A-Za-z0-9]+)*")
+_SEPARATORS = re.compile(r"[-/.#_]")
+
+
+def is_identifier(token: str) -> bool:
+    return any(ch.isdigit() for ch in token) and len(token) >= 3
+
+
+def tokenize(text: str) -> Set[str]:
+    """Return the normalized identifier tokens of ``text``.
+
+    Identifiers are lower-cased with their separators removed, so
+    ``INV-0042`` and ``inv0042`` are the same token.
+    """
+    tokens: Set[str] = set()
+    for match in _TOKEN.finditer(text or ""):
+        token = normalize_token(match.group(0))
+        if is_identifier(token):
+            tokens.add(token)
+    return tokens
+
+
+def normalize_token(token: str) -> str:
+    return _SEPARATORS.sub("", (token or "").strip().lower())
+
+
+class LexicalIndex:
+    """Map identifier tokens to the ids of the chunks that contain them."""
+
+    def __init__(self):
+        self._postings: Dict[str, Set[Any]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._postings)
+
+    def add(self, doc_id: Any, text: str) -> None:
+        tokens = tokenize(text)
+        with self._lock:
+            for token in tokens:
+                self._postings.setdefault(token, set()).add(doc_id)
+
+    def remove(self, doc_id: Any, text: str) -> None:
+        with self._lock:
+            for token in tokenize(text):
+                ids = self._postings.get(token)
+                if ids is not None:
+                    ids.discard(doc_id)
+                    if not ids:
+                        del self._postings[token]
+
+    def lookup(self, token: str) -> Set[Any]:
+        """Return the ids of chunks containing ``token`` (empty if it is not identifier-like)."""
+        with self._lock:
+            return set(self._postings.get(normalize_token(token), ()))
+
+    def lookup_all(self, tokens: Iterable[str]) -> Optional[Set[Any]]:
+        """Ids of chunks containing every one of ``tokens`` (None if ``tokens`` is empty)."""
+        result: Optional[Set[Any]] = None
+        for token in tokens:
+            ids = self.lookup(token)
+            result = ids if result is None else result & ids
+            if not result:
+                return set()
+        return result
+
+    def replace(self, postings: Dict[str, Set[Any]]) -> None:
+        with self._lock:
+            self._postings = postings
+
+    def replay(self, collection, query: Dict[str, Any], batch_size: int = 1000) -> int:
+        """Add the chunks matching ``query`` (already indexed ones are unaffected); returns how many were read."""
+        count = 0
+        for d in collection.find(query, {"text": 1}).batch_size(batch_size):
+            self.add(d["_id"], d.get("text") or "")
+            count += 1
+        return count
+
+    def load(self, collection, batch_size: int = 1000) -> int:
+        """Rebuild the postings from the ``text`` of every stored chunk."""
+        fresh = LexicalIndex()
+        for d in collection.find({}, {"text": 1}).batch_size(batch_size):
+            fresh.add(d["_id"], d.get("text") or "")
+        with self._lock:
+            self._postings = fresh._postings
+        return len(self._postings)
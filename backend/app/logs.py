@@ -0,0 +1,54 @@
+"""Structured (JSON lines) logging for the backend."""
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Any
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json (one object per line) | text (human readable, for local development)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+
+# attributes every LogRecord has; anything else was passed via ``extra``
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _RESERVED})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{k}={v}" for k, v in vars(record).items() if k not in _RESERVED)
+        line = f"{self.formatTime(record)} {record.levelname} {record.name} {record.getMessage()} {fields}".rstrip()
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def get_logger(name: str = "baai") -> logging.Logger:
+    """Return a logger that writes structured lines to stderr (configured once per name)."""
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        logger.addHandler(handler)
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = False
+    return logger
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, exc_info: Any = None, **fields: Any) -> None:
+    """Log ``event`` with ``fields`` as structured attributes."""
+    logger.log(level, event, extra=fields, exc_info=exc_info)
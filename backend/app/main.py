@@ -1,35 +1,64 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 import os
 import time
 import io
 import csv
+import asyncio
 import json
-from datetime import datetime
+import logging
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel, Field
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict, Any, Optional
-import os
-from datetime import datetime
-
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-from pymongo import MongoClient
-import numpy as np
-
-# LangChain imports (required)
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import MongoDBAtlasVectorSearch
-from langchain_community.document_transformers.openai_functions import create_metadata_tagger
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# LangChain imports (required); the OpenAI, community and splitter packages are heavy
+# and imported on first use instead (see clients.py, create_metadata_tagger, _splitter)
 from langchain_core.documents import Document
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-import uuid
-from pathlib import Path
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from starlette.concurrency import run_in_threadpool
+
+from .backfill import UNREGISTERED
+from .batching import EmbeddingBatcher
+from .bill_fields import BILL_FIELDS_SCHEMA, extract_bill_fields, parse_currency
+from .cache import AnswerCache, CachedEmbeddings
+from .context import Context, ContextBuilder, TokenCounter
+from .clients import OpenAIHttpClients, async_mongo_client, chat_model, mongo_client, openai_embeddings
+from .fingerprint import TextFingerprint, content_hash, text_hash
+from .jobs import JobQueue, QueueFull
+from .lexical_index import LexicalIndex, tokenize
+from .logs import get_logger, log_event
+from .metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    HTTP_REQUESTS,
+    HTTP_SECONDS,
+    INGESTED_CHUNKS,
+    INGESTED_DOCUMENTS,
+    REGISTRY as METRICS,
+    TokenUsageCallback,
+    collect_server_timing,
+    server_timing_header,
+    span,
+    timed_iter,
+    trace,
+)
+from .parsing import extract_pdf_pages, iter_pdf_pages
+from .scheduler import BULK, INTERACTIVE, Overloaded, overload_of, priority
+from .snapshot import build as build_snapshot, newer_than, open_snapshot, read_manifest
+from .tagging import TagBackfill, tag_texts
+from .quantization import FORMATS as EMBEDDING_FORMATS, WITHOUT_EMBEDDING_PROJECTION, decode_embedding, encode_embedding
+from .vector_index import VectorIndex
 
 
 # Load environment variables
@@ -39,31 +68,404 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MONGO_DB_URI = os.getenv("MONGO_DB_URI")
 DB_NAME = os.getenv("MONGO_DB", "bills_db")
 COLLECTION_NAME = os.getenv("MONGO_COLLECTION", "bills_collection")
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_CACHE_COLLECTION = os.getenv("EMBEDDING_CACHE_COLLECTION", "embedding_cache")
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "10000"))
+EMBEDDING_CACHE_PERSISTENT_ENTRIES = int(os.getenv("EMBEDDING_CACHE_PERSISTENT_ENTRIES", "200000"))
+ANSWER_CACHE_ENTRIES = int(os.getenv("ANSWER_CACHE_ENTRIES", "1000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+# The answer cache generation is shared by all workers through a counter document in this
+# collection; a worker reads it at most every ANSWER_CACHE_SYNC_SECONDS
+ANSWER_CACHE_COLLECTION = os.getenv("ANSWER_CACHE_COLLECTION", "answer_cache")
+ANSWER_CACHE_SYNC_SECONDS = float(os.getenv("ANSWER_CACHE_SYNC_SECONDS", "1"))
+# How new embeddings are stored in MongoDB: float (BSON array), float16 or int8 (packed BinData)
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "100"))
+# On shutdown, how long running ingestions may finish before they are marked failed
+INGEST_SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("INGEST_SHUTDOWN_TIMEOUT_SECONDS", "30"))
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", str(min(4, os.cpu_count() or 1))))
+# OpenAI allows up to 2048 inputs and ~300k tokens per embeddings request
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "512"))
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "250000"))
+# Query embeddings arriving within this window (or up to this many) share one provider call; 0 disables
+EMBED_COALESCE_WINDOW_MS = float(os.getenv("EMBED_COALESCE_WINDOW_MS", "5"))
+EMBED_COALESCE_MAX_BATCH = int(os.getenv("EMBED_COALESCE_MAX_BATCH", "64"))
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", "1000"))
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "150"))
+# How much of a document's leading text the metadata tagger sees
+TAG_HEAD_CHARS = int(os.getenv("TAG_HEAD_CHARS", "4000"))
+# inline: tag before embedding; deferred: store chunks right away and back-fill their tags in the background
+TAGGING_MODE = os.getenv("TAGGING_MODE", "inline")
+# Tagger completions in flight at once (batch ingestion and the back-fill)
+TAG_CONCURRENCY = int(os.getenv("TAG_CONCURRENCY", "4"))
+# Documents the back-fill claims per batch, and how often it polls for new ones
+TAG_BACKFILL_BATCH_SIZE = int(os.getenv("TAG_BACKFILL_BATCH_SIZE", "16"))
+TAG_BACKFILL_POLL_SECONDS = float(os.getenv("TAG_BACKFILL_POLL_SECONDS", "5"))
+TAG_MAX_ATTEMPTS = int(os.getenv("TAG_MAX_ATTEMPTS", "3"))
+REGISTRY_COLLECTION = os.getenv("REGISTRY_COLLECTION", "ingested_documents")
+# Ingestion job state shared by all workers (any worker answers /api/jobs/{id}); kept this long after the last update
+JOBS_COLLECTION = os.getenv("JOBS_COLLECTION", "ingest_jobs")
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+# A claim left "ingesting" longer than this (e.g. by a crashed worker) can be taken over
+INGEST_CLAIM_TTL_SECONDS = int(os.getenv("INGEST_CLAIM_TTL_SECONDS", "3600"))
+
+# Prime MongoDB and OpenAI connections before reporting ready (costs one embedding and one 1-token completion)
+WARMUP = os.getenv("WARMUP", "false").lower() in ("1", "true", "yes")
+LLM_MODEL = "gpt-4o-mini"
+# Prompt context: token budget for retrieved text, candidate pool (top_k x multiplier) for
+# near-duplicate removal and MMR diversity (lambda 1 = relevance only), passage size for trimming
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+CONTEXT_CANDIDATE_MULTIPLIER = int(os.getenv("CONTEXT_CANDIDATE_MULTIPLIER", "3"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+CONTEXT_DUPLICATE_SIMILARITY = float(os.getenv("CONTEXT_DUPLICATE_SIMILARITY", "0.97"))
+CONTEXT_PASSAGE_TOKENS = int(os.getenv("CONTEXT_PASSAGE_TOKENS", "120"))
+# Largest top_k a query may ask for (larger values are rejected with 422)
+QUERY_MAX_TOP_K = int(os.getenv("QUERY_MAX_TOP_K", "50"))
+# Characters of each source's text returned inline with an answer
+SOURCE_SNIPPET_CHARS = int(os.getenv("SOURCE_SNIPPET_CHARS", "300"))
+# Documents read per cursor batch (and written per response chunk) by /api/export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+# Memory-mapped index snapshot shared by all workers (python -m app.snapshot build); empty disables.
+# On startup only chunks newer than its high-water mark (less a safety margin) are read from MongoDB.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "")
+SNAPSHOT_REPLAY_MARGIN_SECONDS = float(os.getenv("SNAPSHOT_REPLAY_MARGIN_SECONDS", "300"))
+# Rebuild the snapshot from MongoDB after this many chunks were ingested by this worker (0: never)
+SNAPSHOT_REFRESH_ROWS = int(os.getenv("SNAPSHOT_REFRESH_ROWS", "0"))
+# Every INDEX_SYNC_SECONDS (0: never) a worker adds to its in-process indexes the chunks other
+# workers stored, reaching back INDEX_SYNC_MARGIN_SECONDS for inserts that finished late,
+# and attaches a newer snapshot when one was published
+INDEX_SYNC_SECONDS = float(os.getenv("INDEX_SYNC_SECONDS", "5"))
+INDEX_SYNC_MARGIN_SECONDS = float(os.getenv("INDEX_SYNC_MARGIN_SECONDS", "60"))
+# Score indexes at least this large on a worker thread instead of the event loop
+SEARCH_OFFLOAD_ROWS = int(os.getenv("SEARCH_OFFLOAD_ROWS", "20000"))
+
+logger = get_logger("baai")
+
+# External clients; created by init_clients() from the lifespan handler, not at import time.
+# Request handlers use the async client (aclient/acollection/aregistry); ingestion
+# worker threads use the sync one.
+client = None  # pymongo.MongoClient
+db = None
+collection = None
+# One entry per ingested document, holding its content fingerprints
+registry = None
+aclient = None  # pymongo.AsyncMongoClient
+acollection = None
+aregistry = None
+# Every embedding call (ingestion and query) goes through the content-addressed cache
+embeddings: Optional[CachedEmbeddings] = None
+llm = None  # ChatOpenAI
+_http_clients: Optional[OpenAIHttpClients] = None
+# Background tagging of documents ingested with TAGGING_MODE=deferred
+tag_backfill: Optional[TagBackfill] = None
+
+# Generated answers keyed on question + retrieved documents; a new generation starts on every ingest, in any worker
+answer_cache = AnswerCache(
+    max_entries=ANSWER_CACHE_ENTRIES, ttl_seconds=ANSWER_CACHE_TTL_SECONDS, sync_seconds=ANSWER_CACHE_SYNC_SECONDS
+)
+
+# In-process similarity index over the stored embeddings (loaded on startup, updated on ingest)
+vector_index = VectorIndex()
+# Identifier tokens (invoice/account numbers, ...) -> chunk ids, for exact-token filters and lookups
+lexical_index = LexicalIndex()
+
+# Fits the retrieved chunks into CONTEXT_MAX_TOKENS of the chat model's tokens
+token_counter = TokenCounter(LLM_MODEL)
+context_builder = ContextBuilder(
+    token_counter,
+    max_tokens=CONTEXT_MAX_TOKENS,
+    mmr_lambda=CONTEXT_MMR_LAMBDA,
+    duplicate_similarity=CONTEXT_DUPLICATE_SIMILARITY,
+    passage_tokens=CONTEXT_PASSAGE_TOKENS,
+)
+
+# Bounded worker pool for PDF ingestion so uploads never block the event loop
+ingest_jobs = JobQueue(max_workers=INGEST_WORKERS, max_pending=INGEST_MAX_PENDING)
+
+# Process pool for CPU-bound PDF parsing in batch ingestion (created on first use)
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = threading.Lock()
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # spawn: forking a process that already runs threads is not safe
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+
+def _reset_parse_pool(broken: ProcessPoolExecutor) -> None:
+    """Drop ``broken`` (a parse process died) so the next submit creates a fresh pool."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is broken:
+            _parse_pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit_parse(contents: bytes) -> Tuple[Optional[ProcessPoolExecutor], Future]:
+    """Start parsing ``contents`` on the pool; a submit failure is returned as the future's exception."""
+    for _ in range(2):
+        pool = _get_parse_pool()
+        try:
+            return pool, pool.submit(extract_pdf_pages, contents)
+        except BrokenProcessPool:
+            _reset_parse_pool(pool)
+        except Exception as e:
+            failed: Future = Future()
+            failed.set_exception(e)
+            return pool, failed
+    failed = Future()
+    failed.set_exception(BrokenProcessPool("PDF parsing pool is unavailable"))
+    return None, failed
+
+
+def _parse_result(contents: bytes, submitted: Tuple[Optional[ProcessPoolExecutor], Future]) -> List[Tuple[int, str]]:
+    """Pages parsed by ``_submit_parse``; when the pool broke (perhaps on another file), parse once more on a fresh one."""
+    pool, fut = submitted
+    try:
+        return fut.result()
+    except BrokenProcessPool:
+        if pool is None:
+            raise
+        _reset_parse_pool(pool)
+    pool, fut = _submit_parse(contents)
+    try:
+        return fut.result()
+    except BrokenProcessPool:
+        if pool is not None:
+            _reset_parse_pool(pool)  # this file crashes the parser
+        raise
+
+
+def check_config() -> None:
+    if not OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY is required in environment")
+    if not MONGO_DB_URI:
+        raise RuntimeError("MONGO_DB_URI is required in environment")
+    if EMBEDDING_STORAGE not in EMBEDDING_FORMATS:
+        raise RuntimeError(f"EMBEDDING_STORAGE must be one of {EMBEDDING_FORMATS}")
+    if TAGGING_MODE not in ("inline", "deferred"):
+        raise RuntimeError("TAGGING_MODE must be inline or deferred")
+
 
-if not OPENAI_API_KEY:
-    raise RuntimeError("OPENAI_API_KEY is required in environment")
-if not MONGO_DB_URI:
-    raise RuntimeError("MONGO_DB_URI is required in environment")
+def init_clients() -> None:
+    """Create the MongoDB and OpenAI clients (no network I/O yet; idempotent)."""
+    global client, db, collection, registry, aclient, acollection, aregistry, embeddings, llm, _http_clients, tag_backfill
+    if client is not None:
+        return
+    check_config()
+    _http_clients = OpenAIHttpClients()
+    client = mongo_client(MONGO_DB_URI)
+    db = client[DB_NAME]
+    collection = db[COLLECTION_NAME]
+    registry = db[REGISTRY_COLLECTION]
+    ingest_jobs.attach(db[JOBS_COLLECTION])
+    aclient = async_mongo_client(MONGO_DB_URI)
+    acollection = aclient[DB_NAME][COLLECTION_NAME]
+    answer_cache.attach(db[ANSWER_CACHE_COLLECTION], aclient[DB_NAME][ANSWER_CACHE_COLLECTION])
+    aregistry = aclient[DB_NAME][REGISTRY_COLLECTION]
+    # LangChain OpenAI embeddings will pick up OPENAI_API_KEY from env
+    embeddings = CachedEmbeddings(
+        # cache misses of concurrent queries are coalesced into one provider call
+        EmbeddingBatcher(
+            openai_embeddings(EMBEDDING_MODEL, EMBED_BATCH_SIZE, http=_http_clients),
+            window_ms=EMBED_COALESCE_WINDOW_MS,
+            max_batch=EMBED_COALESCE_MAX_BATCH,
+        ),
+        model=EMBEDDING_MODEL,
+        collection=db[EMBEDDING_CACHE_COLLECTION],
+        async_collection=aclient[DB_NAME][EMBEDDING_CACHE_COLLECTION],
+        memory_entries=EMBEDDING_CACHE_MEMORY_ENTRIES,
+        persistent_entries=EMBEDDING_CACHE_PERSISTENT_ENTRIES,
+    )
+    # the callback feeds the token counters of /api/metrics
+    llm = chat_model(LLM_MODEL, callbacks=[TokenUsageCallback()], http=_http_clients)
+    tag_backfill = TagBackfill(
+        aregistry,
+        _metadata_tagger,
+        _apply_tags,
+        batch_size=TAG_BACKFILL_BATCH_SIZE,
+        max_concurrency=TAG_CONCURRENCY,
+        max_attempts=TAG_MAX_ATTEMPTS,
+        poll_seconds=TAG_BACKFILL_POLL_SECONDS,
+    )
 
-# LangChain OpenAI embeddings will pick up OPENAI_API_KEY from env; create embeddings instance
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-llm = ChatOpenAI(temperature=0, model_name="gpt-4o-mini")
 
-# Simple MongoDB client
-client = MongoClient(MONGO_DB_URI)
-db = client[DB_NAME]
-collection = db[COLLECTION_NAME]
+async def close_clients() -> None:
+    global client
+    if _http_clients is not None:
+        await _http_clients.aclose()
+    if aclient is not None:
+        await aclient.close()
+    if client is not None:
+        client.close()
+        client = None
 
-app = FastAPI(title="light-streamlit-simple-backend")
+
+# Readiness of this worker: set once indexes exist and the in-process indexes are loaded
+_readiness: Dict[str, Any] = {"ready": False, "stage": "starting", "error": None}
+
+
+async def _warm_up() -> None:
+    """Open pooled connections to MongoDB and OpenAI on the async clients the request path uses (best effort)."""
+    await aclient.admin.command("ping")
+    await acollection.find_one({}, {"_id": 1})
+    # bypass the embedding cache so the request really reaches the provider
+    await embeddings.inner.aembed_query("warm-up")
+    await llm.ainvoke("ping", max_tokens=1)
+
+
+async def _prepare() -> None:
+    """Create indexes, load the in-process indexes and the tokenizer, optionally warm up, mark the worker ready, then keep its indexes in sync."""
+    try:
+        with trace("startup") as t:
+            _readiness["stage"] = "indexes"
+            with span("indexes"):
+                await run_in_threadpool(ensure_indexes)
+            _readiness["stage"] = "loading"
+            with span("load"):
+                # the tokenizer may download its encoding: load it here, not on the first query's event loop
+                await asyncio.gather(run_in_threadpool(load_vector_index), run_in_threadpool(token_counter.load))
+            if WARMUP:
+                _readiness["stage"] = "warmup"
+                with span("warmup"):
+                    try:
+                        await _warm_up()
+                    except Exception:
+                        log_event(logger, "warmup_failed", level=logging.WARNING, exc_info=True)
+    except Exception as e:
+        _readiness.update(stage="failed", error=str(e))
+        log_event(logger, "startup_failed", level=logging.ERROR, exc_info=True)
+        return
+    _readiness.update(ready=True, stage="ready")
+    log_event(logger, "ready", chunks=len(vector_index), timings_ms=t.timings_ms())
+    # also with inline tagging: it tags the existing documents queued by python -m app.backfill
+    tag_backfill.start()
+    if INDEX_SYNC_SECONDS > 0:
+        await _sync_indexes_periodically()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_clients()
+    # load in the background so liveness answers right away; readiness reports when done
+    preparing = asyncio.create_task(_prepare())
+    try:
+        yield
+    finally:
+        await run_in_threadpool(stop_ingest_jobs)
+        if not preparing.done():
+            preparing.cancel()
+        if tag_backfill is not None:
+            await tag_backfill.stop()
+        await close_clients()
+
+
+def require_ready() -> None:
+    """Dependency for endpoints that need the loaded indexes: 503 until the worker is ready."""
+    if not _readiness["ready"]:
+        raise HTTPException(status_code=503, detail=f"Worker is not ready ({_readiness['stage']})", headers={"Retry-After": "5"})
+
+
+app = FastAPI(title="light-streamlit-simple-backend", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost", "http://localhost:8501", "http://127.0.0.1", "http://127.0.0.1:8501"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
 
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """Count and time every request and report its stage spans in a ``Server-Timing`` header."""
+    started = time.perf_counter()
+    with collect_server_timing() as timings:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    # label by route template, not raw path, to keep the label set bounded
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    HTTP_REQUESTS.inc(method=request.method, route=route, status=str(response.status_code))
+    HTTP_SECONDS.observe(elapsed, method=request.method, route=route)
+    response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+    return response
+
+
+# Their OpenAI calls are admitted ahead of ingestion and tagging when the rate budgets are tight
+INTERACTIVE_ROUTES = {"/api/query", "/api/query/stream"}
+
+
+@app.middleware("http")
+async def prioritize_queries(request: Request, call_next):
+    """Run the OpenAI calls made while answering a query at interactive priority (see scheduler.py)."""
+    with priority(INTERACTIVE if request.url.path in INTERACTIVE_ROUTES else BULK):
+        return await call_next(request)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, exc: Overloaded):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": exc.retry_after_header})
+
+
+def _raise_if_overloaded(e: BaseException) -> None:
+    """Answer 503 with Retry-After when ``e`` comes from the OpenAI scheduler shedding load."""
+    overload = overload_of(e)
+    if overload is not None:
+        raise HTTPException(status_code=503, detail=str(overload), headers={"Retry-After": overload.retry_after_header})
+
+
+# Metadata the LLM tagger attaches to every ingested document; the bill fields are also
+# stored, typed, on the document's registry entry for /api/aggregate
+METADATA_SCHEMA = {
+    "properties": {
+        "title": {"type": "string"},
+        "keywords": {"type": "array", "items": {"type": "string"}},
+        "hasCode": {"type": "boolean"},
+        **BILL_FIELDS_SCHEMA,
+    },
+    "required": ["title", "keywords", "hasCode"],
+}
+
+
+_text_splitter = None
+
+
+def _splitter():
+    global _text_splitter
+    if _text_splitter is None:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        _text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return _text_splitter
+
+
+def create_metadata_tagger(metadata_schema: Dict[str, Any], llm):
+    """LangChain's OpenAI-functions metadata tagger (langchain_community is imported on first use)."""
+    from langchain_community.document_transformers.openai_functions import create_metadata_tagger as _create
+
+    return _create(metadata_schema=metadata_schema, llm=llm)
+
+
+_tagger = None
+_tagger_lock = threading.Lock()
+
+
+def _metadata_tagger():
+    """The metadata tagger, built once on first use and shared by every ingestion."""
+    global _tagger
+    with _tagger_lock:
+        if _tagger is None:
+            _tagger = create_metadata_tagger(metadata_schema=METADATA_SCHEMA, llm=llm)
+        return _tagger
+
+
 def chunk_text(text: str, chunk_size: int = 600, overlap: int = 50) -> List[str]:
     words = text.split()
     chunks = []
@@ -84,57 +486,458 @@ def _embed_query(text: str) -> List[float]:
         return embeddings.embed_documents([text])[0]
 
 
-def _cosine_similarity(a: List[float], b: List[float]) -> float:
-    a = np.array(a, dtype=float)
-    b = np.array(b, dtype=float)
-    if np.linalg.norm(a) == 0 or np.linalg.norm(b) == 0:
-        return 0.0
-    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+def _embed_batched(texts: List[str]) -> List[List[float]]:
+    """Embed ``texts`` in as few provider calls as the request limits allow.
+
+    Batches are capped both by input count (EMBED_BATCH_SIZE) and by an
+    approximate token count (EMBED_BATCH_TOKENS, ~4 characters per token).
+    """
+    vectors: List[List[float]] = []
+    batch: List[str] = []
+    batch_tokens = 0
+    for t in texts:
+        tokens = len(t) // 4 + 1
+        if batch and (len(batch) >= EMBED_BATCH_SIZE or batch_tokens + tokens > EMBED_BATCH_TOKENS):
+            vectors.extend(embeddings.embed_documents(batch))
+            batch, batch_tokens = [], 0
+        batch.append(t)
+        batch_tokens += tokens
+    if batch:
+        vectors.extend(embeddings.embed_documents(batch))
+    return vectors
+
+
+def _store_documents(docs: List[Document], progress: Callable[[str], None] = lambda stage: None) -> List[str]:
+    """Embed documents, insert them into MongoDB and add them to the in-process index.
+
+    Documents are stored in the same layout MongoDBAtlasVectorSearch uses
+    (``text``, ``embedding`` and the metadata as top-level fields), unless
+    EMBEDDING_STORAGE selects a packed float16/int8 format.
+    """
+    if not docs:
+        return []
+    texts = [d.page_content for d in docs]
+    with span("embed"):
+        vectors = _embed_batched(texts)
+    progress("embedded")
+    records = [
+        {"text": t, **encode_embedding(v, EMBEDDING_STORAGE), **(d.metadata or {})} for t, v, d in zip(texts, vectors, docs)
+    ]
+    inserted_ids: List[Any] = []
+    with span("insert"):
+        for start in range(0, len(records), INSERT_BATCH_SIZE):
+            inserted_ids.extend(collection.insert_many(records[start : start + INSERT_BATCH_SIZE], ordered=True).inserted_ids)
+    with span("index"):
+        vector_index.add(inserted_ids, vectors)
+        for doc_id, record in zip(inserted_ids, records):
+            lexical_index.add(doc_id, record["text"])
+    answer_cache.invalidate()
+    _maybe_refresh_snapshot(len(inserted_ids))
+    progress("stored")
+    return [str(i) for i in inserted_ids]
+
+
+def _doc_metadata(d: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the metadata of a stored document (nested ``metadata`` or the top-level fields)."""
+    if d.get("metadata"):
+        return d["metadata"]
+    return {k: v for k, v in d.items() if k not in ("_id", "text") and k not in WITHOUT_EMBEDDING_PROJECTION}
 
 
 class QueryIn(BaseModel):
     question: str
-    top_k: Optional[int] = 4
+    top_k: int = Field(4, ge=1, le=QUERY_MAX_TOP_K)
+    # Optional filters; only matching chunks are scored
+    source: Optional[str] = None  # source file name
+    date_from: Optional[date] = None  # ingestion date range, inclusive
+    date_to: Optional[date] = None
+    keywords: Optional[List[str]] = None  # any of the tagger keywords
+    tokens: Optional[List[str]] = None  # exact tokens that must all appear, e.g. invoice or account numbers
+
+
+# Answer when no chunk matches the query filters (the model is not called)
+NO_MATCH_ANSWER = "No documents match the given filters."
+
+
+def ensure_indexes():
+    registry.create_index([("content_hash", ASCENDING)], unique=True)
+    registry.create_index(
+        [("text_hash", ASCENDING)], unique=True, partialFilterExpression={"text_hash": {"$type": "string"}}
+    )
+    # typed bill fields for /api/aggregate
+    registry.create_index([("bill_date", ASCENDING)])
+    registry.create_index([("vendor", ASCENDING), ("bill_date", ASCENDING)])
+    registry.create_index([("due_date", ASCENDING)])
+    registry.create_index([("account_number", ASCENDING)])
+    collection.create_index([("fingerprint", ASCENDING)])
+    db[JOBS_COLLECTION].create_index([("updated_at", ASCENDING)], expireAfterSeconds=JOB_RETENTION_SECONDS)
+    # least-recently-used trimming of the persistent embedding cache
+    db[EMBEDDING_CACHE_COLLECTION].create_index([("last_used", ASCENDING)])
+    # metadata filters for /api/query (ingestion date ranges use the _id index)
+    collection.create_index([("source", ASCENDING)])
+    collection.create_index([("keywords", ASCENDING)])
+    # documents waiting for the deferred tagging back-fill
+    registry.create_index([("tagging", ASCENDING)], partialFilterExpression={"tagging": {"$type": "string"}})
+
+
+# What the in-process indexes hold: the newest chunk _id read from MongoDB, and the
+# snapshot version (manifest path) last opened
+_index_high_water: Optional[ObjectId] = None
+_snapshot_version: Optional[str] = None
+_index_sync_lock = threading.Lock()
+
+
+def _open_snapshot():
+    """The current snapshot if it is usable by this worker, else None (logged)."""
+    global _snapshot_version
+    snapshot = None
+    try:
+        with span("snapshot"):
+            snapshot = open_snapshot(SNAPSHOT_DIR)
+    except Exception:
+        log_event(logger, "snapshot_unusable", level=logging.WARNING, exc_info=True, directory=SNAPSHOT_DIR)
+    if snapshot is not None and snapshot.manifest.get("model") != EMBEDDING_MODEL:
+        log_event(logger, "snapshot_unusable", level=logging.WARNING, directory=SNAPSHOT_DIR, model=snapshot.manifest.get("model"))
+        snapshot = None
+    # an unusable version is not retried by every sync
+    manifest = read_manifest(SNAPSHOT_DIR)
+    _snapshot_version = manifest.get("path") if manifest else None
+    return snapshot
+
+
+def _attach_snapshot(snapshot) -> None:
+    """Serve the snapshot's rows and replay the chunks that may be newer than it from MongoDB."""
+    vector_index.attach(snapshot.ids, snapshot.vectors)
+    lexical_index.replace(snapshot.postings)
+    newer = snapshot.newer_filter(SNAPSHOT_REPLAY_MARGIN_SECONDS)
+    with span("replay"):
+        replayed = vector_index.replay(collection, newer)
+        lexical_index.replay(collection, newer)
+    log_event(
+        logger,
+        "snapshot_loaded",
+        directory=SNAPSHOT_DIR,
+        version=snapshot.manifest.get("path"),
+        rows=len(snapshot.ids),
+        high_water=snapshot.manifest.get("high_water"),
+        replayed=replayed,
+    )
+
+
+def _latest_id() -> Optional[ObjectId]:
+    last = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    return last["_id"] if last else None
+
+
+def load_vector_index():
+    """Fill the in-process indexes from the snapshot plus newer chunks when there is one, else from MongoDB."""
+    global _index_high_water
+    with _index_sync_lock:
+        # read first: chunks stored during the load are caught up by the next sync
+        _index_high_water = _latest_id()
+        snapshot = _open_snapshot() if SNAPSHOT_DIR else None
+        if snapshot is None:
+            vector_index.load(collection)
+            lexical_index.load(collection)
+        else:
+            _attach_snapshot(snapshot)
+
+
+def sync_indexes() -> int:
+    """Catch the in-process indexes up with MongoDB; returns how many chunks were added.
+
+    Attaches a snapshot published since the last one this worker opened, then
+    adds the chunks stored (e.g. by other workers) since the high-water mark.
+    Only their ids are read until one turns out to be missing here.
+    """
+    global _index_high_water
+    with _index_sync_lock:
+        if SNAPSHOT_DIR:
+            manifest = read_manifest(SNAPSHOT_DIR)
+            if manifest is not None and manifest.get("path") != _snapshot_version:
+                snapshot = _open_snapshot()
+                if snapshot is not None:
+                    _attach_snapshot(snapshot)
+        ids = [d["_id"] for d in collection.find(newer_than(_index_high_water, INDEX_SYNC_MARGIN_SECONDS), {"_id": 1})]
+        if not ids:
+            return 0
+        missing = [doc_id for doc_id in ids if doc_id not in vector_index]
+        added = 0
+        if missing:
+            query = {"_id": {"$in": missing}}
+            added = vector_index.replay(collection, query)
+            lexical_index.replay(collection, query)
+        if added:
+            log_event(logger, "index_synced", added=added, chunks=len(vector_index))
+        _index_high_water = max(ids + ([_index_high_water] if _index_high_water else []))
+        return added
+
+
+async def _sync_indexes_periodically() -> None:
+    while True:
+        await asyncio.sleep(INDEX_SYNC_SECONDS)
+        try:
+            await run_in_threadpool(sync_indexes)
+        except Exception:
+            log_event(logger, "index_sync_failed", level=logging.WARNING, exc_info=True)
+
+
+_snapshot_lock = threading.Lock()
+_rows_since_snapshot = 0
+
+
+def _maybe_refresh_snapshot(added: int) -> None:
+    """Count ingested chunks and, every SNAPSHOT_REFRESH_ROWS of them, rebuild the snapshot in the background."""
+    global _rows_since_snapshot
+    if not (SNAPSHOT_DIR and SNAPSHOT_REFRESH_ROWS > 0):
+        return
+    with _snapshot_lock:
+        _rows_since_snapshot += added
+        if _rows_since_snapshot < SNAPSHOT_REFRESH_ROWS:
+            return
+        _rows_since_snapshot = 0
+    threading.Thread(target=_write_snapshot, name="snapshot", daemon=True).start()
+
+
+_snapshot_writing = threading.Lock()
+
+
+def _write_snapshot() -> None:
+    if not _snapshot_writing.acquire(blocking=False):
+        return  # one is already being written; the next threshold triggers another
+    try:
+        started = time.perf_counter()
+        # built from MongoDB, not this worker's index: that one lacks other workers' chunks
+        manifest = build_snapshot(collection, SNAPSHOT_DIR, EMBEDDING_MODEL)
+        log_event(logger, "snapshot_written", version=manifest["path"], rows=manifest["rows"], seconds=round(time.perf_counter() - started, 3))
+    except Exception:
+        log_event(logger, "snapshot_failed", level=logging.ERROR, exc_info=True, directory=SNAPSHOT_DIR)
+    finally:
+        _snapshot_writing.release()
+
+
+def stop_ingest_jobs():
+    # running jobs still parse on the pool and write to MongoDB: stop the pool and the clients after them
+    ingest_jobs.shutdown(INGEST_SHUTDOWN_TIMEOUT_SECONDS)
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
 
 
 @app.get("/api/health")
+@app.get("/api/health/live")
 def health():
+    """Liveness: the process is up and serving requests."""
     return {"status": "ok"}
 
 
-@app.post("/api/ingest_text")
-def ingest_text(payload: Dict[str, Any]):
+@app.get("/api/health/ready")
+def ready():
+    """Readiness: clients are created and the in-process indexes are loaded (503 until then)."""
+    body = {"status": "ready" if _readiness["ready"] else "not_ready", "stage": _readiness["stage"], "chunks": len(vector_index)}
+    if _readiness["error"]:
+        body["error"] = _readiness["error"]
+    return JSONResponse(status_code=200 if _readiness["ready"] else 503, content=body)
+
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    return {"embeddings": embeddings.snapshot(), "answers": answer_cache.snapshot()}
+
+
+def _embedding_cache_counts():
+    stats = embeddings.snapshot()
+    return [({"cache": "embeddings", "result": r}, stats[r]) for r in ("memory_hits", "persistent_hits", "misses")]
+
+
+def _answer_cache_counts():
+    stats = answer_cache.snapshot()
+    return [({"cache": "answers", "result": r}, stats[r]) for r in ("hits", "misses")]
+
+
+METRICS.gauge(
+    "baai_cache_lookups_total",
+    "Cache lookups by result",
+    lambda: _embedding_cache_counts() + _answer_cache_counts(),
+    counter=True,
+)
+METRICS.gauge(
+    "baai_cache_hit_ratio",
+    "Cache hit rate since start",
+    lambda: [({"cache": "embeddings"}, embeddings.snapshot()["hit_rate"]), ({"cache": "answers"}, answer_cache.snapshot()["hit_rate"])],
+)
+METRICS.gauge(
+    "baai_embedding_provider_calls_total",
+    "Embedding requests sent to the provider (cache misses)",
+    lambda: [({}, embeddings.snapshot()["provider_calls"])],
+    counter=True,
+)
+METRICS.gauge(
+    "baai_embedding_provider_inputs_total",
+    "Texts sent to the embedding provider",
+    lambda: [({}, embeddings.snapshot()["provider_inputs"])],
+    counter=True,
+)
+METRICS.gauge("baai_ingest_jobs_pending", "Queued or running ingestion jobs", lambda: [({}, ingest_jobs.pending())])
+
+
+def _openai_scheduler_state(key: str):
+    if _http_clients is None:
+        return []
+    state = _http_clients.scheduler.snapshot()[key]
+    return [({"priority": p}, n) for p, n in state.items()] if isinstance(state, dict) else [({}, state)]
+
+
+METRICS.gauge("baai_openai_queue_depth", "OpenAI requests waiting for admission", lambda: _openai_scheduler_state("waiting"))
+METRICS.gauge("baai_openai_in_flight", "OpenAI requests awaiting a response", lambda: _openai_scheduler_state("in_flight"))
+METRICS.gauge(
+    "baai_openai_paused_seconds", "Time left before queued OpenAI requests resume after a rate limit", lambda: _openai_scheduler_state("paused_seconds")
+)
+METRICS.gauge("baai_vector_index_size", "Chunks in the in-process vector index", lambda: [({}, len(vector_index))])
+
+
+@app.get("/api/metrics")
+def metrics():
+    """Prometheus text-format metrics: stage/request latency histograms, token usage, cache hit rates."""
+    return Response(content=METRICS.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+def _claim_document(fingerprint: str, source: Optional[str], text_fingerprint: Optional[str] = None) -> Optional[Any]:
+    """Register a document before ingesting it; return its registry id, or None if it is already known.
+
+    The unique indexes on ``content_hash`` and ``text_hash`` make the claim
+    atomic, so concurrent uploads of the same bill ingest it only once.
+    """
+    entry = {"content_hash": fingerprint, "source": source, "status": "ingesting", "claimed_at": datetime.utcnow()}
+    if text_fingerprint:
+        entry["text_hash"] = text_fingerprint
+    for _ in range(2):
+        try:
+            return registry.insert_one(dict(entry)).inserted_id
+        except DuplicateKeyError:
+            # take over claims abandoned by a crashed worker, otherwise it is a duplicate
+            stale = registry.find_one_and_delete(
+                {
+                    "content_hash": fingerprint,
+                    "status": "ingesting",
+                    "claimed_at": {"$lt": datetime.utcfromtimestamp(time.time() - INGEST_CLAIM_TTL_SECONDS)},
+                }
+            )
+            if stale is None:
+                return None
+            _discard_chunks(fingerprint)
+    return None
+
+
+def _registered_whole_text(pages: List[Tuple[int, str]]) -> Optional[str]:
+    """The hash of a PDF's text taken as one part, if a registered document has that text hash, else None.
+
+    Texts from /api/ingest_text and documents stored before page-wise
+    ingestion (registered by ``python -m app.backfill``) are hashed that way.
+    """
+    whole = text_hash("\n\n".join(t for _, t in pages))
+    return whole if registry.find_one({"text_hash": whole}, {"_id": 1}) is not None else None
+
+
+def _set_text_fingerprint(registry_id: Any, text_fingerprint: str) -> bool:
+    """Record the normalized-text hash; False if another document already has the same text."""
+    try:
+        registry.update_one({"_id": registry_id}, {"$set": {"text_hash": text_fingerprint}})
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def _complete_document(
+    registry_id: Any,
+    chunk_count: int,
+    tags: Optional[Dict[str, Any]] = None,
+    tag_head: Optional[str] = None,
+    tag_exclude: Sequence[str] = (),
+) -> None:
+    """Mark a claimed document as ingested and store its typed bill fields.
+
+    With ``tag_head`` the document is not tagged yet: it is queued for the
+    back-fill, which tags that text and copies the tags onto the document's
+    chunks, except the fields in ``tag_exclude`` (metadata given at ingestion).
+    """
+    fields = extract_bill_fields(tags or {})
+    if tag_head is not None:
+        fields.update(tagging="pending", tag_head=tag_head)
+        if tag_exclude:
+            fields["tag_exclude"] = list(tag_exclude)
+    registry.update_one(
+        {"_id": registry_id},
+        {"$set": {"status": "done", "chunk_count": chunk_count, "ingested_at": datetime.utcnow(), **fields}},
+    )
+    if tag_head is not None and tag_backfill is not None:
+        tag_backfill.notify()
+
+
+async def _apply_tags(entry: Dict[str, Any], tags: Dict[str, Any]) -> Dict[str, Any]:
+    """Back-fill: copy a document's tags onto its stored chunks; returns its typed bill fields for the registry."""
+    exclude = set(entry.get("tag_exclude") or ())
+    chunk_tags = {k: v for k, v in tags.items() if k not in exclude}
+    if chunk_tags:
+        await acollection.update_many({"fingerprint": entry["content_hash"]}, {"$set": chunk_tags})
+        # cached answers carry the chunks' metadata
+        await answer_cache.ainvalidate()
+    return extract_bill_fields(tags)
+
+
+def _tagging_result() -> Dict[str, Any]:
+    """Extra field of an ingestion result: whether tags are still to come."""
+    return {"tagging": "pending"} if TAGGING_MODE == "deferred" else {}
+
+
+def _discard_chunks(fingerprint: str) -> None:
+    chunks = list(collection.find({"fingerprint": fingerprint}, {"_id": 1, "text": 1}))
+    chunk_ids = [d["_id"] for d in chunks]
+    if chunk_ids:
+        collection.delete_many({"_id": {"$in": chunk_ids}})
+        vector_index.discard(chunk_ids)
+        for d in chunks:
+            lexical_index.remove(d["_id"], d.get("text") or "")
+        answer_cache.invalidate()
+
+
+def _release_document(registry_id: Any, fingerprint: str) -> None:
+    """Undo a claim: remove any chunks stored under it and its registry entry."""
+    _discard_chunks(fingerprint)
+    registry.delete_one({"_id": registry_id})
+
+
+def _already_ingested(fingerprint: Optional[str] = None, text_fingerprint: Optional[str] = None) -> Dict[str, Any]:
+    """Result for a duplicate upload: the registry entry with the same bytes or the same normalized text."""
+    clauses = [{"content_hash": fingerprint}] if fingerprint else []
+    if text_fingerprint:
+        clauses.append({"text_hash": text_fingerprint})
+    existing = registry.find_one({"$or": clauses}, {"_id": 1}) if clauses else None
+    return {
+        "status": "already_ingested",
+        "inserted_count": 0,
+        "ids": [],
+        "document_id": str(existing["_id"]) if existing else None,
+    }
+
+
+@app.post("/api/ingest_text", dependencies=[Depends(require_ready)])
+async def ingest_text(payload: Dict[str, Any]):
     """Ingest a plain text document (JSON {text, metadata}). Splits into chunks, embeds, and stores them."""
     try:
         text = payload.get("text")
         metadata = payload.get("metadata", {})
         if not text:
             raise HTTPException(status_code=400, detail="text is required")
-        # Use LangChain-only ingestion: transform, split, embed, and store in MongoDB vectorstore
+        # Use LangChain-only ingestion: transform, split, embed, and store in MongoDB vectorstore.
+        # Runs on the ingestion workers so it never holds a thread the query path needs.
         try:
-            doc = Document(page_content=text, metadata=metadata or {})
-            if len(doc.page_content.split()) <= 20:
-                return {"inserted_count": 0, "ids": []}
-
-            splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=150)
-
-            schema = {
-                "properties": {
-                    "title": {"type": "string"},
-                    "keywords": {"type": "array", "items": {"type": "string"}},
-                    "hasCode": {"type": "boolean"},
-                },
-                "required": ["title", "keywords", "hasCode"],
-            }
-
-            document_transformer = create_metadata_tagger(metadata_schema=schema, llm=llm)
-            transformed_docs = document_transformer.transform_documents([doc])
-            split_docs = splitter.split_documents(transformed_docs)
-
-            # Use LangChain OpenAIEmbeddings and MongoDB vectorstore
-            vectorstore = MongoDBAtlasVectorSearch.from_documents(split_docs, embeddings, collection=collection)
-            return {"inserted_count": len(split_docs), "ids": []}
+            return await ingest_jobs.run(_ingest_text_document, text, metadata or {})
+        except QueueFull as e:
+            raise HTTPException(status_code=503, detail=f"Ingestion queue is full, retry later ({e})")
         except Exception as e:
+            INGESTED_DOCUMENTS.inc(operation="ingest_text", outcome="failed")
+            log_event(logger, "ingest_text_failed", level=logging.ERROR, exc_info=True, source=(metadata or {}).get("source"))
+            _raise_if_overloaded(e)
             raise HTTPException(status_code=500, detail=f"Ingestion failed: {e}")
     except HTTPException:
         raise
@@ -142,107 +945,808 @@ def ingest_text(payload: Dict[str, Any]):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/ingest_pdf")
+def _ingest_text_document(text: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    with trace("ingest_text") as t:
+        doc = Document(page_content=text, metadata=metadata)
+        if len(doc.page_content.split()) <= 20:
+            INGESTED_DOCUMENTS.inc(operation="ingest_text", outcome="too_short")
+            return {"inserted_count": 0, "ids": []}
+
+        # Skip documents that were already ingested (same bytes or same normalized text)
+        fingerprint = content_hash(text.encode("utf-8"))
+        text_fingerprint = text_hash(text)
+        with span("claim"):
+            registry_id = _claim_document(fingerprint, metadata.get("source"), text_fingerprint)
+        if registry_id is None:
+            INGESTED_DOCUMENTS.inc(operation="ingest_text", outcome="duplicate")
+            return _already_ingested(fingerprint, text_fingerprint)
+        head = text[:TAG_HEAD_CHARS]
+        tags = None
+        try:
+            if TAGGING_MODE == "inline":
+                tags = _tag_texts([head])[0]
+                # metadata given with the document wins over the tagger's
+                doc.metadata = {**tags, **metadata}
+            with span("split"):
+                chunk_fp = TextFingerprint()
+                split_docs = [d for d in _splitter().split_documents([doc]) if chunk_fp.add(d.page_content)]
+            for d in split_docs:
+                d.metadata["fingerprint"] = fingerprint
+
+            # Embed with LangChain OpenAIEmbeddings and store in MongoDB + the in-process index
+            ids = _store_documents(split_docs)
+        except Exception:
+            _release_document(registry_id, fingerprint)
+            raise
+        if tags is None:
+            _complete_document(registry_id, len(ids), tag_head=head, tag_exclude=list(metadata))
+        else:
+            _complete_document(registry_id, len(ids), {**tags, **metadata})
+    INGESTED_DOCUMENTS.inc(operation="ingest_text", outcome="ingested")
+    INGESTED_CHUNKS.inc(len(ids), operation="ingest_text")
+    log_event(logger, "ingest_text", source=metadata.get("source"), chunks=len(ids), timings_ms=t.timings_ms())
+    return {"inserted_count": len(ids), "ids": ids, **_tagging_result()}
+
+
+def _tag_texts(texts: List[str]) -> List[Dict[str, Any]]:
+    """Run the metadata tagger over ``texts`` (TAG_CONCURRENCY at a time) and return the extracted metadata for each."""
+    with span("tag"):
+        return tag_texts(_metadata_tagger(), texts, TAG_CONCURRENCY)
+
+
+def _page_chunks(page_number: int, text: str, source: str, fingerprint: str) -> List[Document]:
+    """Split one page into chunks carrying ``source``, ``page`` and document ``fingerprint`` metadata."""
+    return [
+        Document(
+            page_content=chunk,
+            metadata={"source": source, "page": page_number, "chunk": i, "fingerprint": fingerprint},
+        )
+        for i, chunk in enumerate(_splitter().split_text(text))
+    ]
+
+
+def _ingest_pdf_bytes(contents: bytes, filename: str, progress: Callable[[str], None] = lambda stage: None) -> Dict[str, Any]:
+    """Parse, tag, chunk, embed and store one in-memory PDF. Runs on an ingestion worker thread.
+
+    The pages' text is extracted first, so a document whose bytes or
+    normalized text were already ingested is skipped before any tagger or
+    embedding call; repeated pages and chunks within the document are
+    skipped too. Chunks are flushed to storage in EMBED_BATCH_SIZE batches,
+    so memory is bounded by the text plus one batch rather than by every
+    chunk and vector. The whole document is tagged once, from its first
+    TAG_HEAD_CHARS characters, and the tags are copied onto every chunk.
+    """
+    with trace("ingest_pdf") as t:
+        result, outcome = _ingest_pdf_traced(contents, filename, progress)
+    INGESTED_DOCUMENTS.inc(operation="ingest_pdf", outcome=outcome)
+    INGESTED_CHUNKS.inc(result["inserted_count"], operation="ingest_pdf")
+    log_event(
+        logger,
+        "ingest_pdf",
+        source=filename,
+        outcome=outcome,
+        chunks=result["inserted_count"],
+        bytes=len(contents),
+        timings_ms=t.timings_ms(),
+    )
+    return result
+
+
+def _ingest_pdf_traced(contents: bytes, filename: str, progress: Callable[[str], None]) -> Tuple[Dict[str, Any], str]:
+    """Body of ``_ingest_pdf_bytes``; returns (result, outcome for the metrics)."""
+    fingerprint = content_hash(contents)
+    with span("claim"):
+        registry_id = _claim_document(fingerprint, filename)
+    if registry_id is None:
+        return _already_ingested(fingerprint), "duplicate"
+    try:
+        pages, text_fingerprint = _parse_pdf_pages(contents)
+        progress("parsed")
+        if text_fingerprint is None:
+            # too little text to ingest
+            _release_document(registry_id, fingerprint)
+            return {"inserted_count": 0, "ids": []}, "too_short"
+        known = _registered_whole_text(pages)
+        if known is not None or not _set_text_fingerprint(registry_id, text_fingerprint):
+            # same text as a document that was already ingested from different bytes: skip before tagging/embedding
+            _release_document(registry_id, fingerprint)
+            return _already_ingested(text_fingerprint=known or text_fingerprint), "duplicate"
+        ids, tags, head = _ingest_pdf_pages(pages, filename, fingerprint, progress)
+    except Exception:
+        INGESTED_DOCUMENTS.inc(operation="ingest_pdf", outcome="failed")
+        log_event(logger, "ingest_pdf_failed", level=logging.ERROR, exc_info=True, source=filename)
+        _release_document(registry_id, fingerprint)
+        raise
+    if tags is None:
+        _complete_document(registry_id, len(ids), tag_head=head)
+    else:
+        _complete_document(registry_id, len(ids), tags)
+    return {"inserted_count": len(ids), "ids": ids, **_tagging_result()}, "ingested"
+
+
+def _parse_pdf_pages(contents: bytes) -> Tuple[List[Tuple[int, str]], Optional[str]]:
+    """Extract the text of one PDF's pages, without blank and repeated pages.
+
+    Returns (pages, normalized-text hash or None if the document is too short).
+    """
+    pages: List[Tuple[int, str]] = []
+    total_words = 0
+    page_fp = TextFingerprint()
+    for page_number, text in timed_iter(iter_pdf_pages(contents), "parse"):
+        if not text.split() or not page_fp.add(text):
+            # blank page, or a repeat of an earlier page
+            continue
+        total_words += len(text.split())
+        pages.append((page_number, text))
+    return pages, page_fp.hexdigest() if total_words > 20 else None
+
+
+def _ingest_pdf_pages(
+    pages: List[Tuple[int, str]], filename: str, fingerprint: str, progress: Callable[[str], None]
+) -> Tuple[List[str], Optional[Dict[str, Any]], str]:
+    """Tag, chunk, embed and store the parsed pages of one PDF, EMBED_BATCH_SIZE chunks at a time.
+
+    Returns (ids, tagger metadata or None when tagging is deferred, the text to tag).
+    """
+    head = "\n\n".join(t for _, t in pages)[:TAG_HEAD_CHARS]
+    deferred = TAGGING_MODE == "deferred"
+    # deferred: chunks are stored untagged right away
+    tags: Dict[str, Any] = {} if deferred else _tag_texts([head])[0]
+    if not deferred:
+        progress("tagged")
+    pending: List[Document] = []
+    ids: List[str] = []
+    chunk_fp = TextFingerprint()
+
+    def flush():
+        nonlocal pending
+        for d in pending:
+            d.metadata = {**tags, **d.metadata}
+        ids.extend(_store_documents(pending, progress=progress))
+        pending = []
+
+    for page_number, text in pages:
+        with span("split"):
+            pending.extend(c for c in _page_chunks(page_number, text, filename, fingerprint) if chunk_fp.add(c.page_content))
+        if len(pending) >= EMBED_BATCH_SIZE:
+            flush()
+    if pending:
+        flush()
+    return ids, None if deferred else tags, head
+
+
+@app.post("/api/ingest_pdf", status_code=202, dependencies=[Depends(require_ready)])
 async def ingest_pdf(file: UploadFile = File(...)):
-    if PyPDFLoader is None:
-        raise HTTPException(status_code=500, detail="PyPDF2 not installed on server")
+    """Queue a PDF for ingestion and return its job right away; poll /api/jobs/{job_id} for progress.
+
+    A PDF whose bytes were already ingested is answered immediately with
+    ``status: already_ingested`` and no job.
+    """
+    contents = await file.read()
+    fingerprint = content_hash(contents)
+    known = await aregistry.find_one({"content_hash": fingerprint, "status": "done"}, {"_id": 1})
+    if known is not None:
+        return JSONResponse(status_code=200, content={**_already_ingested(), "document_id": str(known["_id"])})
     try:
-        contents = await file.read()
-        # Use LangChain-only ingestion for PDFs
-        try:
-            # Save uploaded PDF into a server uploads directory and load it from there
-            uploads_dir = Path(__file__).resolve().parent.parent / "uploads"
-            uploads_dir.mkdir(parents=True, exist_ok=True)
-            out_name = f"ingest_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex}.pdf"
-            tmp_path = uploads_dir / out_name
-            tmp_path.write_bytes(contents)
-
-            # Load and process the saved PDF; ensure the uploaded file is removed afterwards
-            try:
-                loader = PyPDFLoader(str(tmp_path))
-                pages = loader.load()
-
-                # Combine all page text into a single document (embed whole PDF)
-                full_text_parts = [p.page_content for p in pages if (p.page_content and len(p.page_content.split()) > 0)]
-                full_text = "\n\n".join(full_text_parts).strip()
-                if len(full_text.split()) <= 20:
-                    return {"inserted_count": 0, "ids": []}
-
-                schema = {
-                    "properties": {
-                        "title": {"type": "string"},
-                        "keywords": {"type": "array", "items": {"type": "string"}},
-                        "hasCode": {"type": "boolean"},
-                    },
-                    "required": ["title", "keywords", "hasCode"],
-                }
+        job = await run_in_threadpool(ingest_jobs.submit, _ingest_pdf_bytes, contents, file.filename, filename=file.filename)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Ingestion queue is full, retry later ({e})")
+    return job.to_dict()
+
 
-                document_transformer = create_metadata_tagger(metadata_schema=schema, llm=llm)
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job.to_dict()
 
-                # Create a single Document containing the whole PDF text and tag it
-                whole_doc = Document(page_content=full_text, metadata={"source": file.filename})
-                docs = document_transformer.transform_documents([whole_doc])
 
-                # Store the single whole-document into MongoDB vectorstore
-                vectorstore = MongoDBAtlasVectorSearch.from_documents(docs, embeddings, collection=collection)
+@app.get("/api/tagging")
+async def tagging_progress():
+    """Deferred tagging progress: documents pending, running, done and failed, plus this worker's back-fill counters."""
+    return {"mode": TAGGING_MODE, **await tag_backfill.progress()}
 
-                return {"inserted_count": len(docs), "ids": []}
-            finally:
-                # cleanup: remove the uploaded file from disk
-                try:
-                    if tmp_path and tmp_path.exists():
-                        tmp_path.unlink()
-                except Exception:
-                    # swallow cleanup errors; nothing further to do
-                    pass
+
+def _ingest_pdf_batch(uploads: List[tuple]) -> List[Dict[str, Any]]:
+    """Ingest many ``(filename, contents)`` PDFs together.
+
+    PDFs are parsed in parallel on the process pool, then every file is
+    tagged and split into page chunks, and all chunks are embedded in large
+    batches and written with bulk inserts. Returns one result per file, in upload order.
+    """
+    futures = [_submit_parse(contents) for _, contents in uploads]
+
+    results: List[Dict[str, Any]] = []
+    file_chunks: List[List[Document]] = []
+    heads: List[str] = []
+    owners: List[int] = []  # index into results for every entry of file_chunks
+    claims: List[tuple] = []  # (registry_id, fingerprint) for every entry of file_chunks
+    for (filename, contents), submitted in zip(uploads, futures):
+        result = {"filename": filename, "inserted_count": 0, "ids": [], "error": None}
+        results.append(result)
+        fingerprint = content_hash(contents)
+        registry_id = _claim_document(fingerprint, filename)
+        if registry_id is None:
+            result.update(_already_ingested(fingerprint))
+            continue
+        try:
+            page_fp = TextFingerprint()
+            with span("parse"):
+                parsed = _parse_result(contents, submitted)
+            pages = [(n, t) for n, t in parsed if t.split() and page_fp.add(t)]
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"PDF ingestion failed: {e}")
+            _release_document(registry_id, fingerprint)
+            result["error"] = f"PDF parsing failed: {e}"
+            continue
+        if sum(len(t.split()) for _, t in pages) <= 20:
+            _release_document(registry_id, fingerprint)
+            continue
+        known = _registered_whole_text(pages)
+        if known is not None or not _set_text_fingerprint(registry_id, page_fp.hexdigest()):
+            _release_document(registry_id, fingerprint)
+            result.update(_already_ingested(text_fingerprint=known or page_fp.hexdigest()))
+            continue
+        chunk_fp = TextFingerprint()
+        chunks: List[Document] = []
+        with span("split"):
+            for page_number, text in pages:
+                chunks.extend(c for c in _page_chunks(page_number, text, filename, fingerprint) if chunk_fp.add(c.page_content))
+        file_chunks.append(chunks)
+        heads.append("\n\n".join(t for _, t in pages)[:TAG_HEAD_CHARS])
+        owners.append(len(results) - 1)
+        claims.append((registry_id, fingerprint))
+
+    if not file_chunks:
+        return results
+    deferred = TAGGING_MODE == "deferred"
+    try:
+        # deferred: stored untagged, the back-fill tags the heads later
+        file_tags = [{} for _ in heads] if deferred else _tag_texts(heads)
+        for tags, chunks in zip(file_tags, file_chunks):
+            for d in chunks:
+                d.metadata = {**tags, **d.metadata}
+        ids = _store_documents([d for chunks in file_chunks for d in chunks])
     except Exception as e:
-        print(e)
-        raise HTTPException(status_code=500, detail=str(e))
+        for i, (registry_id, fingerprint) in zip(owners, claims):
+            _release_document(registry_id, fingerprint)
+            results[i]["error"] = f"PDF ingestion failed: {e}"
+        return results
+    pos = 0
+    for owner, chunks, tags, head, (registry_id, _) in zip(owners, file_chunks, file_tags, heads, claims):
+        results[owner]["ids"] = ids[pos : pos + len(chunks)]
+        results[owner]["inserted_count"] = len(chunks)
+        results[owner].update(_tagging_result())
+        if deferred:
+            _complete_document(registry_id, len(chunks), tag_head=head)
+        else:
+            _complete_document(registry_id, len(chunks), tags)
+        pos += len(chunks)
+    return results
 
 
-@app.post("/api/query")
-def query(inreq: QueryIn):
+@app.post("/api/ingest_pdfs", dependencies=[Depends(require_ready)])
+async def ingest_pdfs(files: List[UploadFile] = File(...)):
+    """Ingest many PDFs in one multipart request and return per-file results."""
+    uploads = [(f.filename, await f.read()) for f in files]
     try:
-        question = inreq.question
-        print(question)
-        top_k = int(inreq.top_k or 4)
+        with trace("ingest_pdfs") as t:
+            # on the ingestion workers, not the web server's threadpool
+            results = await ingest_jobs.run(_ingest_pdf_batch, uploads)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Ingestion queue is full, retry later ({e})")
+    except Exception as e:
+        log_event(logger, "ingest_pdfs_failed", level=logging.ERROR, exc_info=True, files=len(uploads))
+        _raise_if_overloaded(e)
+        raise HTTPException(status_code=500, detail=str(e))
+    for r in results:
+        outcome = "failed" if r["error"] else "duplicate" if r.get("status") == "already_ingested" else "ingested" if r["inserted_count"] else "too_short"
+        INGESTED_DOCUMENTS.inc(operation="ingest_pdfs", outcome=outcome)
+    inserted = sum(r["inserted_count"] for r in results)
+    INGESTED_CHUNKS.inc(inserted, operation="ingest_pdfs")
+    log_event(logger, "ingest_pdfs", files=len(uploads), chunks=inserted, timings_ms=t.timings_ms())
+    return {"inserted_count": inserted, "files": results}
+
+
+def _date_filter(date_from: Optional[date], date_to: Optional[date]) -> Dict[str, Any]:
+    """Mongo filter on ingestion date, using the creation time embedded in ``_id``."""
+    bounds: Dict[str, Any] = {}
+    if date_from:
+        bounds["$gte"] = ObjectId.from_datetime(datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        bounds["$lt"] = ObjectId.from_datetime(datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    return {"_id": bounds} if bounds else {}
+
+
+def _query_tokens(tokens: Optional[List[str]]) -> List[str]:
+    """The lexical-index tokens of the ``tokens`` filter, split and normalized like indexed text.
+
+    ``"INV 0042"`` becomes ``0042`` (``INV`` alone is not indexed); a token
+    with no identifier in it (a plain word) is rejected with 400, since it
+    could only be matched by scanning every chunk.
+    """
+    result: List[str] = []
+    for token in tokens or []:
+        found = tokenize(token)
+        if not found:
+            raise HTTPException(
+                status_code=400,
+                detail=f"token {token!r} has no identifier (3+ characters with a digit); use keywords for words",
+            )
+        result.extend(sorted(found - set(result)))
+    return result
+
+
+async def _candidate_ids(inreq: QueryIn, tokens: List[str]) -> Optional[set]:
+    """Resolve the query filters (``tokens`` from ``_query_tokens``) to the set of chunk ids to score, or None when unfiltered."""
+    candidates: Optional[set] = None
+    clauses: List[Dict[str, Any]] = []
+    if tokens:
+        candidates = lexical_index.lookup_all(tokens)
+        if not candidates:
+            return set()
+    if inreq.source:
+        clauses.append({"source": inreq.source})
+    if inreq.keywords:
+        clauses.append({"keywords": {"$in": inreq.keywords}})
+    date_clause = _date_filter(inreq.date_from, inreq.date_to)
+    if date_clause:
+        clauses.append(date_clause)
+    if not clauses:
+        return candidates
+    if candidates is not None:
+        clauses.append({"_id": {"$in": list(candidates)}})
+    return {d["_id"] async for d in acollection.find({"$and": clauses}, {"_id": 1})}
+
+
+async def _retrieve(
+    question: str, top_k: int, candidates: Optional[set] = None, fetch_k: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], Optional[List[float]]]:
+    """Return the ``fetch_k`` (default ``top_k``) stored documents most similar to the question, and its embedding.
+
+    With ``candidates`` only those chunks are scored; when no more than
+    ``top_k`` chunks match the filters they are returned as-is, without
+    embedding the question at all (the embedding is then None). Scoring a
+    large index runs on a worker thread so the event loop keeps serving
+    other requests.
+    """
+    fetch_k = max(top_k, fetch_k or top_k)
+    q_emb = None
+    if candidates is not None and len(candidates) <= top_k:
+        top_ids = sorted(candidates)
+    else:
         # Use LangChain embeddings to compute query vector
-        try:
+        with span("embed"):
             try:
-                q_emb = embeddings.embed_query(question)
+                q_emb = await embeddings.aembed_query(question)
             except Exception:
-                q_emb = embeddings.embed_documents([question])[0]
-
-            # fetch stored docs with embeddings from MongoDB collection
-            docs = list(collection.find({}, {"text": 1, "metadata": 1, "embedding": 1}))
-            scored = []
-            for d in docs:
-                emb = d.get("embedding")
-                if not emb:
-                    continue
-                score = _cosine_similarity(q_emb, emb)
-                scored.append((score, d))
-            scored.sort(key=lambda x: x[0], reverse=True)
-            top_docs = [d for _, d in scored[:top_k]]
-
-            # Build a context with the top docs
-            context = "\n\n".join([f"{idx+1}. {d.get('text')}" for idx, d in enumerate(top_docs)])
-
-            prompt = (
-                "You are a helpful assistant for bill documents. Use the provided context to answer the question.\n\n"
-                f"CONTEXT:\n{context}\n\nQUESTION:\n{question}\n\nAnswer concisely and truthfully. If not in context, say you don't know."
-            )
+                q_emb = (await embeddings.aembed_documents([question]))[0]
+
+        # score against the in-process index, then fetch only the winners by _id
+        with span("search"):
+            rows = len(candidates) if candidates is not None else len(vector_index)
+            if rows >= SEARCH_OFFLOAD_ROWS:
+                hits = await run_in_threadpool(vector_index.search, q_emb, fetch_k, candidates)
+            else:
+                hits = vector_index.search(q_emb, fetch_k, candidates)
+            top_ids = [doc_id for doc_id, _ in hits]
+    if not top_ids:
+        return [], q_emb
+    with span("fetch"):
+        found = {d["_id"]: d async for d in acollection.find({"_id": {"$in": top_ids}}, WITHOUT_EMBEDDING_PROJECTION)}
+    return [found[i] for i in top_ids if i in found], q_emb
+
+
+async def _retrieve_context(question: str, top_k: int, candidates: Optional[set]) -> Context:
+    """Retrieve a candidate pool for the question and fit the best ``top_k`` of it into the token budget."""
+    pool, q_emb = await _retrieve(question, top_k, candidates, fetch_k=top_k * max(1, CONTEXT_CANDIDATE_MULTIPLIER))
+    with span("context"):
+        ids, vectors = vector_index.vectors([d["_id"] for d in pool])
+        # MMR needs every candidate's embedding; otherwise retrieval order is kept
+        return context_builder.build(question, pool, top_k, q_emb, vectors if len(ids) == len(pool) else None)
+
+
+def _build_prompt(question: str, ctx: Context) -> str:
+    # Build a context with the selected (and trimmed) docs
+    context = ctx.render()
+    return (
+        "You are a helpful assistant for bill documents. Use the provided context to answer the question.\n\n"
+        f"CONTEXT:\n{context}\n\nQUESTION:\n{question}\n\nAnswer concisely and truthfully. If not in context, say you don't know."
+    )
+
+
+def _source_title(metadata: Dict[str, Any]) -> str:
+    title = metadata.get("source") or metadata.get("filename") or "document"
+    return f"{title} (page {metadata['page']})" if metadata.get("page") else str(title)
+
+
+def _sources(ctx: Context) -> List[Dict[str, Any]]:
+    """Lightweight references to the documents in the context; /api/sources/{id} serves the full text.
+
+    The snippet is taken from the (trimmed) text the model was given.
+    """
+    sources = []
+    for d, text in zip(ctx.docs, ctx.texts):
+        metadata = _doc_metadata(d)
+        snippet = " ".join(text.split())
+        if len(snippet) > SOURCE_SNIPPET_CHARS:
+            snippet = snippet[:SOURCE_SNIPPET_CHARS].rsplit(" ", 1)[0] + " ..."
+        sources.append({"id": str(d["_id"]), "title": _source_title(metadata), "snippet": snippet, "metadata": metadata})
+    return sources
+
+
+def _log_query(event: str, question: str, top_k: int, top_docs: List[Dict[str, Any]], cached: bool, t, **fields: Any) -> None:
+    log_event(
+        logger,
+        event,
+        question=question[:200],
+        top_k=top_k,
+        sources=len(top_docs),
+        cached=cached,
+        timings_ms=t.timings_ms(),
+        **fields,
+    )
 
-            # Use LangChain ChatOpenAI (gpt-4o-mini) to answer
-            answer = llm.invoke(prompt)
-            print(answer)
-            sources = [{"text": d.get("text"), "metadata": d.get("metadata", {})} for d in top_docs]
-            return {"answer": answer.content, "sources": sources}
+
+@app.post("/api/query", dependencies=[Depends(require_ready)])
+async def query(inreq: QueryIn):
+    tokens = _query_tokens(inreq.tokens)
+    try:
+        question = inreq.question
+        top_k = inreq.top_k
+        try:
+            with trace("query") as t:
+                with span("filter"):
+                    candidates = await _candidate_ids(inreq, tokens)
+                if candidates is not None and not candidates:
+                    # nothing matches the filters: no embedding or completion to pay for
+                    ctx = Context()
+                    _log_query("query", question, top_k, [], False, t, context=ctx.summary(), matched=0)
+                    return {"answer": NO_MATCH_ANSWER, "sources": [], "cached": False, "context": ctx.summary()}
+                ctx = await _retrieve_context(question, top_k, candidates)
+                top_docs = ctx.docs
+                await answer_cache.sync()
+                cache_key = answer_cache.key(question, [d["_id"] for d in top_docs], top_k)
+                cached = answer_cache.get(cache_key)
+                if cached is None:
+                    prompt = _build_prompt(question, ctx)
+
+                    # Use LangChain ChatOpenAI (gpt-4o-mini) to answer
+                    with span("llm"):
+                        answer = await llm.ainvoke(prompt)
+                    answer_cache.put(cache_key, answer.content)
+            if cached is not None:
+                _log_query("query", question, top_k, top_docs, True, t, context=ctx.summary())
+                return {"answer": cached, "sources": _sources(ctx), "cached": True, "context": ctx.summary()}
+            _log_query("query", question, top_k, top_docs, False, t, context=ctx.summary(), usage=answer.usage_metadata)
+            return {
+                "answer": answer.content,
+                "sources": _sources(ctx),
+                "cached": False,
+                "context": ctx.summary(),
+                "usage": answer.usage_metadata,
+            }
         except Exception as e:
+            _raise_if_overloaded(e)
             raise HTTPException(status_code=500, detail=str(e))
+    except HTTPException as e:
+        if e.status_code == 503:
+            log_event(logger, "query_shed", level=logging.WARNING, question=inreq.question[:200], detail=e.detail)
+            raise
+        log_event(logger, "query_failed", level=logging.ERROR, exc_info=True, question=inreq.question[:200])
+        raise
     except Exception as e:
-        print(e)
+        log_event(logger, "query_failed", level=logging.ERROR, exc_info=True, question=inreq.question[:200])
         raise HTTPException(status_code=500, detail=str(e))
 
+
+class AggregateIn(BaseModel):
+    group_by: Optional[str] = "vendor"  # vendor | month | currency | none
+    date_from: Optional[date] = None  # bill date range, inclusive
+    date_to: Optional[date] = None
+    vendor: Optional[str] = None
+    currency: Optional[str] = None
+
+
+_AGGREGATE_KEYS = {
+    "vendor": "$vendor",
+    "month": {"$dateToString": {"format": "%Y-%m", "date": "$bill_date"}},
+    "currency": None,  # every group is already split by currency
+    "none": None,
+}
+
+
+@app.post("/api/aggregate")
+async def aggregate(inreq: AggregateIn):
+    """Bill totals over the whole corpus from the extracted bill fields, via the Mongo aggregation pipeline.
+
+    Groups are always split by currency so different currencies are never summed together.
+    """
+    group_by = (inreq.group_by or "none").lower()
+    if group_by not in _AGGREGATE_KEYS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {sorted(_AGGREGATE_KEYS)}")
+    match: Dict[str, Any] = {"status": "done", "total_amount": {"$type": "number"}}
+    if inreq.date_from or inreq.date_to:
+        match["bill_date"] = {}
+        if inreq.date_from:
+            match["bill_date"]["$gte"] = datetime.combine(inreq.date_from, datetime.min.time())
+        if inreq.date_to:
+            match["bill_date"]["$lt"] = datetime.combine(inreq.date_to + timedelta(days=1), datetime.min.time())
+    if inreq.vendor:
+        match["vendor"] = inreq.vendor
+    if inreq.currency:
+        currency = parse_currency(inreq.currency)
+        if currency is None:
+            raise HTTPException(status_code=400, detail="currency must be an ISO 4217 code, symbol or currency name")
+        match["currency"] = currency
+    pipeline = [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": {"key": _AGGREGATE_KEYS[group_by], "currency": "$currency"},
+                "total": {"$sum": "$total_amount"},
+                "count": {"$sum": 1},
+                "average": {"$avg": "$total_amount"},
+                "first_bill_date": {"$min": "$bill_date"},
+                "last_bill_date": {"$max": "$bill_date"},
+            }
+        },
+        {"$sort": {"_id.key": 1, "_id.currency": 1}},
+    ]
+    try:
+        groups = [
+            {
+                "key": g["_id"].get("key"),
+                "currency": g["_id"].get("currency"),
+                "total": round(g["total"], 2),
+                "count": g["count"],
+                "average": round(g["average"], 2),
+                "first_bill_date": g.get("first_bill_date"),
+                "last_bill_date": g.get("last_bill_date"),
+            }
+            async for g in await aregistry.aggregate(pipeline)
+        ]
+        # documents the totals cannot include (not bills, not tagged yet, or stored before
+        # bill fields were extracted: python -m app.backfill), and chunks of unregistered documents
+        untyped = await aregistry.count_documents({"status": "done", "total_amount": {"$not": {"$type": "number"}}})
+        unregistered = await acollection.count_documents(UNREGISTERED)
+    except Exception as e:
+        log_event(logger, "aggregate_failed", level=logging.ERROR, exc_info=True, group_by=group_by)
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "group_by": group_by,
+        "bills": sum(g["count"] for g in groups),
+        "groups": groups,
+        "documents_without_total": untyped,
+        "unregistered_chunks": unregistered,
+    }
+
+
+@app.get("/api/lookup", dependencies=[Depends(require_ready)])
+async def lookup(token: str, limit: int = 20):
+    """Return the chunks containing an exact identifier (e.g. a bill number) from the lexical index.
+
+    No embedding or LLM call is made.
+    """
+    ids = sorted(lexical_index.lookup(token))[: max(0, limit)]
+    if not ids:
+        return {"token": token, "count": 0, "results": []}
+    docs = {d["_id"]: d async for d in acollection.find({"_id": {"$in": ids}}, WITHOUT_EMBEDDING_PROJECTION)}
+    results = [{"id": str(i), "text": docs[i].get("text"), "metadata": _doc_metadata(docs[i])} for i in ids if i in docs]
+    return {"token": token, "count": len(results), "results": results}
+
+
+@app.get("/api/sources/{source_id}", dependencies=[Depends(require_ready)])
+async def get_source(source_id: str):
+    """Full text and metadata of one stored chunk, for the source references returned with answers."""
+    try:
+        oid = ObjectId(source_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="invalid source id")
+    d = await acollection.find_one({"_id": oid}, WITHOUT_EMBEDDING_PROJECTION)
+    if d is None:
+        raise HTTPException(status_code=404, detail="source not found")
+    metadata = _doc_metadata(d)
+    return {"id": source_id, "title": _source_title(metadata), "text": d.get("text"), "metadata": metadata}
+
+
+def _ndjson(event: Dict[str, Any]) -> str:
+    return json.dumps(event, default=str) + "\n"
+
+
+@app.post("/api/query/stream", dependencies=[Depends(require_ready)])
+async def query_stream(inreq: QueryIn):
+    """Streaming variant of /api/query.
+
+    Responds with NDJSON events: one ``sources`` event as soon as retrieval is
+    done, then ``token`` events as the model generates, then ``done`` (or
+    ``error`` if generation fails part-way). A cached answer is sent as a
+    single ``token`` event and ``done`` reports ``cached: true``.
+    """
+    question = inreq.question
+    top_k = inreq.top_k
+    tokens = _query_tokens(inreq.tokens)
+    try:
+        # finished by the generator once the answer has been streamed
+        with trace("query_stream", finish=False) as t:
+            with span("filter"):
+                candidates = await _candidate_ids(inreq, tokens)
+            # nothing matches the filters: no embedding or completion to pay for
+            ctx = Context() if candidates is not None and not candidates else await _retrieve_context(question, top_k, candidates)
+    except Exception as e:
+        _raise_if_overloaded(e)
+        log_event(logger, "query_stream_failed", level=logging.ERROR, exc_info=True, question=question[:200])
+        raise HTTPException(status_code=500, detail=str(e))
+    top_docs = ctx.docs
+    await answer_cache.sync()
+    cache_key = answer_cache.key(question, [d["_id"] for d in top_docs], top_k)
+    cached = answer_cache.get(cache_key)
+    no_match = candidates is not None and not candidates
+    prompt = _build_prompt(question, ctx)
+
+    async def events():
+        yield _ndjson({"type": "sources", "sources": _sources(ctx), "context": ctx.summary()})
+        if no_match:
+            yield _ndjson({"type": "token", "content": NO_MATCH_ANSWER})
+            yield _ndjson({"type": "done", "cached": False})
+            t.finish()
+            _log_query("query_stream", question, top_k, top_docs, False, t, context=ctx.summary(), matched=0)
+            return
+        if cached is not None:
+            yield _ndjson({"type": "token", "content": cached})
+            yield _ndjson({"type": "done", "cached": True})
+            t.finish()
+            _log_query("query_stream", question, top_k, top_docs, True, t, context=ctx.summary())
+            return
+        parts: List[str] = []
+        started = time.perf_counter()
+        try:
+            with t.span("llm"):
+                async for chunk in llm.astream(prompt, config={"metadata": {"operation": "query_stream"}}):
+                    if chunk.content:
+                        if not parts:
+                            t.add("first_token", time.perf_counter() - started)
+                        parts.append(chunk.content)
+                        yield _ndjson({"type": "token", "content": chunk.content})
+        except (GeneratorExit, asyncio.CancelledError):
+            # the client went away mid-answer
+            t.finish("cancelled")
+            raise
+        except Exception as e:
+            t.finish("error")
+            log_event(logger, "query_stream_failed", level=logging.ERROR, exc_info=True, question=question[:200])
+            overload = overload_of(e)
+            # the response has started, so a shed answer is reported in the stream
+            extra = {"retry_after": overload.retry_after_header} if overload is not None else {}
+            yield _ndjson({"type": "error", "detail": str(e), **extra})
+            return
+        answer_cache.put(cache_key, "".join(parts))
+        t.finish()
+        yield _ndjson({"type": "done", "cached": False})
+        _log_query("query_stream", question, top_k, top_docs, False, t, context=ctx.summary())
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+# Fixed CSV columns of /api/export; metadata outside these goes to the JSON ``other_metadata`` column
+_EXPORT_FIELDS = ["source", "page", "chunk", *METADATA_SCHEMA["properties"]]
+_EXPORT_FORMATS = {"jsonl": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+def _export_record(d: Dict[str, Any], include_embeddings: bool) -> Dict[str, Any]:
+    record = {
+        "id": str(d["_id"]),
+        "ingested_at": d["_id"].generation_time.isoformat() if isinstance(d["_id"], ObjectId) else None,
+        "text": d.get("text"),
+        "metadata": _doc_metadata(d),
+    }
+    if include_embeddings:
+        vec = decode_embedding(d)
+        record["embedding"] = vec.tolist() if vec is not None else None
+    return record
+
+
+def _csv_row(record: Dict[str, Any]) -> List[Any]:
+    metadata = record["metadata"]
+    values = []
+    for field in _EXPORT_FIELDS:
+        value = metadata.get(field)
+        values.append(json.dumps(value, default=str) if isinstance(value, (list, dict)) else value)
+    other = {k: v for k, v in metadata.items() if k not in _EXPORT_FIELDS}
+    row = [record["id"], record["ingested_at"], record["text"], *values, json.dumps(other, default=str) if other else ""]
+    if "embedding" in record:
+        row.append(json.dumps(record["embedding"]) if record["embedding"] is not None else "")
+    return row
+
+
+@app.get("/api/export")
+async def export(
+    format: str = "jsonl",
+    source: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    include_embeddings: bool = False,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+):
+    """Stream stored chunks (text, metadata, tagger fields, optionally embeddings) as JSONL or CSV.
+
+    Rows come in ``_id`` order from a batched server-side cursor and are
+    written one batch per response chunk, so memory stays flat whatever the
+    collection size. Every row carries its ``id``; an interrupted or
+    ``limit``-ed export resumes with ``after=<id of the last row received>``.
+    Dates filter on ingestion time, like /api/query.
+    """
+    format = format.lower()
+    if format not in _EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {sorted(_EXPORT_FORMATS)}")
+    clauses: List[Dict[str, Any]] = []
+    if source:
+        clauses.append({"source": source})
+    date_clause = _date_filter(date_from, date_to)
+    if date_clause:
+        clauses.append(date_clause)
+    if after:
+        try:
+            clauses.append({"_id": {"$gt": ObjectId(after)}})
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="after must be the id of an exported row")
+    query_filter = {"$and": clauses} if clauses else {}
+    projection = None if include_embeddings else WITHOUT_EMBEDDING_PROJECTION
+    cursor = acollection.find(query_filter, projection).sort("_id", ASCENDING).batch_size(EXPORT_BATCH_SIZE)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+
+    def encode(batch: List[Dict[str, Any]]) -> str:
+        if format == "jsonl":
+            return "".join(json.dumps(r, default=str) + "\n" for r in batch)
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(_csv_row(r) for r in batch)
+        return buffer.getvalue()
+
+    async def rows():
+        started = time.perf_counter()
+        count = 0
+        last_id = None
+        outcome = "ok"
+        try:
+            if format == "csv":
+                header = ["id", "ingested_at", "text", *_EXPORT_FIELDS, "other_metadata"]
+                yield ",".join(header + (["embedding"] if include_embeddings else [])) + "\r\n"
+            batch: List[Dict[str, Any]] = []
+            async for d in cursor:
+                batch.append(_export_record(d, include_embeddings))
+                if len(batch) >= EXPORT_BATCH_SIZE:
+                    yield encode(batch)
+                    count += len(batch)
+                    last_id = batch[-1]["id"]
+                    batch = []
+            if batch:
+                yield encode(batch)
+                count += len(batch)
+                last_id = batch[-1]["id"]
+        except (GeneratorExit, asyncio.CancelledError):
+            outcome = "cancelled"
+            raise
+        except Exception:
+            # headers are already sent; the truncated body is resumable from the last complete row
+            outcome = "error"
+            log_event(logger, "export_failed", level=logging.ERROR, exc_info=True, rows=count, last_id=last_id)
+        finally:
+            await cursor.close()
+            log_event(
+                logger,
+                "export",
+                format=format,
+                rows=count,
+                last_id=last_id,
+                outcome=outcome,
+                seconds=round(time.perf_counter() - started, 3),
+            )
+
+    filename = f"bills-export.{format}"
+    return StreamingResponse(
+        rows(),
+        media_type=_EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
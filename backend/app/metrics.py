@@ -0,0 +1,337 @@
+"""Prometheus-format metrics and per-stage timing spans.
+
+A small in-process registry (counters, gauges computed at scrape time and
+histograms) rendered in the Prometheus text exposition format, so no client
+library is needed. ``trace(operation)`` / ``span(stage)`` time the stages of an
+operation into ``baai_stage_duration_seconds`` and, inside an HTTP request,
+into that request's ``Server-Timing`` header.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+Sample = Tuple[Dict[str, str], float]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [("", dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket..., +Inf count], sum
+        self._values: Dict[tuple, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        out = []
+        for key, counts, total in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                out.append(("_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            out.append(("_sum", labels, total))
+            out.append(("_count", labels, cumulative))
+        return out
+
+
+class Gauge(_Metric):
+    """Gauge whose samples are read from a callback at scrape time."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], Iterable[Sample]], counter: bool = False):
+        super().__init__(name, help)
+        self.read = read
+        if counter:
+            # monotonic values owned elsewhere (e.g. cache hit counters)
+            self.type = "counter"
+
+    def samples(self):
+        return [("", labels, value) for labels, value in self.read()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, read: Callable[[], Iterable[Sample]], counter: bool = False) -> Gauge:
+        return self.register(Gauge(name, help, read, counter))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # a failing scrape-time callback must not take the whole endpoint down
+                continue
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "baai_stage_duration_seconds", "Time spent in each stage of an operation", ("operation", "stage")
+)
+OPERATION_SECONDS = REGISTRY.histogram(
+    "baai_operation_duration_seconds", "End-to-end duration of an operation", ("operation", "outcome")
+)
+
+
+# --- spans ---
+
+class Trace:
+    """Accumulated stage durations of one operation (a query, an ingested document, ...)."""
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.stages: Dict[str, float] = {}
+        self.started = time.perf_counter()
+        self.finished = False
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        timings = _server_timing.get()
+        if timings is not None:
+            timings.append((stage, seconds))
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def timings_ms(self) -> Dict[str, float]:
+        return {stage: round(seconds * 1000, 2) for stage, seconds in self.stages.items()}
+
+    def finish(self, outcome: str = "ok") -> None:
+        """Observe each stage total and the end-to-end duration (once)."""
+        if self.finished:
+            return
+        self.finished = True
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, operation=self.operation, stage=stage)
+        OPERATION_SECONDS.observe(self.elapsed, operation=self.operation, outcome=outcome)
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("baai_trace", default=None)
+# (stage, seconds) recorded while serving the current HTTP request, for its Server-Timing header
+_server_timing: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "baai_server_timing", default=None
+)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def trace(operation: str, finish: bool = True) -> Iterator[Trace]:
+    """Time an operation; ``span()`` calls made inside it (on this thread) are attributed to it.
+
+    With ``finish=False`` the caller finishes the trace itself, e.g. once a
+    streamed response has been fully sent.
+    """
+    t = Trace(operation)
+    token = _current_trace.set(t)
+    try:
+        yield t
+    except BaseException:
+        t.finish("error")
+        raise
+    finally:
+        _current_trace.reset(token)
+    if finish:
+        t.finish()
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time one stage of the current operation (a no-op outside ``trace()``)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        t = _current_trace.get()
+        if t is not None:
+            t.add(stage, time.perf_counter() - started)
+
+
+def timed_iter(iterable: Iterable[Any], stage: str) -> Iterator[Any]:
+    """Yield from ``iterable``, attributing the time spent producing items to ``stage``."""
+    it = iter(iterable)
+    while True:
+        with span(stage):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+
+@contextmanager
+def collect_server_timing() -> Iterator[List[Tuple[str, float]]]:
+    """Collect the spans recorded while serving one request."""
+    timings: List[Tuple[str, float]] = []
+    token = _server_timing.set(timings)
+    try:
+        yield timings
+    finally:
+        _server_timing.reset(token)
+
+
+def server_timing_header(timings: List[Tuple[str, float]], total_seconds: float) -> str:
+    """Format spans as a ``Server-Timing`` header value, summing repeated stages."""
+    totals: Dict[str, float] = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items()]
+    parts.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# --- application metrics ---
+
+HTTP_REQUESTS = REGISTRY.counter("baai_http_requests_total", "HTTP requests served", ("method", "route", "status"))
+HTTP_SECONDS = REGISTRY.histogram("baai_http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+LLM_REQUESTS = REGISTRY.counter("baai_llm_requests_total", "Chat model calls", ("operation",))
+LLM_TOKENS = REGISTRY.counter("baai_llm_tokens_total", "Chat model token usage", ("operation", "kind"))
+INGESTED_DOCUMENTS = REGISTRY.counter("baai_ingested_documents_total", "Documents submitted for ingestion", ("operation", "outcome"))
+INGESTED_CHUNKS = REGISTRY.counter("baai_ingested_chunks_total", "Chunks embedded and stored", ("operation",))
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """Count chat model calls and tokens per operation.
+
+    The operation is the one being traced when the call starts, or
+    ``metadata["operation"]`` from the run config (for calls consumed
+    outside the trace, like a streamed answer).
+    """
+
+    def __init__(self):
+        self._operations: Dict[Any, str] = {}
+
+    def on_chat_model_start(
+        self, serialized: Dict[str, Any], messages: Any, *, run_id: Any, metadata: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> None:
+        operation = (metadata or {}).get("operation")
+        if operation is None:
+            t = _current_trace.get()
+            operation = t.operation if t is not None else "other"
+        self._operations[run_id] = operation
+
+    def on_llm_error(self, error: BaseException, *, run_id: Any, **kwargs: Any) -> None:
+        self._operations.pop(run_id, None)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: Any, **kwargs: Any) -> None:
+        operation = self._operations.pop(run_id, "other")
+        LLM_REQUESTS.inc(operation=operation)
+        usage: Dict[str, int] = {}
+        for generations in response.generations:
+            for g in generations:
+                meta = getattr(getattr(g, "message", None), "usage_metadata", None) or {}
+                usage["input"] = usage.get("input", 0) + meta.get("input_tokens", 0)
+                usage["output"] = usage.get("output", 0) + meta.get("output_tokens", 0)
+        if not any(usage.values()):
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            usage = {"input": token_usage.get("prompt_tokens", 0), "output": token_usage.get("completion_tokens", 0)}
+        for kind, count in usage.items():
+            if count:
+                LLM_TOKENS.inc(count, operation=operation, kind=kind)
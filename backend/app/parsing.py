@@ -0,0 +1,24 @@
+"""PDF text extraction.
+
+Kept free of the web app's imports and clients so the functions can run in
+worker processes of a ``ProcessPoolExecutor``.
+"""
+import io
+from typing import Iterator, List, Tuple
+
+from pypdf import PdfReader
+
+
+def iter_pdf_pages(contents: bytes) -> Iterator[Tuple[int, str]]:
+    """Yield ``(page_number, text)`` for every page of the in-memory PDF, starting at 1.
+
+    Pages are extracted lazily, so only one page's text is alive at a time.
+    """
+    reader = PdfReader(io.BytesIO(contents))
+    for number, page in enumerate(reader.pages, start=1):
+        yield number, page.extract_text() or ""
+
+
+def extract_pdf_pages(contents: bytes) -> List[Tuple[int, str]]:
+    """Return ``(page_number, text)`` for every page (picklable result for process pools)."""
+    return list(iter_pdf_pages(contents))
@@ -0,0 +1,199 @@
+"""Compact embedding storage formats and the tools to migrate to them.
+
+Embeddings can be stored either as the plain BSON array of doubles written
+by LangChain (``embedding``) or as packed ``BinData`` (``embedding_bin``)
+with its ``embedding_format`` and a per-vector ``embedding_scale``:
+
+- ``float16``: half precision, scale 1.0 (~3 KB for 1536 dimensions)
+- ``int8``: symmetric per-vector quantization, value = int8 * scale (~1.5 KB)
+
+Run from ``backend/``::
+
+    python -m app.quantization migrate --format int8      # or float16 / float to go back
+    python -m app.quantization recall --format int8 --sample 5000 --queries 200 --k 10
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+import numpy as np
+from bson.binary import Binary
+
+
+FORMATS = ("float", "float16", "int8")
+
+# Every field an embedding can be stored in, for projections
+EMBEDDING_FIELDS = ("embedding", "embedding_bin", "embedding_format", "embedding_scale")
+EMBEDDING_PROJECTION = {f: 1 for f in EMBEDDING_FIELDS}
+WITHOUT_EMBEDDING_PROJECTION = {f: 0 for f in EMBEDDING_FIELDS}
+# Documents that carry an embedding in any format
+HAS_EMBEDDING = {"$or": [{"embedding": {"$exists": True}}, {"embedding_bin": {"$exists": True}}]}
+
+_DTYPES = {"float16": np.float16, "int8": np.int8}
+
+
+def quantize(vector: Sequence[float], fmt: str):
+    """Return ``(packed ndarray, scale)`` for ``vector`` in ``fmt`` (float16 or int8)."""
+    v = np.asarray(vector, dtype=np.float32)
+    if fmt == "float16":
+        return v.astype(np.float16), 1.0
+    if fmt == "int8":
+        peak = float(np.max(np.abs(v))) if v.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        return np.clip(np.rint(v / scale), -127, 127).astype(np.int8), scale
+    raise ValueError(f"unknown embedding format {fmt!r}; expected one of {FORMATS}")
+
+
+def encode_embedding(vector: Sequence[float], fmt: str = "float") -> Dict[str, Any]:
+    """Return the document fields that store ``vector`` in ``fmt``."""
+    if fmt == "float":
+        return {"embedding": [float(x) for x in vector]}
+    packed, scale = quantize(vector, fmt)
+    return {"embedding_bin": Binary(packed.tobytes()), "embedding_format": fmt, "embedding_scale": scale}
+
+
+def decode_embedding(doc: Dict[str, Any]) -> Optional[np.ndarray]:
+    """Return a stored document's embedding as float32, or None if it has none.
+
+    Packed vectors are decoded with ``np.frombuffer`` straight from the BSON
+    bytes, without creating a Python object per element.
+    """
+    raw = doc.get("embedding_bin")
+    if raw is not None:
+        dtype = _DTYPES.get(doc.get("embedding_format"))
+        if dtype is None:
+            return None
+        vec = np.frombuffer(raw, dtype=dtype).astype(np.float32)
+        scale = doc.get("embedding_scale", 1.0)
+        return vec * np.float32(scale) if scale != 1.0 else vec
+    emb = doc.get("embedding")
+    if not emb:
+        return None
+    return np.asarray(emb, dtype=np.float32)
+
+
+def migrate(collection, fmt: str, batch_size: int = 500, keep_float: bool = False) -> int:
+    """Rewrite every stored embedding into ``fmt``; safe to interrupt and re-run."""
+    from pymongo import UpdateOne
+
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown embedding format {fmt!r}; expected one of {FORMATS}")
+    if fmt == "float":
+        todo = {"embedding_bin": {"$exists": True}}
+    elif keep_float:
+        todo = {"embedding": {"$type": "array"}, "embedding_format": {"$ne": fmt}}
+    else:
+        todo = {"$or": [{"embedding": {"$type": "array"}}, {"embedding_format": {"$exists": True, "$ne": fmt}}]}
+
+    migrated = 0
+    ops = []
+    for d in collection.find(todo, EMBEDDING_PROJECTION).batch_size(batch_size):
+        vec = decode_embedding(d)
+        if vec is None:
+            continue
+        fields = encode_embedding(vec, fmt)
+        if fmt == "float":
+            update = {"$set": fields, "$unset": {"embedding_bin": "", "embedding_format": "", "embedding_scale": ""}}
+        elif keep_float:
+            update = {"$set": fields}
+        else:
+            update = {"$set": fields, "$unset": {"embedding": ""}}
+        ops.append(UpdateOne({"_id": d["_id"]}, update))
+        if len(ops) >= batch_size:
+            migrated += collection.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        migrated += collection.bulk_write(ops, ordered=False).modified_count
+    return migrated
+
+
+def _normalized(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def recall_check(vectors: Iterable[Sequence[float]], fmt: str, queries: int = 200, k: int = 10, seed: int = 0) -> Dict[str, Any]:
+    """Compare top-``k`` cosine retrieval on ``fmt``-quantized vectors against full precision.
+
+    A random subset of the vectors is used as queries (each one excluding
+    itself from its results); recall@k is the mean overlap of the quantized
+    top-k with the float32 top-k.
+    """
+    full = np.asarray(list(vectors), dtype=np.float32)
+    if full.ndim != 2 or full.shape[0] <= k:
+        raise ValueError(f"need more than k={k} vectors to measure recall")
+    packed = np.empty_like(full)
+    for i, v in enumerate(full):
+        q, scale = quantize(v, fmt) if fmt != "float" else (v, 1.0)
+        packed[i] = q.astype(np.float32) * np.float32(scale)
+
+    full_n, packed_n = _normalized(full), _normalized(packed)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(full.shape[0], size=min(queries, full.shape[0]), replace=False)
+    overlaps = []
+    for i in picks:
+        exact = full_n @ full_n[i]
+        approx = packed_n @ full_n[i]
+        exact[i] = approx[i] = -np.inf
+        truth = set(np.argpartition(-exact, k)[:k].tolist())
+        found = set(np.argpartition(-approx, k)[:k].tolist())
+        overlaps.append(len(truth & found) / k)
+    return {
+        "format": fmt,
+        "k": k,
+        "vectors": int(full.shape[0]),
+        "queries": len(overlaps),
+        "recall_at_k": float(np.mean(overlaps)),
+        "min_recall_at_k": float(np.min(overlaps)),
+        "bytes_per_vector": int(packed.shape[1] * (4 if fmt == "float" else np.dtype(_DTYPES[fmt]).itemsize)),
+    }
+
+
+def _collection():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    uri = os.getenv("MONGO_DB_URI")
+    if not uri:
+        raise RuntimeError("MONGO_DB_URI is required in environment")
+    client = MongoClient(uri)
+    return client[os.getenv("MONGO_DB", "bills_db")][os.getenv("MONGO_COLLECTION", "bills_collection")]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.quantization", description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    mig = sub.add_parser("migrate", help="rewrite stored embeddings into a storage format")
+    mig.add_argument("--format", choices=FORMATS, required=True)
+    mig.add_argument("--batch-size", type=int, default=500)
+    mig.add_argument("--keep-float", action="store_true", help="keep the float array next to the packed vector")
+    rec = sub.add_parser("recall", help="measure recall@k of a format against full-precision vectors")
+    rec.add_argument("--format", choices=FORMATS, required=True)
+    rec.add_argument("--sample", type=int, default=5000, help="number of stored float vectors to sample")
+    rec.add_argument("--queries", type=int, default=200)
+    rec.add_argument("--k", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    collection = _collection()
+    if args.command == "migrate":
+        n = migrate(collection, args.format, batch_size=args.batch_size, keep_float=args.keep_float)
+        print(json.dumps({"format": args.format, "migrated": n}))
+        return 0
+
+    sample = collection.aggregate(
+        [{"$match": {"embedding": {"$type": "array"}}}, {"$sample": {"size": args.sample}}, {"$project": {"embedding": 1}}]
+    )
+    vectors = [d["embedding"] for d in sample]
+    if len(vectors) <= args.k:
+        print("not enough full-precision embeddings to compare against (migrate with --keep-float first)", file=sys.stderr)
+        return 1
+    print(json.dumps(recall_check(vectors, args.format, queries=args.queries, k=args.k), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
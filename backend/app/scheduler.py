@@ -0,0 +1,498 @@
+"""Admission control and rate-limit-aware scheduling of the OpenAI requests of one worker.
+
+Every OpenAI request (embeddings, chat, tagging; sync and async) goes through
+the shared httpx clients, whose transports hand it to one ``RateScheduler``:
+
+- requests-per-minute and tokens-per-minute budgets are token buckets; a
+  request waits until both have room for it (tokens are estimated from the
+  request body). Without configured budgets, only the limits OpenAI reports
+  (429s, ``x-ratelimit-remaining-*`` headers) pause the queue;
+- waiting requests are admitted in priority order: ``interactive`` (set for
+  the query endpoints with ``priority()``) before ``bulk`` (ingestion,
+  tagging), and bulk requests leave part of the budgets to interactive ones;
+- 429s, 5xx responses and connection errors are retried with jittered
+  exponential backoff, honouring ``Retry-After``; a 429 pauses the whole queue;
+- when the queue is full, a request has waited too long, or the retries are
+  spent on 429s, ``Overloaded`` is raised with a suggested ``retry_after``
+  so the API can answer ``503`` instead of holding the request.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+from .metrics import REGISTRY, current_trace
+
+OPENAI_REQUESTS = REGISTRY.counter(
+    "baai_openai_requests_total", "OpenAI HTTP attempts by endpoint and outcome (ok, retried, failed, shed)", ("endpoint", "outcome")
+)
+OPENAI_WAIT_SECONDS = REGISTRY.histogram(
+    "baai_openai_queue_wait_seconds",
+    "Time an OpenAI request waited for admission",
+    ("priority",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BULK)
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("baai_openai_priority", default=BULK)
+
+# Statuses worth retrying; 429 also pauses the queue
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# How often a waiting request that is not first in line checks again
+POLL_SECONDS = 0.01
+# Budgets allow bursts of this many seconds' worth of requests/tokens
+BURST_SECONDS = 10.0
+
+
+@contextmanager
+def priority(level: str) -> Iterator[None]:
+    """Run the OpenAI calls made inside (and in tasks/threads started from here) at ``level``."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class Overloaded(Exception):
+    """The OpenAI request was not sent (or kept being rate limited); retry after ``retry_after`` seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def overload_of(exc: Optional[BaseException]) -> Optional[Overloaded]:
+    """The ``Overloaded`` behind ``exc``, also when a client library wrapped it (e.g. in APIConnectionError)."""
+    for _ in range(8):
+        if exc is None:
+            return None
+        if isinstance(exc, Overloaded):
+            return exc
+        exc = exc.__cause__ or exc.__context__
+    return None
+
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in a ``Retry-After`` (``"2"``) or ``x-ratelimit-reset-*`` (``"1m30.5s"``, ``"20ms"``) value."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    return sum(float(n) * _UNITS[unit] for n, unit in parts) if parts else None
+
+
+def retry_after_of(headers) -> Optional[float]:
+    if headers.get("retry-after-ms"):
+        return _parse_duration(headers["retry-after-ms"]) / 1000.0
+    return _parse_duration(headers.get("retry-after"))
+
+
+def estimate_tokens(body: bytes, completion_tokens: int = 512) -> int:
+    """Tokens an OpenAI request counts against the TPM budget: its input plus the completion it may produce."""
+    try:
+        payload = json.loads(body) if body else {}
+    except ValueError:
+        return len(body) // 4 + 1
+    if not isinstance(payload, dict):
+        return len(body) // 4 + 1
+    if "input" in payload:
+        inputs = payload["input"]
+        if isinstance(inputs, str) or (isinstance(inputs, list) and inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        # LangChain sends embedding inputs pre-tokenized (lists of token ids)
+        return sum(len(i) if isinstance(i, list) else len(str(i)) // 4 + 1 for i in inputs) or 1
+    if "messages" in payload:
+        completion = payload.get("max_completion_tokens") or payload.get("max_tokens") or completion_tokens
+        return len(json.dumps(payload["messages"])) // 4 + 1 + int(completion)
+    return len(body) // 4 + 1
+
+
+class _Bucket:
+    """Token bucket refilled at ``per_minute``; it may go into debt for a request larger than its capacity."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, amount: float, reserve: float, now: float) -> float:
+        """Seconds until ``amount`` fits while keeping ``reserve`` (a fraction of the capacity) untouched."""
+        self._refill(now)
+        needed = min(amount + reserve * self.capacity, self.capacity)
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= amount
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "deadline", "cancelled")
+
+    def __init__(self, priority: str, seq: int, tokens: int, deadline: float):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.deadline = deadline
+        self.cancelled = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (PRIORITIES.index(self.priority), self.seq) < (PRIORITIES.index(other.priority), other.seq)
+
+
+class RateScheduler:
+    """Admit OpenAI requests within RPM/TPM budgets, interactive first; see the module docstring.
+
+    ``rpm``/``tpm`` of 0 disable that budget; ``max_in_flight`` of 0 disables
+    the cap on requests whose response is not finished (a streamed answer
+    holds its slot until its body is closed). ``max_wait`` maps each priority
+    to how long its requests may wait before being shed.
+    """
+
+    def __init__(
+        self,
+        rpm: float = 0,
+        tpm: float = 0,
+        max_in_flight: int = 0,
+        max_queue: int = 256,
+        max_wait: Optional[Dict[str, float]] = None,
+        bulk_reserve: float = 0.2,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        completion_tokens: int = 512,
+    ):
+        self._lock = threading.Lock()
+        self._requests = _Bucket(rpm) if rpm > 0 else None
+        self._tokens = _Bucket(tpm) if tpm > 0 else None
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = {INTERACTIVE: 10.0, BULK: 120.0, **(max_wait or {})}
+        self.bulk_reserve = bulk_reserve
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.completion_tokens = completion_tokens
+        self._heap: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._waiting = {p: 0 for p in PRIORITIES}
+        self._in_flight = 0
+        self._paused_until = 0.0
+
+    # --- admission ---
+
+    def _enqueue(self, tokens: int) -> _Waiter:
+        level = _priority.get()
+        with self._lock:
+            if sum(self._waiting.values()) >= self.max_queue:
+                raise Overloaded("OpenAI request queue is full", self._retry_after(time.monotonic()))
+            w = _Waiter(level, next(self._seq), tokens, time.monotonic() + self.max_wait.get(level, self.max_wait[BULK]))
+            heapq.heappush(self._heap, w)
+            self._waiting[level] += 1
+        return w
+
+    def _cancel(self, w: _Waiter) -> None:
+        with self._lock:
+            if not w.cancelled:
+                w.cancelled = True
+                self._waiting[w.priority] -= 1
+
+    def _poll(self, w: _Waiter) -> Optional[float]:
+        """Admit ``w`` if it is first in line and the budgets allow; else the seconds to wait before asking again."""
+        with self._lock:
+            while self._heap and self._heap[0].cancelled:
+                heapq.heappop(self._heap)
+            now = time.monotonic()
+            if now >= w.deadline:
+                w.cancelled = True
+                self._waiting[w.priority] -= 1
+                raise Overloaded("OpenAI requests are rate limited, gave up waiting", self._retry_after(now))
+            if self._heap[0] is not w:
+                return POLL_SECONDS
+            reserve = self.bulk_reserve if w.priority == BULK else 0.0
+            delay = self._paused_until - now
+            if self.max_in_flight and self._in_flight >= self.max_in_flight:
+                delay = max(delay, POLL_SECONDS)
+            if self._requests is not None:
+                delay = max(delay, self._requests.wait(1, reserve, now))
+            if self._tokens is not None:
+                delay = max(delay, self._tokens.wait(w.tokens, reserve, now))
+            if delay > 0:
+                return min(delay, w.deadline - now + POLL_SECONDS)
+            heapq.heappop(self._heap)
+            w.cancelled = True
+            self._waiting[w.priority] -= 1
+            if self._requests is not None:
+                self._requests.take(1)
+            if self._tokens is not None:
+                self._tokens.take(w.tokens)
+            self._in_flight += 1
+            return None
+
+    def _retry_after(self, now: float) -> float:
+        """Rough time until a new request would be admitted. Caller holds the lock."""
+        wait = max(0.0, self._paused_until - now)
+        if self._requests is not None:
+            wait = max(wait, sum(self._waiting.values()) / self._requests.rate)
+        return max(1.0, wait)
+
+    def _admitted(self, w: _Waiter, started: float) -> None:
+        waited = time.monotonic() - started
+        OPENAI_WAIT_SECONDS.observe(waited, priority=w.priority)
+        t = current_trace()
+        if t is not None:
+            t.add("openai_queue", waited)
+
+    def acquire(self, tokens: int) -> None:
+        """Block until a request of ``tokens`` is admitted (raises ``Overloaded`` when shed)."""
+        started = time.monotonic()
+        w = self._enqueue(tokens)
+        try:
+            while (delay := self._poll(w)) is not None:
+                time.sleep(delay)
+        except BaseException:
+            self._cancel(w)
+            raise
+        self._admitted(w, started)
+
+    async def aacquire(self, tokens: int) -> None:
+        started = time.monotonic()
+        w = self._enqueue(tokens)
+        try:
+            while (delay := self._poll(w)) is not None:
+                await asyncio.sleep(delay)
+        except BaseException:
+            self._cancel(w)
+            raise
+        self._admitted(w, started)
+
+    def release(self) -> None:
+        """The admitted request failed, or its response body was read or closed."""
+        with self._lock:
+            self._in_flight -= 1
+
+    # --- responses and retries ---
+
+    def pause(self, seconds: float) -> None:
+        """Hold every queued request for ``seconds`` (the provider said to slow down)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def observe(self, headers) -> None:
+        """Pause until the reported reset when OpenAI says a budget is used up."""
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is not None and remaining.strip() == "0":
+                reset = _parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self.pause(reset)
+
+    def backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Full-jitter exponential backoff, never shorter than the provider's ``Retry-After``."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+        return max(delay, retry_after or 0.0)
+
+    def retry_delay(self, endpoint: str, attempt: int, response: Optional[httpx.Response]) -> Optional[float]:
+        """After an attempt: None to return ``response`` (or re-raise the error), else the seconds before retrying.
+
+        Raises ``Overloaded`` once the retries are spent on 429s.
+        """
+        if response is not None:
+            self.observe(response.headers)
+            if response.status_code not in RETRY_STATUSES:
+                OPENAI_REQUESTS.inc(endpoint=endpoint, outcome="ok" if response.status_code < 400 else "failed")
+                return None
+        retry_after = retry_after_of(response.headers) if response is not None else None
+        rate_limited = response is not None and response.status_code == 429
+        if rate_limited:
+            self.pause(retry_after or self.backoff_base * 2**attempt)
+        if attempt >= self.max_retries:
+            OPENAI_REQUESTS.inc(endpoint=endpoint, outcome="failed")
+            if rate_limited:
+                with self._lock:
+                    raise Overloaded("OpenAI rate limit reached", retry_after or self._retry_after(time.monotonic()))
+            return None
+        OPENAI_REQUESTS.inc(endpoint=endpoint, outcome="retried")
+        return self.backoff(attempt, retry_after)
+
+    def shed(self, endpoint: str) -> None:
+        OPENAI_REQUESTS.inc(endpoint=endpoint, outcome="shed")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "waiting": dict(self._waiting),
+                "in_flight": self._in_flight,
+                "paused_seconds": max(0.0, self._paused_until - now),
+                "requests_available": self._requests.level if self._requests is not None else None,
+                "tokens_available": self._tokens.level if self._tokens is not None else None,
+            }
+
+
+def _endpoint(request: httpx.Request) -> str:
+    return request.url.path.rstrip("/").rsplit("/", 1)[-1] or "unknown"
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Response body that gives the in-flight slot back when it is closed, so streamed answers count while they stream."""
+
+    def __init__(self, inner: httpx.SyncByteStream, scheduler: RateScheduler):
+        self.inner = inner
+        self.scheduler = scheduler
+        self.released = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield from self.inner
+
+    def close(self) -> None:
+        try:
+            self.inner.close()
+        finally:
+            if not self.released:
+                self.released = True
+                self.scheduler.release()
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    """Async counterpart of ``_ReleasingStream``."""
+
+    def __init__(self, inner: httpx.AsyncByteStream, scheduler: RateScheduler):
+        self.inner = inner
+        self.scheduler = scheduler
+        self.released = False
+
+    async def __aiter__(self):
+        async for chunk in self.inner:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self.inner.aclose()
+        finally:
+            if not self.released:
+                self.released = True
+                self.scheduler.release()
+
+
+class ScheduledTransport(httpx.BaseTransport):
+    """Sync httpx transport sending each request through ``scheduler`` (admission, retries)."""
+
+    def __init__(self, inner: httpx.BaseTransport, scheduler: RateScheduler):
+        self.inner = inner
+        self.scheduler = scheduler
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = _endpoint(request)
+        tokens = estimate_tokens(request.read(), self.scheduler.completion_tokens)
+        attempt = 0
+        while True:
+            try:
+                self.scheduler.acquire(tokens)
+            except Overloaded:
+                self.scheduler.shed(endpoint)
+                raise
+            try:
+                response = self.inner.handle_request(request)
+            except BaseException as e:
+                self.scheduler.release()
+                if not isinstance(e, httpx.TransportError):
+                    raise
+                delay, response = self.scheduler.retry_delay(endpoint, attempt, None), None
+                if delay is None:
+                    raise
+            else:
+                # the slot stays taken until the body is closed (after a streamed answer ends)
+                if response.is_closed:
+                    self.scheduler.release()
+                else:
+                    response.stream = _ReleasingStream(response.stream, self.scheduler)
+            if response is not None:
+                try:
+                    delay = self.scheduler.retry_delay(endpoint, attempt, response)
+                except Overloaded:
+                    response.close()
+                    raise
+                if delay is None:
+                    return response
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+class AsyncScheduledTransport(httpx.AsyncBaseTransport):
+    """Async counterpart of ``ScheduledTransport``."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, scheduler: RateScheduler):
+        self.inner = inner
+        self.scheduler = scheduler
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = _endpoint(request)
+        tokens = estimate_tokens(await request.aread(), self.scheduler.completion_tokens)
+        attempt = 0
+        while True:
+            try:
+                await self.scheduler.aacquire(tokens)
+            except Overloaded:
+                self.scheduler.shed(endpoint)
+                raise
+            try:
+                response = await self.inner.handle_async_request(request)
+            except BaseException as e:
+                self.scheduler.release()
+                if not isinstance(e, httpx.TransportError):
+                    raise
+                delay, response = self.scheduler.retry_delay(endpoint, attempt, None), None
+                if delay is None:
+                    raise
+            else:
+                if response.is_closed:
+                    self.scheduler.release()
+                else:
+                    response.stream = _AsyncReleasingStream(response.stream, self.scheduler)
+            if response is not None:
+                try:
+                    delay = self.scheduler.retry_delay(endpoint, attempt, response)
+                except Overloaded:
+                    await response.aclose()
+                    raise
+                if delay is None:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
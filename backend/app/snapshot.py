@@ -0,0 +1,277 @@
+"""On-disk snapshot of the in-process vector and lexical indexes, memory-mapped by every worker.
+
+Layout of the snapshot directory (``SNAPSHOT_DIR``)::
+
+    manifest.json              the current snapshot's manifest, plus its ``path``
+    <version>/vectors.npy      float32 (rows, dim), rows L2-normalized
+    <version>/ids.npy          uint8 (rows, 12): the ObjectId of each row (zeros: unused row)
+    <version>/lexical.json     identifier token -> row numbers
+    <version>/manifest.json    rows, dim, embedding model, high_water (largest _id included)
+
+Workers open ``vectors.npy`` with ``np.load(mmap_mode="r")``, so the OS page
+cache holds one copy of the matrix for all of them, and replay from MongoDB
+only the documents ingested after the high-water mark. A new snapshot is
+written to a fresh version directory and published by atomically replacing
+the top-level manifest; older versions are pruned.
+
+Run from ``backend/``::
+
+    python -m app.snapshot build     # from MongoDB
+    python -m app.snapshot info
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+
+import numpy as np
+from bson import ObjectId
+
+from .lexical_index import tokenize
+from .quantization import EMBEDDING_PROJECTION, HAS_EMBEDDING, decode_embedding
+
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+# Snapshot versions kept on disk (workers may still have an older one mapped)
+KEEP_VERSIONS = 2
+
+
+class Snapshot:
+    """An opened snapshot: manifest, row ids, memory-mapped vectors and lexical postings."""
+
+    def __init__(self, manifest: Dict[str, Any], ids: List[Optional[ObjectId]], vectors: np.ndarray, postings: Dict[str, Set[Any]]):
+        self.manifest = manifest
+        self.ids = ids
+        self.vectors = vectors
+        self.postings = postings
+
+    @property
+    def high_water(self) -> Optional[ObjectId]:
+        hw = self.manifest.get("high_water")
+        return ObjectId(hw) if hw else None
+
+    def newer_filter(self, margin_seconds: float = 0.0) -> Dict[str, Any]:
+        """Mongo filter for documents that may be missing from the snapshot.
+
+        ``margin_seconds`` reaches back before the high-water mark, for
+        documents whose ids were generated before it but inserted after the
+        snapshot was taken; the caller skips ids it already has.
+        """
+        return newer_than(self.high_water, margin_seconds)
+
+
+def newer_than(high_water: Optional[ObjectId], margin_seconds: float = 0.0) -> Dict[str, Any]:
+    """Mongo filter for documents with an ``_id`` after ``high_water``, less ``margin_seconds`` (everything if None)."""
+    if high_water is None:
+        return {}
+    if margin_seconds <= 0:
+        return {"_id": {"$gt": high_water}}
+    return {"_id": {"$gt": ObjectId.from_datetime(high_water.generation_time - timedelta(seconds=margin_seconds))}}
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _write_json(path: str, data: Any) -> None:
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+class SnapshotWriter:
+    """Write one snapshot version of up to ``rows`` vectors of ``dim``; ``commit()`` publishes it."""
+
+    def __init__(self, directory: str, rows: int, dim: int, model: str):
+        self.directory = directory
+        self.version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ") + f"-{os.getpid()}"
+        self.path = os.path.join(directory, self.version)
+        os.makedirs(self.path)
+        self.model = model
+        self.dim = dim
+        self.capacity = rows
+        # the file starts zero-filled, so unwritten rows are zero vectors
+        self.vectors = np.lib.format.open_memmap(
+            os.path.join(self.path, "vectors.npy"), mode="w+", dtype=np.float32, shape=(rows, dim)
+        )
+        self.ids = np.zeros((rows, 12), dtype=np.uint8)
+        self.postings: Dict[str, List[int]] = {}
+        self.count = 0
+        self.high_water: Optional[ObjectId] = None
+
+    def append(self, ids: Sequence[Optional[ObjectId]], vectors: np.ndarray) -> int:
+        """Write rows for ``ids`` (None: unused row); returns the number of the first row written."""
+        n = min(len(ids), self.capacity - self.count)
+        start = self.count
+        if n <= 0:
+            return start
+        self.vectors[start : start + n] = _normalize(np.asarray(vectors[:n], dtype=np.float32))
+        for offset, doc_id in enumerate(ids[:n]):
+            if doc_id is None:
+                continue
+            self.ids[start + offset] = np.frombuffer(doc_id.binary, dtype=np.uint8)
+            if self.high_water is None or doc_id > self.high_water:
+                self.high_water = doc_id
+        self.count += n
+        return start
+
+    def add_tokens(self, row: int, tokens: Iterable[str]) -> None:
+        for token in tokens:
+            self.postings.setdefault(token, []).append(row)
+
+    def commit(self) -> Dict[str, Any]:
+        """Flush the files, then make this version the current snapshot."""
+        self.vectors.flush()
+        del self.vectors
+        np.save(os.path.join(self.path, "ids.npy"), self.ids)
+        with open(os.path.join(self.path, "lexical.json"), "w") as f:
+            json.dump(self.postings, f)
+        manifest = {
+            "format": FORMAT_VERSION,
+            "rows": self.capacity,
+            "filled": self.count,
+            "dim": self.dim,
+            "model": self.model,
+            "high_water": str(self.high_water) if self.high_water else None,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        _write_json(os.path.join(self.path, MANIFEST), manifest)
+        _write_json(os.path.join(self.directory, MANIFEST), {**manifest, "path": self.version})
+        _prune(self.directory, keep=self.version)
+        return {**manifest, "path": self.version}
+
+    def abort(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _prune(directory: str, keep: str) -> None:
+    """Remove all but the newest KEEP_VERSIONS version directories (never ``keep``)."""
+    versions = sorted(
+        (name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)) and name != keep), reverse=True
+    )
+    for name in versions[KEEP_VERSIONS - 1 :]:
+        # a worker that still maps the files keeps them readable until it exits
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def read_manifest(directory: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def open_snapshot(directory: str) -> Optional[Snapshot]:
+    """Open the current snapshot in ``directory`` (None if there is none); the vectors are memory-mapped."""
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return None
+    if manifest.get("format") != FORMAT_VERSION:
+        raise ValueError(f"unsupported snapshot format {manifest.get('format')}")
+    path = os.path.join(directory, manifest["path"])
+    vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+    raw = np.load(os.path.join(path, "ids.npy")).tobytes()
+    zero = bytes(12)
+    ids = [None if raw[i : i + 12] == zero else ObjectId(raw[i : i + 12]) for i in range(0, len(raw), 12)]
+    if len(ids) != vectors.shape[0]:
+        raise ValueError("snapshot ids and vectors differ in length")
+    with open(os.path.join(path, "lexical.json")) as f:
+        postings = {token: {ids[r] for r in rows if ids[r] is not None} for token, rows in json.load(f).items()}
+    return Snapshot(manifest, ids, vectors, postings)
+
+
+def build(collection, directory: str, model: str, batch_size: int = 1000) -> Dict[str, Any]:
+    """Write a snapshot of every embedded document in ``collection``, in ``_id`` order."""
+    os.makedirs(directory, exist_ok=True)
+    last = collection.find_one(HAS_EMBEDDING, {"_id": 1}, sort=[("_id", -1)])
+    if last is None:
+        raise ValueError("no embedded documents to snapshot")
+    # documents inserted while the snapshot is written are left to the replay on startup
+    query = {"$and": [HAS_EMBEDDING, {"_id": {"$lte": last["_id"]}}]}
+    rows = collection.count_documents(query)
+    cursor = collection.find(query, {**EMBEDDING_PROJECTION, "text": 1}).sort("_id", 1).batch_size(batch_size)
+    writer: Optional[SnapshotWriter] = None
+    batch_ids: List[ObjectId] = []
+    batch_vectors: List[np.ndarray] = []
+    batch_tokens: List[Set[str]] = []
+
+    def flush() -> None:
+        start = writer.append(batch_ids, np.stack(batch_vectors))
+        for offset, tokens in enumerate(batch_tokens[: writer.count - start]):
+            writer.add_tokens(start + offset, tokens)
+        batch_ids.clear()
+        batch_vectors.clear()
+        batch_tokens.clear()
+
+    try:
+        for d in cursor:
+            vec = decode_embedding(d)
+            if vec is None or not vec.size:
+                continue
+            if writer is None:
+                writer = SnapshotWriter(directory, rows, vec.shape[0], model)
+            elif vec.shape[0] != writer.dim:
+                # skip vectors from a different embedding model
+                continue
+            batch_ids.append(d["_id"])
+            batch_vectors.append(vec)
+            batch_tokens.append(tokenize(d.get("text") or ""))
+            if len(batch_ids) >= batch_size:
+                flush()
+        if writer is None:
+            raise ValueError("no decodable embeddings to snapshot")
+        if batch_ids:
+            flush()
+        return writer.commit()
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+
+
+def _collection():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    uri = os.getenv("MONGO_DB_URI")
+    if not uri:
+        raise RuntimeError("MONGO_DB_URI is required in environment")
+    client = MongoClient(uri)
+    return client[os.getenv("MONGO_DB", "bills_db")][os.getenv("MONGO_COLLECTION", "bills_collection")]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.snapshot", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--dir", default=os.getenv("SNAPSHOT_DIR"), help="snapshot directory (default: SNAPSHOT_DIR)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bld = sub.add_parser("build", help="write a new snapshot from MongoDB")
+    bld.add_argument("--batch-size", type=int, default=1000)
+    bld.add_argument("--model", default="text-embedding-3-small", help="embedding model of the stored vectors (checked on load)")
+    sub.add_parser("info", help="print the current snapshot's manifest")
+    args = parser.parse_args(argv)
+    if not args.dir:
+        parser.error("set SNAPSHOT_DIR or pass --dir")
+
+    if args.command == "info":
+        manifest = read_manifest(args.dir)
+        if manifest is None:
+            print(f"no snapshot in {args.dir}", file=sys.stderr)
+            return 1
+        print(json.dumps(manifest, indent=2))
+        return 0
+
+    manifest = build(_collection(), args.dir, args.model, batch_size=args.batch_size)
+    print(json.dumps(manifest, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
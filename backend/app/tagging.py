@@ -0,0 +1,227 @@
+"""Metadata tagging: batched, concurrency-limited tagger calls and the deferred back-fill.
+
+In deferred mode, ingestion stores chunks untagged and marks the document's
+registry entry ``tagging: "pending"`` with the text to tag (``tag_head``).
+``TagBackfill`` claims pending entries in batches, tags them with the
+tagger's ``tagging_chain.abatch`` (at most ``max_concurrency`` completions in
+flight) and hands the tags to an ``apply`` callback that writes them onto the
+stored chunks. Claims are atomic, so every worker process can run a back-fill.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Union
+
+from langchain_core.documents import Document
+from pymongo import ReturnDocument
+
+from .logs import get_logger, log_event
+from .metrics import REGISTRY
+from .scheduler import overload_of
+
+TAGGED_DOCUMENTS = REGISTRY.counter(
+    "baai_tagging_documents_total", "Documents processed by the deferred tagging back-fill, by outcome", ["outcome"]
+)
+TAG_BATCH_SECONDS = REGISTRY.histogram("baai_tagging_batch_seconds", "Duration of one tagging back-fill batch")
+
+logger = get_logger("baai.tagging")
+
+# Registry states of deferred tagging (documents tagged inline have no ``tagging`` field)
+STATES = ("pending", "running", "done", "failed")
+
+
+def _chain_output(chain, output: Any) -> Dict[str, Any]:
+    """The extracted metadata in one chain result (LLMChain returns ``{"text": {...}}``)."""
+    keys = getattr(chain, "output_keys", None) or []
+    if isinstance(output, dict) and keys and keys[0] in output:
+        output = output[keys[0]]
+    return dict(output or {})
+
+
+def tag_texts(tagger, texts: Sequence[str], max_concurrency: int) -> List[Dict[str, Any]]:
+    """Tag ``texts`` with at most ``max_concurrency`` tagger completions in flight; one metadata dict per text."""
+    if not texts:
+        return []
+    chain = getattr(tagger, "tagging_chain", None)
+    if chain is None:
+        return [dict(d.metadata) for d in tagger.transform_documents([Document(page_content=t) for t in texts])]
+    outputs = chain.batch(list(texts), config={"max_concurrency": max_concurrency})
+    return [_chain_output(chain, o) for o in outputs]
+
+
+async def atag_texts(tagger, texts: Sequence[str], max_concurrency: int) -> List[Union[Dict[str, Any], BaseException]]:
+    """Async ``tag_texts``; a failed text gets its exception instead of metadata."""
+    if not texts:
+        return []
+    chain = getattr(tagger, "tagging_chain", None)
+    if chain is None:
+        limit = asyncio.Semaphore(max_concurrency)
+
+        async def one(text: str) -> Dict[str, Any]:
+            async with limit:
+                return (await asyncio.to_thread(tag_texts, tagger, [text], 1))[0]
+
+        return await asyncio.gather(*(one(t) for t in texts), return_exceptions=True)
+    outputs = await chain.abatch(list(texts), config={"max_concurrency": max_concurrency}, return_exceptions=True)
+    return [o if isinstance(o, BaseException) else _chain_output(chain, o) for o in outputs]
+
+
+class TagBackfill:
+    """Tag documents queued for deferred tagging, ``batch_size`` at a time, in the background.
+
+    ``apply(entry, tags)`` stores the tags of one registry entry and returns
+    extra registry fields to set with ``tagging: "done"``. A failed document
+    goes back to ``pending``, not claimed again for ``poll_seconds`` doubling
+    with every attempt, until it has been tried ``max_attempts`` times; then
+    it stays ``failed`` with its error. Claims older than
+    ``claim_ttl_seconds`` (a worker died mid-batch) are taken over.
+    """
+
+    def __init__(
+        self,
+        registry,
+        tagger: Callable[[], Any],
+        apply: Callable[[Dict[str, Any], Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        batch_size: int = 16,
+        max_concurrency: int = 4,
+        max_attempts: int = 3,
+        claim_ttl_seconds: float = 600.0,
+        poll_seconds: float = 5.0,
+    ):
+        self.registry = registry
+        self.tagger = tagger
+        self.apply = apply
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.claim_ttl_seconds = claim_ttl_seconds
+        self.poll_seconds = poll_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self.stats: Dict[str, Any] = {"batches": 0, "tagged": 0, "failed": 0, "retried": 0, "last_batch_seconds": None, "last_error": None}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Start the back-fill loop on the running event loop (idempotent)."""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self) -> None:
+        """Wake the loop now instead of at its next poll (safe to call from ingestion threads)."""
+        if self._loop is not None and self._wake is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                claimed = await self.run_once()
+            except Exception as e:
+                self.stats["last_error"] = str(e)
+                log_event(logger, "tagging_batch_failed", level=logging.ERROR, exc_info=True)
+                claimed = 0
+            if claimed:
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self) -> List[Dict[str, Any]]:
+        now = datetime.utcnow()
+        stale = datetime.utcfromtimestamp(time.time() - self.claim_ttl_seconds)
+        claimed = []
+        for _ in range(self.batch_size):
+            entry = await self.registry.find_one_and_update(
+                {
+                    "$or": [
+                        {"tagging": "pending", "tagging_retry_at": {"$not": {"$gt": now}}},
+                        {"tagging": "running", "tagging_claimed_at": {"$lt": stale}},
+                    ]
+                },
+                {"$set": {"tagging": "running", "tagging_claimed_at": datetime.utcnow()}, "$inc": {"tagging_attempts": 1}},
+                sort=[("_id", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if entry is None:
+                break
+            claimed.append(entry)
+        return claimed
+
+    async def run_once(self) -> int:
+        """Claim and tag one batch; returns the number of documents claimed."""
+        entries = await self._claim()
+        if not entries:
+            return 0
+        started = time.perf_counter()
+        results = await atag_texts(self.tagger(), [e.get("tag_head") or "" for e in entries], self.max_concurrency)
+        outcomes = {"tagged": 0, "retried": 0, "failed": 0}
+        for entry, tags in zip(entries, results):
+            if not isinstance(tags, BaseException):
+                try:
+                    fields = await self.apply(entry, tags)
+                    await self.registry.update_one(
+                        {"_id": entry["_id"]},
+                        {
+                            "$set": {**fields, "tagging": "done", "tagged_at": datetime.utcnow()},
+                            "$unset": {"tag_head": "", "tag_exclude": "", "tagging_claimed_at": "", "tagging_error": "", "tagging_retry_at": ""},
+                        },
+                    )
+                    outcomes["tagged"] += 1
+                    continue
+                except Exception as e:
+                    tags = e
+            attempts = entry.get("tagging_attempts", 1)
+            overload = overload_of(tags)
+            if overload is not None:
+                # shed by the OpenAI scheduler: try again when it says, without using up an attempt
+                outcome, delay, inc = "retried", overload.retry_after, {"tagging_attempts": -1}
+            else:
+                outcome = "failed" if attempts >= self.max_attempts else "retried"
+                delay, inc = self.poll_seconds * 2 ** (attempts - 1), {}
+            await self.registry.update_one(
+                {"_id": entry["_id"]},
+                {
+                    "$set": {
+                        "tagging": "failed" if outcome == "failed" else "pending",
+                        "tagging_error": str(tags),
+                        "tagging_retry_at": datetime.utcfromtimestamp(time.time() + delay),
+                    },
+                    **({"$inc": inc} if inc else {}),
+                },
+            )
+            outcomes[outcome] += 1
+            self.stats["last_error"] = str(tags)
+            log_event(logger, "tagging_document_failed", level=logging.WARNING, document_id=str(entry["_id"]), outcome=outcome, error=str(tags))
+        elapsed = time.perf_counter() - started
+        TAG_BATCH_SECONDS.observe(elapsed)
+        for outcome, n in outcomes.items():
+            if n:
+                TAGGED_DOCUMENTS.inc(n, outcome=outcome)
+            self.stats[outcome] += n
+        self.stats["batches"] += 1
+        self.stats["last_batch_seconds"] = round(elapsed, 3)
+        log_event(logger, "tagging_batch", documents=len(entries), seconds=round(elapsed, 3), **outcomes)
+        return len(entries)
+
+    async def progress(self) -> Dict[str, Any]:
+        """Documents per deferred-tagging state (all workers) and this worker's back-fill counters."""
+        counts = {state: await self.registry.count_documents({"tagging": state}) for state in STATES}
+        return {**counts, "worker": {"running": self.running, **self.stats}}
@@ -0,0 +1,241 @@
+"""In-process similarity index over the chunk embeddings stored in MongoDB."""
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .quantization import EMBEDDING_PROJECTION, HAS_EMBEDDING, decode_embedding
+
+
+class VectorIndex:
+    """Pre-normalized float32 matrix plus a parallel id list.
+
+    Rows are L2-normalized when they are added, so scoring a query against the
+    whole corpus is a single matrix-vector product and top-k selection is an
+    ``np.argpartition`` over the scores. Rows are only ever appended; the
+    backing buffer grows geometrically so ingestion stays amortized O(1).
+
+    The first rows may come from a read-only base matrix (``attach()``, e.g. a
+    memory-mapped snapshot shared by every worker process); rows added after
+    that live in the in-memory buffer. Row numbers run across both.
+    """
+
+    def __init__(self, initial_capacity: int = 1024):
+        self._lock = threading.Lock()
+        self._initial_capacity = max(1, initial_capacity)
+        self._base: Optional[np.ndarray] = None
+        self._base_size = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._ids: List[Any] = []
+        self._rows: Dict[Any, int] = {}
+        self._size = 0  # rows in the in-memory buffer
+        # rows that no longer belong to their id (discarded, re-added or unused), masked out of searches
+        self._dead: Set[int] = set()
+        self._dead_rows: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self._base_size + self._size
+
+    def __contains__(self, doc_id: Any) -> bool:
+        return doc_id in self._rows
+
+    @property
+    def dim(self) -> Optional[int]:
+        if self._base is not None:
+            return self._base.shape[1]
+        return None if self._matrix is None else self._matrix.shape[1]
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _reserve(self, extra: int, dim: int) -> None:
+        """Grow the backing buffer so ``extra`` more rows fit. Caller holds the lock."""
+        index_dim = self.dim
+        if index_dim is not None and index_dim != dim:
+            raise ValueError(f"embedding dimension {dim} does not match index dimension {index_dim}")
+        if self._matrix is None:
+            capacity = max(self._initial_capacity, extra)
+            self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+            return
+        needed = self._size + extra
+        if needed <= self._matrix.shape[0]:
+            return
+        capacity = max(needed, self._matrix.shape[0] * 2)
+        grown = np.zeros((capacity, dim), dtype=np.float32)
+        grown[: self._size] = self._matrix[: self._size]
+        # Searches in flight keep a reference to the old buffer, which stays valid.
+        self._matrix = grown
+
+    def add(self, ids: Sequence[Any], vectors: Iterable[Sequence[float]]) -> None:
+        """Append ``vectors`` under the matching ``ids``."""
+        vecs = np.asarray(vectors, dtype=np.float32)
+        if vecs.ndim == 1:
+            vecs = vecs.reshape(1, -1)
+        if len(ids) != vecs.shape[0]:
+            raise ValueError("ids and vectors must have the same length")
+        if not len(ids):
+            return
+        vecs = self._normalize(vecs)
+        with self._lock:
+            self._reserve(vecs.shape[0], vecs.shape[1])
+            self._matrix[self._size : self._size + vecs.shape[0]] = vecs
+            self._ids.extend(ids)
+            start = self._base_size + self._size
+            for offset, doc_id in enumerate(ids):
+                previous = self._rows.get(doc_id)
+                if previous is not None:
+                    self._mark_dead(previous)
+                self._rows[doc_id] = start + offset
+            self._size += vecs.shape[0]
+
+    def attach(self, ids: Sequence[Any], vectors: np.ndarray) -> None:
+        """Replace the contents with ``vectors``, rows already L2-normalized, used in place (never written).
+
+        ``ids[i]`` is the id of row ``i``; None marks an unused row.
+        """
+        if len(ids) != vectors.shape[0]:
+            raise ValueError("ids and vectors must have the same length")
+        rows = {doc_id: r for r, doc_id in enumerate(ids) if doc_id is not None}
+        dead = {r for r, doc_id in enumerate(ids) if doc_id is None or rows[doc_id] != r}
+        with self._lock:
+            self._base, self._base_size = vectors, vectors.shape[0]
+            self._matrix, self._size = None, 0
+            self._ids, self._rows = list(ids), rows
+            self._dead, self._dead_rows = dead, None
+
+    def discard(self, ids: Iterable[Any]) -> None:
+        """Drop ``ids`` from search results (in-memory rows are zeroed; slots are not reused)."""
+        with self._lock:
+            for doc_id in ids:
+                row = self._rows.pop(doc_id, None)
+                if row is not None:
+                    self._mark_dead(row)
+
+    def _mark_dead(self, row: int) -> None:
+        """Exclude ``row`` from searches. Caller holds the lock."""
+        self._dead.add(row)
+        self._dead_rows = None
+        if row >= self._base_size:
+            self._matrix[row - self._base_size] = 0.0
+
+    @staticmethod
+    def _gather(base: Optional[np.ndarray], base_size: int, matrix: Optional[np.ndarray], rows: np.ndarray) -> np.ndarray:
+        """The given rows (numbered across the base and the in-memory buffer), in order."""
+        if base is None:
+            return matrix[rows]
+        if matrix is None:
+            return base[rows]
+        in_base = rows < base_size
+        out = np.empty((rows.size, base.shape[1]), dtype=np.float32)
+        out[in_base] = base[rows[in_base]]
+        out[~in_base] = matrix[rows[~in_base] - base_size]
+        return out
+
+    def search(self, query: Sequence[float], k: int, candidates: Optional[Iterable[Any]] = None) -> List[Tuple[Any, float]]:
+        """Return up to ``k`` ``(id, cosine_score)`` pairs, best first.
+
+        With ``candidates``, only those ids are scored (a gather of their rows
+        followed by the same matrix-vector product). Discarded rows are masked
+        out before the top-k selection, so ``k`` results come back whenever
+        that many live rows exist.
+        """
+        q = np.asarray(query, dtype=np.float32).ravel()
+        q_norm = np.linalg.norm(q)
+        with self._lock:
+            base, base_size, matrix, size, ids = self._base, self._base_size, self._matrix, self._size, self._ids
+            rows = dead = None
+            if candidates is not None:
+                rows = np.fromiter({self._rows[c] for c in candidates if c in self._rows}, dtype=np.int64)
+            elif self._dead:
+                if self._dead_rows is None:
+                    self._dead_rows = np.fromiter(self._dead, dtype=np.int64, count=len(self._dead))
+                dead = self._dead_rows
+        dim = self.dim
+        if dim is None or base_size + size == 0 or k <= 0 or q_norm == 0 or (rows is not None and rows.size == 0):
+            return []
+        if q.shape[0] != dim:
+            raise ValueError(f"query dimension {q.shape[0]} does not match index dimension {dim}")
+        q = q / q_norm
+        if rows is not None:
+            scores = self._gather(base, base_size, matrix, rows) @ q
+        elif base is None:
+            scores = matrix[:size] @ q
+        elif size == 0:
+            scores = base[:base_size] @ q
+        else:
+            scores = np.concatenate([base[:base_size] @ q, matrix[:size] @ q])
+        if dead is not None:
+            scores[dead] = -np.inf
+        k = min(k, scores.shape[0] - (0 if dead is None else dead.size))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        picked = top if rows is None else rows[top]
+        return [(ids[r], float(scores[i])) for i, r in zip(top, picked) if ids[r] in self._rows]
+
+    def vectors(self, ids: Sequence[Any]) -> Tuple[List[Any], np.ndarray]:
+        """Return the indexed ids among ``ids`` (in order) and their normalized rows."""
+        with self._lock:
+            base, base_size, matrix = self._base, self._base_size, self._matrix
+            found = [(doc_id, self._rows[doc_id]) for doc_id in ids if doc_id in self._rows]
+        if not found:
+            return [], np.zeros((0, self.dim or 0), dtype=np.float32)
+        rows = np.fromiter((row for _, row in found), dtype=np.int64, count=len(found))
+        return [doc_id for doc_id, _ in found], self._gather(base, base_size, matrix, rows)
+
+    @staticmethod
+    def _batches(
+        collection, query: Dict[str, Any], batch_size: int, dim: Optional[int] = None
+    ) -> Iterator[Tuple[List[Any], np.ndarray]]:
+        """Decode the embeddings of the documents matching ``query`` into float32 batches.
+
+        Both plain float arrays and packed float16/int8 vectors are accepted;
+        vectors are gathered into a preallocated batch buffer. Vectors of
+        another dimension than ``dim`` (or the first one seen) are skipped.
+        """
+        cursor = collection.find(query, EMBEDDING_PROJECTION).batch_size(batch_size)
+        batch_ids: List[Any] = []
+        buffer: Optional[np.ndarray] = None
+        for d in cursor:
+            vec = decode_embedding(d)
+            if vec is None or not vec.size:
+                continue
+            if buffer is None:
+                if dim is not None and vec.shape[0] != dim:
+                    continue
+                buffer = np.empty((batch_size, vec.shape[0]), dtype=np.float32)
+            elif vec.shape[0] != buffer.shape[1]:
+                # skip vectors from a different embedding model
+                continue
+            buffer[len(batch_ids)] = vec
+            batch_ids.append(d["_id"])
+            if len(batch_ids) == batch_size:
+                yield batch_ids, buffer
+                batch_ids = []
+        if batch_ids:
+            yield batch_ids, buffer[: len(batch_ids)]
+
+    def load(self, collection, batch_size: int = 1000) -> int:
+        """Rebuild the index from every document in ``collection`` that has an embedding."""
+        fresh = VectorIndex(initial_capacity=self._initial_capacity)
+        for batch_ids, vectors in self._batches(collection, HAS_EMBEDDING, batch_size):
+            fresh.add(batch_ids, vectors)
+        with self._lock:
+            self._base, self._base_size = None, 0
+            self._matrix, self._ids, self._rows, self._size = fresh._matrix, fresh._ids, fresh._rows, fresh._size
+            self._dead, self._dead_rows = fresh._dead, None
+        return len(self)
+
+    def replay(self, collection, query: Dict[str, Any], batch_size: int = 1000) -> int:
+        """Append the documents matching ``query`` that are not indexed yet; returns how many were added."""
+        added = 0
+        for batch_ids, vectors in self._batches(collection, {"$and": [HAS_EMBEDDING, query]}, batch_size, self.dim):
+            keep = [i for i, doc_id in enumerate(batch_ids) if doc_id not in self._rows]
+            if keep:
+                self.add([batch_ids[i] for i in keep], vectors[keep])
+                added += len(keep)
+        return added
@@ -0,0 +1,279 @@
+"""Offline stand-ins for the OpenAI clients, the LLM metadata tagger and the async MongoDB driver."""
+import asyncio
+import hashlib
+import re
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class HashedEmbeddings(Embeddings):
+    """Deterministic bag-of-words vectors: every word hashes to a signed dimension.
+
+    Texts sharing words get similar vectors, so retrieval behaves sensibly,
+    and ``latency_ms`` simulates the provider round trip per call.
+    """
+
+    def __init__(self, dim: int = 1536, latency_ms: float = 0.0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self.inputs = 0
+
+    def _vector(self, text: str) -> List[float]:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        return (vec / norm if norm else vec).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.inputs += len(texts)
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.inputs += len(texts)
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000.0)
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class CannedChatModel(BaseChatModel):
+    """Chat model that answers with a canned text after ``latency_ms``, optionally streamed word by word."""
+
+    answer: str = "The total amount due on the matching bill is 1,234.56 USD, due on 2025-02-15."
+    latency_ms: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "canned-bench"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        return self._result(messages)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self.calls += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000.0)
+        return self._result(messages)
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        message = AIMessage(
+            content=self.answer,
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": len(self.answer) // 4,
+                "total_tokens": prompt_tokens + len(self.answer) // 4,
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        self.calls += 1
+        words = self.answer.split(" ")
+        for i, word in enumerate(words):
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000.0 / len(words))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        self.calls += 1
+        words = self.answer.split(" ")
+        for i, word in enumerate(words):
+            if self.latency_ms:
+                await asyncio.sleep(self.latency_ms / 1000.0 / len(words))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+
+
+_VENDOR = re.compile(r"Vendor:\s*(.+)")
+_FIELD = re.compile(r"(Bill date|Due date|Total|Account):\s*(\S+)")
+
+
+class _RegexTaggingChain:
+    """The fake tagger's ``tagging_chain``: ``batch``/``abatch`` return ``{"text": tags}`` per input, like LLMChain."""
+
+    output_keys = ["text"]
+
+    def __init__(self, tagger: "RegexMetadataTagger"):
+        self.tagger = tagger
+
+    def batch(self, inputs: List[str], config: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Dict[str, Any]]:
+        from concurrent.futures import ThreadPoolExecutor
+
+        workers = (config or {}).get("max_concurrency") or len(inputs)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            return [{"text": tags} for tags in pool.map(self.tagger.tags, inputs)]
+
+    async def abatch(
+        self, inputs: List[str], config: Optional[Dict[str, Any]] = None, return_exceptions: bool = False, **kwargs: Any
+    ) -> List[Any]:
+        limit = asyncio.Semaphore(max(1, (config or {}).get("max_concurrency") or len(inputs)))
+
+        async def one(text: str) -> Dict[str, Any]:
+            async with limit:
+                if self.tagger.latency_ms:
+                    await asyncio.sleep(self.tagger.latency_ms / 1000.0)
+                return {"text": self.tagger.tags(text, sleep=False)}
+
+        return await asyncio.gather(*(one(t) for t in inputs), return_exceptions=return_exceptions)
+
+
+class RegexMetadataTagger:
+    """Replacement for ``create_metadata_tagger`` that reads the fields of the synthetic bills."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self.tagging_chain = _RegexTaggingChain(self)
+
+    def tags(self, text: str, sleep: bool = True) -> Dict[str, Any]:
+        self.calls += 1
+        if self.latency_ms and sleep:
+            time.sleep(self.latency_ms / 1000.0)
+        fields = dict(_FIELD.findall(text))
+        vendor = _VENDOR.search(text)
+        return {
+            "title": f"Bill from {vendor.group(1).strip()}" if vendor else "Document",
+            "keywords": ["bill", "invoice"],
+            "hasCode": False,
+            "vendor": vendor.group(1).strip() if vendor else None,
+            "bill_date": fields.get("Bill date"),
+            "due_date": fields.get("Due date"),
+            "total_amount": fields.get("Total"),
+            "currency": "USD",
+            "account_number": fields.get("Account"),
+        }
+
+    def transform_documents(self, documents: List[Document], **kwargs: Any) -> List[Document]:
+        return [
+            Document(page_content=d.page_content, metadata={**self.tags(d.page_content), **d.metadata}) for d in documents
+        ]
+
+
+class _AsyncCursor:
+    """Async iteration over a mongomock cursor (enough of PyMongo's AsyncCursor for the app)."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+
+        def chain(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return _AsyncCursor(result) if result is self._cursor else result
+
+        return chain
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def close(self):
+        self._cursor.close()
+
+    async def to_list(self, length: Optional[int] = None):
+        return list(self._cursor) if length is None else [d for _, d in zip(range(length), self._cursor)]
+
+
+class _AsyncCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return _AsyncCursor(self._collection.find(*args, **kwargs))
+
+    async def aggregate(self, *args, **kwargs):
+        return _AsyncCursor(self._collection.aggregate(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+class _AsyncDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name):
+        return _AsyncCollection(self._database[name])
+
+    __getattr__ = __getitem__
+
+    async def command(self, *args, **kwargs):
+        return {"ok": 1.0}
+
+
+class AsyncMongoMock:
+    """``AsyncMongoClient`` stand-in over a mongomock client, so both drivers see the same data."""
+
+    def __init__(self, sync_client):
+        self._client = sync_client
+
+    def __getitem__(self, name):
+        return _AsyncDatabase(self._client[name])
+
+    @property
+    def admin(self):
+        return _AsyncDatabase(self._client["admin"])
+
+    async def close(self):
+        pass
@@ -0,0 +1,344 @@
+"""Offline benchmark: ingestion throughput and query latency versus corpus size.
+
+Runs the FastAPI app in-process with deterministic stand-ins for the OpenAI
+embeddings, chat model and metadata tagger, against mongomock (default) or
+a local mongod (``--mongo-uri``). Prints a JSON report; pass ``--baseline``
+with an earlier report to print the relative change of every metric.
+
+Run from ``backend/``::
+
+    python -m benchmarks.run --sizes 1000 10000 100000 --output bench.json
+    python -m benchmarks.run --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .fakes import AsyncMongoMock, CannedChatModel, HashedEmbeddings, RegexMetadataTagger
+from .synthetic import bill_pdfs, chunk_records, questions
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def latency_summary(samples_s: List[float]) -> Dict[str, float]:
+    ms = np.asarray(samples_s) * 1000.0
+    return {
+        "count": int(ms.size),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def _mongomock_bulk_write(self, requests, ordered=True, **kwargs):
+    """mongomock's bulk_write predates the current pymongo operation classes; apply UpdateOne ops one by one."""
+    for op in requests:
+        self.update_one(op._filter, op._doc, upsert=op._upsert)
+
+
+def load_app(args):
+    """Import ``app.main`` with the OpenAI clients, the tagger and (optionally) MongoDB replaced."""
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    os.environ["MONGO_DB_URI"] = args.mongo_uri or "mongodb://benchmark.invalid:27017"
+    os.environ["MONGO_DB"] = f"bench_{os.getpid()}"
+    # per-request logs would dominate the measurement
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import langchain_openai
+    import pymongo
+
+    fakes = {
+        "embeddings": HashedEmbeddings(latency_ms=args.embed_latency_ms),
+        "llm": CannedChatModel(latency_ms=args.llm_latency_ms),
+        "tagger": RegexMetadataTagger(latency_ms=args.tag_latency_ms),
+    }
+    langchain_openai.OpenAIEmbeddings = lambda **kwargs: fakes["embeddings"]
+
+    def chat_model(callbacks=None, **kwargs):
+        # keep the app's callbacks (token usage metrics) on the fake model
+        fakes["llm"].callbacks = callbacks
+        return fakes["llm"]
+
+    langchain_openai.ChatOpenAI = chat_model
+    if not args.mongo_uri:
+        import mongomock
+
+        mongomock.collection.Collection.bulk_write = _mongomock_bulk_write
+        # one in-memory server shared by the sync and the async client
+        shared = {}
+
+        def sync_client(uri, **kwargs):
+            return shared.setdefault(uri, mongomock.MongoClient(uri))
+
+        pymongo.MongoClient = sync_client
+        pymongo.AsyncMongoClient = lambda uri, **kwargs: AsyncMongoMock(sync_client(uri))
+
+    from app import main
+
+    main.create_metadata_tagger = lambda metadata_schema, llm, **kwargs: fakes["tagger"]
+    main.TAGGING_MODE = args.tagging
+    return main, fakes
+
+
+def wait_ready(client, timeout: float = 600.0) -> None:
+    """Block until the app reports ready (indexes loaded in the background)."""
+    deadline = time.monotonic() + timeout
+    while client.get("/api/health/ready").status_code != 200:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"app not ready: {client.get('/api/health/ready').json()}")
+        time.sleep(0.05)
+
+
+def bench_ingest_jobs(client, count: int, start_seed: int) -> Dict[str, Any]:
+    """Submit PDFs to /api/ingest_pdf and wait for every job."""
+    files = list(bill_pdfs(count, start_seed=start_seed))
+    started = time.perf_counter()
+    job_ids = []
+    for f in files:
+        r = client.post("/api/ingest_pdf", files={"file": (f["name"], f["contents"], "application/pdf")})
+        r.raise_for_status()
+        job_ids.append(r.json()["job_id"])
+    chunks = failed = 0
+    for job_id in job_ids:
+        while True:
+            job = client.get(f"/api/jobs/{job_id}").json()
+            if job["status"] in ("done", "failed"):
+                break
+            time.sleep(0.005)
+        if job["status"] == "failed":
+            failed += 1
+        else:
+            chunks += job["result"]["inserted_count"]
+    elapsed = time.perf_counter() - started
+    return {"files": count, "failed": failed, "chunks": chunks, "seconds": elapsed, "docs_per_sec": count / elapsed, "chunks_per_sec": chunks / elapsed}
+
+
+def bench_ingest_batch(client, count: int, start_seed: int, batch_size: int) -> Dict[str, Any]:
+    """Send PDFs to /api/ingest_pdfs in multipart batches."""
+    files = list(bill_pdfs(count, start_seed=start_seed))
+    started = time.perf_counter()
+    chunks = failed = 0
+    for i in range(0, len(files), batch_size):
+        batch = files[i : i + batch_size]
+        r = client.post("/api/ingest_pdfs", files=[("files", (f["name"], f["contents"], "application/pdf")) for f in batch])
+        r.raise_for_status()
+        for result in r.json()["files"]:
+            failed += 1 if result.get("error") else 0
+            chunks += result["inserted_count"]
+    elapsed = time.perf_counter() - started
+    return {"files": count, "failed": failed, "chunks": chunks, "seconds": elapsed, "docs_per_sec": count / elapsed, "chunks_per_sec": chunks / elapsed}
+
+
+def wait_tagged(client, timeout: float = 600.0) -> Dict[str, Any]:
+    """Wait for the deferred tagging back-fill to drain; reports how long that took after ingestion."""
+    started = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    while True:
+        progress = client.get("/api/tagging").json()
+        if not progress["pending"] and not progress["running"]:
+            break
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"tagging back-fill not drained: {progress}")
+        time.sleep(0.01)
+    return {"seconds": time.perf_counter() - started, "done": progress["done"], "failed": progress["failed"]}
+
+
+def seed_corpus(main, fakes, target: int, batch_size: int = 2000) -> float:
+    """Insert synthetic pre-embedded chunks until the collection holds ``target`` documents."""
+    from app.quantization import encode_embedding
+
+    started = time.perf_counter()
+    have = main.collection.count_documents({})
+    seed = 1_000_000 + have
+    while have < target:
+        n = min(batch_size, target - have)
+        records = list(chunk_records(n, start_seed=seed))
+        vectors = fakes["embeddings"].embed_documents([r["text"] for r in records])
+        for r, v in zip(records, vectors):
+            r.update(encode_embedding(v, main.EMBEDDING_STORAGE))
+        main.collection.insert_many(records)
+        have += n
+        seed += n
+    return time.perf_counter() - started
+
+
+def bench_queries(client, count: int, top_k: int, seed: int, endpoint: str = "/api/query") -> Dict[str, Any]:
+    samples = []
+    context_tokens = []
+    for q in questions(count, seed=seed):
+        started = time.perf_counter()
+        r = client.post(endpoint, json={"question": q, "top_k": top_k})
+        if endpoint.endswith("/stream"):
+            for _ in r.iter_lines():
+                pass
+        r.raise_for_status()
+        samples.append(time.perf_counter() - started)
+        if not endpoint.endswith("/stream"):
+            context_tokens.append(r.json()["context"]["tokens"])
+    summary = latency_summary(samples)
+    if context_tokens:
+        summary["context_tokens_mean"] = sum(context_tokens) / len(context_tokens)
+    return summary
+
+
+def bench_concurrent_queries(client, count: int, concurrency: int, top_k: int, seed: int) -> Dict[str, Any]:
+    """Fire ``count`` distinct queries with ``concurrency`` in flight; reports throughput and latency."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def one(q: str) -> float:
+        started = time.perf_counter()
+        client.post("/api/query", json={"question": q, "top_k": top_k}).raise_for_status()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, questions(count, seed=seed)))
+    elapsed = time.perf_counter() - started
+    return {"concurrency": concurrency, "seconds": elapsed, "queries_per_sec": count / elapsed, **latency_summary(samples)}
+
+
+def run(args) -> Dict[str, Any]:
+    main, fakes = load_app(args)
+    from fastapi.testclient import TestClient
+
+    report: Dict[str, Any] = {
+        "commit": git_commit(),
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "mongo": "local mongod" if args.mongo_uri else "mongomock",
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "ingest": {},
+        "query": [],
+    }
+    with TestClient(main.app) as client:
+        wait_ready(client)
+        if args.ingest_files:
+            report["ingest"]["ingest_pdf_jobs"] = bench_ingest_jobs(client, args.ingest_files, start_seed=0)
+            report["ingest"]["ingest_pdfs_batch"] = bench_ingest_batch(
+                client, args.ingest_files, start_seed=args.ingest_files, batch_size=args.batch_files
+            )
+            if args.tagging == "deferred":
+                report["ingest"]["tagging_backfill"] = wait_tagged(client)
+            report["ingest"]["peak_rss_mb"] = peak_rss_mb()
+
+        for size in sorted(args.sizes):
+            seed_s = seed_corpus(main, fakes, size)
+            started = time.perf_counter()
+            main.vector_index.load(main.collection)
+            main.lexical_index.load(main.collection)
+            load_s = time.perf_counter() - started
+            # cold start from a memory-mapped snapshot; the queries below then run against it
+            from app import snapshot
+
+            snapshot_dir = tempfile.mkdtemp(prefix="bench-snapshot-")
+            started = time.perf_counter()
+            snapshot.build(main.collection, snapshot_dir, main.EMBEDDING_MODEL)
+            snapshot_build_s = time.perf_counter() - started
+            main.SNAPSHOT_DIR = snapshot_dir
+            # the corpus was seeded seconds ago: a replay margin would re-scan all of it
+            main.SNAPSHOT_REPLAY_MARGIN_SECONDS = 0
+            started = time.perf_counter()
+            main.load_vector_index()
+            snapshot_load_s = time.perf_counter() - started
+            entry = {
+                "corpus_chunks": main.collection.count_documents({}),
+                "seed_seconds": seed_s,
+                "index_load_seconds": load_s,
+                "snapshot_build_seconds": snapshot_build_s,
+                "snapshot_load_seconds": snapshot_load_s,
+                "query": bench_queries(client, args.queries, args.top_k, seed=size),
+                "query_stream": bench_queries(client, max(1, args.queries // 4), args.top_k, seed=size + 1, endpoint="/api/query/stream"),
+                "query_concurrent": bench_concurrent_queries(client, args.queries, args.concurrency, args.top_k, seed=size + 2)
+                if args.concurrency
+                else None,
+                "peak_rss_mb": peak_rss_mb(),
+            }
+            main.SNAPSHOT_DIR = ""
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+            report["query"].append(entry)
+            print(f"corpus={entry['corpus_chunks']} p50={entry['query']['p50_ms']:.2f}ms p99={entry['query']['p99_ms']:.2f}ms", file=sys.stderr)
+
+    report["provider_calls"] = {
+        "embedding_calls": fakes["embeddings"].calls,
+        "embedding_inputs": fakes["embeddings"].inputs,
+        "llm_calls": fakes["llm"].calls,
+        "tagger_calls": fakes["tagger"].calls,
+    }
+    report["peak_rss_mb"] = peak_rss_mb()
+    if args.mongo_uri:
+        main.client.drop_database(os.environ["MONGO_DB"])
+    return report
+
+
+def compare(current: Any, baseline: Any, path: str = "") -> List[str]:
+    """List ``metric: baseline -> current (+x%)`` for every numeric metric present in both reports."""
+    lines = []
+    if isinstance(current, dict) and isinstance(baseline, dict):
+        for k in current:
+            if k in baseline and k != "settings":
+                lines.extend(compare(current[k], baseline[k], f"{path}.{k}" if path else k))
+    elif isinstance(current, list) and isinstance(baseline, list):
+        for i, (c, b) in enumerate(zip(current, baseline)):
+            lines.extend(compare(c, b, f"{path}[{i}]"))
+    elif isinstance(current, (int, float)) and isinstance(baseline, (int, float)) and not isinstance(current, bool):
+        change = (current - baseline) / baseline * 100 if baseline else 0.0
+        lines.append(f"{path}: {baseline:.4g} -> {current:.4g} ({change:+.1f}%)")
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="corpus sizes (chunks) to measure queries at")
+    parser.add_argument("--queries", type=int, default=200, help="queries per corpus size")
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=32, help="in-flight queries for the concurrent phase (0 to skip)")
+    parser.add_argument("--ingest-files", type=int, default=50, help="PDFs per ingestion benchmark (0 to skip)")
+    parser.add_argument("--batch-files", type=int, default=25, help="PDFs per /api/ingest_pdfs request")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="simulated latency per embeddings call")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated latency per chat completion")
+    parser.add_argument("--tag-latency-ms", type=float, default=0.0, help="simulated latency per tagged document")
+    parser.add_argument("--tagging", choices=("inline", "deferred"), default="inline", help="TAGGING_MODE of the app")
+    parser.add_argument("--mongo-uri", default=None, help="use this mongod instead of mongomock (a throwaway database is created)")
+    parser.add_argument("--output", default=None, help="also write the JSON report to this file")
+    parser.add_argument("--baseline", default=None, help="earlier JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(text + "\n")
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        print("\n".join(compare(report, baseline)), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Synthetic bills: plain text, minimal PDFs and pre-embedded chunk corpora."""
+import random
+from datetime import date, timedelta
+from typing import Dict, Iterator, List
+
+VENDORS = [
+    "Manila Electric Company",
+    "Maynilad Water Services",
+    "Globe Telecom",
+    "PLDT Home Fiber",
+    "Converge ICT",
+    "Smart Communications",
+    "Acme Office Supplies",
+    "Northwind Traders",
+    "Contoso Insurance",
+    "Blue Harbor Property Management",
+]
+ITEMS = [
+    "Energy charge",
+    "Distribution charge",
+    "Water consumption",
+    "Monthly service fee",
+    "Late payment penalty",
+    "Equipment rental",
+    "Data add-on",
+    "Environmental fee",
+    "Value added tax",
+    "Maintenance fee",
+]
+
+
+def make_bill(seed: int, pages: int = 1) -> Dict[str, str]:
+    """Return ``{"name", "vendor", "invoice", "pages": [page text, ...]}`` for one fake bill."""
+    rng = random.Random(seed)
+    vendor = rng.choice(VENDORS)
+    invoice = f"INV-{seed:07d}"
+    account = f"{rng.randint(1000, 9999)}-{rng.randint(100000, 999999)}"
+    bill_date = date(2024, 1, 1) + timedelta(days=rng.randint(0, 540))
+    due_date = bill_date + timedelta(days=rng.choice([14, 21, 30]))
+    lines = [(rng.choice(ITEMS), rng.randint(100, 50000) / 100.0) for _ in range(rng.randint(4, 12))]
+    total = sum(amount for _, amount in lines)
+    header = [
+        f"Vendor: {vendor}",
+        f"Invoice number: {invoice}",
+        f"Account: {account}",
+        f"Bill date: {bill_date.isoformat()}",
+        f"Due date: {due_date.isoformat()}",
+        f"Total: {total:.2f}",
+        "Thank you for your prompt payment. Please pay on or before the due date to avoid penalties.",
+    ]
+    page_texts = []
+    for p in range(pages):
+        body = [f"{name} {amount:.2f}" for name, amount in lines] if p == 0 else [
+            f"Usage detail line {i} for account {account} reading {rng.randint(1000, 99999)} kWh" for i in range(20)
+        ]
+        page_texts.append("\n".join((header if p == 0 else [f"Vendor: {vendor}", f"Invoice number: {invoice}"]) + body))
+    return {"name": f"{invoice}.pdf", "vendor": vendor, "invoice": invoice, "pages": page_texts}
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: List[str]) -> bytes:
+    """Build a minimal single-font PDF with one text page per entry of ``pages``."""
+    objects: List[bytes] = []
+    n_pages = len(pages)
+    # 1: catalog, 2: page tree, 3: font, then (page, content) pairs
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(n_pages))
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {n_pages} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i, text in enumerate(pages):
+        ops = ["BT", "/F1 10 Tf", "12 TL", "50 780 Td"]
+        for line in text.splitlines():
+            ops.append(f"({_escape(line)}) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1", "replace")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {5 + 2 * i} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for off in offsets:
+        out += b"%010d 00000 n \n" % off
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def bill_pdfs(count: int, start_seed: int = 0, max_pages: int = 3) -> Iterator[Dict[str, object]]:
+    """Yield ``{"name", "contents"}`` for ``count`` distinct synthetic bill PDFs."""
+    for seed in range(start_seed, start_seed + count):
+        bill = make_bill(seed, pages=1 + seed % max_pages)
+        yield {"name": bill["name"], "contents": make_pdf(bill["pages"])}
+
+
+def chunk_records(count: int, start_seed: int = 0) -> Iterator[Dict[str, object]]:
+    """Yield chunk documents (without embeddings) shaped like the ones ingestion stores."""
+    for seed in range(start_seed, start_seed + count):
+        bill = make_bill(seed)
+        yield {
+            "text": bill["pages"][0][:500],
+            "source": bill["name"],
+            "page": 1,
+            "chunk": 0,
+            "title": f"Bill from {bill['vendor']}",
+            "keywords": ["bill", "invoice"],
+            "hasCode": False,
+            "vendor": bill["vendor"],
+        }
+
+
+def questions(count: int, seed: int = 1) -> List[str]:
+    """Distinct user questions (distinct so the answer cache does not hide retrieval cost)."""
+    rng = random.Random(seed)
+    templates = [
+        "What is the total amount due on my {vendor} bill?",
+        "When is the {vendor} bill due?",
+        "How much was the {item} on the {vendor} invoice?",
+        "Which account number is on the {vendor} statement?",
+    ]
+    return [
+        rng.choice(templates).format(vendor=rng.choice(VENDORS), item=rng.choice(ITEMS).lower()) + f" (#{i})"
+        for i in range(count)
+    ]
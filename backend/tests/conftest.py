@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# tests import the backend as ``app``, like uvicorn --app-dir backend
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def api():
+    """The app with fake OpenAI clients and mongomock (see benchmarks/run.py), once it is ready."""
+    pytest.importorskip("mongomock")
+    from argparse import Namespace
+
+    from fastapi.testclient import TestClient
+
+    from benchmarks.run import load_app, wait_ready
+
+    main, fakes = load_app(Namespace(mongo_uri=None, embed_latency_ms=0, llm_latency_ms=0, tag_latency_ms=0, tagging="inline"))
+    with TestClient(main.app) as c:
+        wait_ready(c)
+        c.post("/api/ingest_text", json={"text": "Invoice INV-0042 total due 120.00 USD " + " ".join(f"line{i}" for i in range(30))})
+        yield c
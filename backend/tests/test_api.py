@@ -0,0 +1,22 @@
+"""HTTP API behaviour against the app with fake OpenAI clients and mongomock (see conftest.py)."""
+import pytest
+
+
+@pytest.mark.parametrize("top_k", [0, -1, 51, None])
+def test_out_of_range_top_k_is_rejected(api, top_k, monkeypatch):
+    from benchmarks.fakes import CannedChatModel
+
+    async def called(self, *args, **kwargs):
+        raise AssertionError("the model must not be called")
+
+    monkeypatch.setattr(CannedChatModel, "_agenerate", called)
+    for path in ("/api/query", "/api/query/stream"):
+        r = api.post(path, json={"question": "What is the total of INV-0042?", "top_k": top_k})
+        assert r.status_code == 422
+        assert r.json()["detail"][0]["loc"] == ["body", "top_k"]
+
+
+def test_top_k_defaults_to_four(api):
+    r = api.post("/api/query", json={"question": "Which invoice totals 120.00 USD?"})
+    assert r.status_code == 200
+    assert 1 <= len(r.json()["sources"]) <= 4
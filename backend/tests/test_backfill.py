@@ -0,0 +1,112 @@
+"""Back-fill of documents stored before the registry and the typed bill fields (app/backfill.py)."""
+import time
+
+import pytest
+from bson import ObjectId
+
+from app import backfill
+
+BILL = "Vendor: Old Power Co\nBill date: 2023-02-01\nDue date: 2023-02-20\nTotal: 310.25\nAccount: AC-1001\n" + "usage " * 30
+
+
+@pytest.fixture
+def db():
+    mongomock = pytest.importorskip("mongomock")
+    database = mongomock.MongoClient()["db"]
+    database["registry"].create_index("content_hash", unique=True)
+    database["registry"].create_index("text_hash", unique=True, partialFilterExpression={"text_hash": {"$type": "string"}})
+    return database["chunks"], database["registry"]
+
+
+def legacy(collection, text, source, title="Bill", **metadata):
+    """A chunk as stored before documents were registered: tagger metadata, no fingerprint."""
+    chunk = {"_id": ObjectId(), "text": text, "embedding": [0.1, 0.2], "source": source, "title": title, "keywords": ["bill"]}
+    return collection.insert_one({**chunk, **metadata}).inserted_id
+
+
+def test_groups_unregistered_chunks_into_documents_and_queues_tagging(db):
+    collection, registry = db
+    first = [legacy(collection, BILL, "old.pdf"), legacy(collection, "page two " * 10, "old.pdf")]
+    other = legacy(collection, "Vendor: Water\nTotal: 12.00 " + "x " * 30, "water.pdf", title="Water bill")
+    assert backfill.status(collection, registry)["unregistered_chunks"] == 3
+
+    counts = backfill.run(collection, registry, head_chars=50)
+    assert counts["registered"] == 2 and counts["duplicate"] == 0
+    entries = {e["source"]: e for e in registry.find()}
+    assert entries["old.pdf"]["chunk_count"] == 2
+    assert entries["old.pdf"]["tagging"] == "pending"
+    assert entries["old.pdf"]["tag_head"] == BILL[:50]
+    assert {c["_id"] for c in collection.find({"fingerprint": entries["old.pdf"]["content_hash"]})} == set(first)
+    assert collection.find_one({"_id": other})["fingerprint"] == entries["water.pdf"]["content_hash"]
+    assert backfill.status(collection, registry) == {"unregistered_chunks": 0, "untyped_documents": 0, "tagging_pending": 2}
+    # nothing left on a second run
+    assert backfill.run(collection, registry)["registered"] == 0
+
+
+def test_bill_fields_in_chunk_metadata_are_typed_without_tagging(db):
+    collection, registry = db
+    legacy(collection, BILL, "tagged.pdf", vendor="Old Power Co", total_amount="$310.25", bill_date="2023-02-01")
+    registry.insert_one({"content_hash": "abc", "status": "done", "source": "new.pdf"})
+    collection.insert_one({"text": "later", "fingerprint": "abc", "vendor": "Gas Ltd", "total_amount": 40, "currency": "eur"})
+
+    counts = backfill.run(collection, registry)
+    assert counts["registered"] == 1 and counts["typed"] == 1
+    old = registry.find_one({"source": "tagged.pdf"})
+    assert old["total_amount"] == 310.25 and old["currency"] == "USD" and "tagging" not in old
+    new = registry.find_one({"source": "new.pdf"})
+    assert new["vendor"] == "Gas Ltd" and new["currency"] == "EUR"
+
+
+def test_same_text_stored_twice_is_reported(db):
+    collection, registry = db
+    legacy(collection, BILL, "a.pdf")
+    copy = legacy(collection, BILL, "b.pdf")
+    counts = backfill.run(collection, registry)
+    assert counts["registered"] == 1 and counts["duplicate"] == 1
+    assert counts["duplicate_chunk_ids"] == [str(copy)]
+
+
+def test_backfilled_bills_reach_the_aggregate(api):
+    from app import main
+
+    before = api.post("/api/aggregate", json={"vendor": "Old Power Co"}).json()
+    assert before["bills"] == 0
+    # with a real embedding, so the other tests' indexes stay whole
+    embedding = main.collection.find_one({"embedding": {"$exists": True}})["embedding"]
+    legacy(main.collection, BILL, "old-power.pdf", embedding=embedding)
+    assert api.post("/api/aggregate", json={}).json()["unregistered_chunks"] == 1
+
+    backfill.run(main.collection, main.registry)
+    main.tag_backfill.notify()
+    deadline = time.monotonic() + 5
+    while main.registry.find_one({"source": "old-power.pdf"}).get("tagging") != "done":
+        assert time.monotonic() < deadline, "not tagged"
+        time.sleep(0.02)
+    after = api.post("/api/aggregate", json={"vendor": "Old Power Co"}).json()
+    assert after["bills"] == 1 and after["groups"][0]["total"] == 310.25
+    assert after["unregistered_chunks"] == 0
+
+
+def test_pdf_of_a_backfilled_document_is_a_duplicate(api):
+    from app import main
+    from app.parsing import iter_pdf_pages
+    from benchmarks.synthetic import bill_pdfs
+
+    pdf = list(bill_pdfs(1, start_seed=9001, max_pages=3))[0]
+    # stored whole, the way PDFs were before page-wise ingestion
+    text = "\n\n".join(t for _, t in iter_pdf_pages(pdf["contents"]) if t.split())
+    embedding = main.collection.find_one({"embedding": {"$exists": True}})["embedding"]
+    legacy(main.collection, text, pdf["name"], embedding=embedding)
+    backfill.run(main.collection, main.registry)
+
+    upload = (pdf["name"], pdf["contents"], "application/pdf")
+    r = api.post("/api/ingest_pdfs", files=[("files", upload)])
+    assert r.json()["files"][0]["status"] == "already_ingested"
+
+    job = api.post("/api/ingest_pdf", files={"file": upload}).json()
+    deadline = time.monotonic() + 5
+    while job["status"] not in ("done", "failed"):
+        assert time.monotonic() < deadline, "job did not finish"
+        time.sleep(0.02)
+        job = api.get(f"/api/jobs/{job['job_id']}").json()
+    assert job["result"]["status"] == "already_ingested"
@@ -0,0 +1,69 @@
+"""Answer cache (app/cache.py): invalidation shared by worker processes through MongoDB."""
+import asyncio
+
+import pytest
+
+from app.cache import AnswerCache
+
+
+@pytest.fixture
+def store():
+    mongomock = pytest.importorskip("mongomock")
+    from benchmarks.fakes import AsyncMongoMock
+
+    client = mongomock.MongoClient()
+    return client["db"]["answer_cache"], AsyncMongoMock(client)["db"]["answer_cache"]
+
+
+def workers(store, n=2, **kwargs):
+    caches = [AnswerCache(sync_seconds=0, **kwargs) for _ in range(n)]
+    for cache in caches:
+        cache.attach(*store)
+    return caches
+
+
+def test_invalidation_reaches_other_workers(store):
+    a, b = workers(store)
+    key = a.key("What is due?", ["d1"], 4)
+    a.put(key, "120.00 USD")
+    assert a.get(key) == "120.00 USD"
+
+    b.invalidate()
+    asyncio.run(a.sync())
+    assert a.get(a.key("What is due?", ["d1"], 4)) is None
+    assert a.generation == b.generation == 1
+    # an answer computed before the invalidation is not stored
+    a.put(key, "stale")
+    assert a.get(key) is None
+
+
+def test_async_invalidation_is_shared(store):
+    a, b = workers(store)
+    asyncio.run(a.ainvalidate())
+    asyncio.run(a.ainvalidate())
+    asyncio.run(b.sync())
+    assert b.generation == 2
+    b.invalidate()
+    asyncio.run(a.sync())
+    assert a.generation == 3
+
+
+def test_sync_reads_the_counter_at_most_every_sync_seconds(store):
+    a, b = workers(store)
+    a.sync_seconds = 3600
+    asyncio.run(a.sync())
+    b.invalidate()
+    asyncio.run(a.sync())
+    assert a.generation == 0
+
+
+def test_unreachable_store_still_invalidates_locally():
+    class Down:
+        def find_one_and_update(self, *args, **kwargs):
+            raise ConnectionError("down")
+
+    cache = AnswerCache()
+    cache.attach(Down(), None)
+    cache.invalidate()
+    assert cache.generation == 1
+    assert cache.snapshot()["sync_errors"] == 1
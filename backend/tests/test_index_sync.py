@@ -0,0 +1,75 @@
+"""Two app instances (uvicorn workers) sharing one MongoDB collection keep their in-process indexes in sync."""
+import importlib.util
+import time
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def worker2(api):
+    """A second, independent copy of ``app.main`` on the same (mongomock) database as ``api``."""
+    from fastapi.testclient import TestClient
+
+    from benchmarks.run import wait_ready
+    from app import main
+
+    spec = importlib.util.spec_from_file_location("app.main_worker2", main.__file__)
+    other = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(other)
+    other.create_metadata_tagger = main.create_metadata_tagger
+    other.TAGGING_MODE = main.TAGGING_MODE
+    other.INDEX_SYNC_SECONDS = 0.05
+    with TestClient(other.app) as c:
+        wait_ready(c)
+        c.worker = other
+        yield c
+
+
+def until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_chunks_ingested_by_another_worker_become_searchable(api, worker2):
+    from app import main
+
+    assert worker2.worker.vector_index is not main.vector_index
+    r = api.post("/api/ingest_text", json={"text": "Invoice INV-7731 from Northwind total due 88.10 EUR " + "detail " * 40})
+    assert r.status_code == 200
+    ids = [main.ObjectId(i) for i in r.json()["ids"]]
+    assert ids
+
+    until(lambda: all(i in worker2.worker.vector_index for i in ids))
+    r = worker2.post("/api/query", json={"question": "What does INV-7731 total?", "tokens": ["INV-7731"]})
+    assert r.status_code == 200
+    assert r.json()["sources"]
+    assert all("INV-7731" in s["snippet"] for s in r.json()["sources"])
+
+
+def test_chunks_written_directly_to_mongo_are_caught_up(api, worker2):
+    from app import main
+
+    doc = main.collection.find_one({"text": {"$regex": "INV-7731"}})
+    copy = {k: v for k, v in doc.items() if k != "_id"}
+    copy["text"] = copy["text"].replace("INV-7731", "INV-7732")
+    new_id = main.collection.insert_one(copy).inserted_id
+    until(lambda: new_id in worker2.worker.vector_index)
+    assert worker2.worker.lexical_index.lookup("INV-7732") == {new_id}
+    # the first worker syncs too (every INDEX_SYNC_SECONDS; here on demand)
+    main.sync_indexes()
+    assert new_id in main.vector_index
+
+
+def test_a_newer_snapshot_is_attached(api, worker2, tmp_path, monkeypatch):
+    from app import main
+    from app.snapshot import build
+
+    other = worker2.worker
+    monkeypatch.setattr(other, "SNAPSHOT_DIR", str(tmp_path))
+    manifest = build(main.collection, str(tmp_path), main.EMBEDDING_MODEL)
+    until(lambda: other._snapshot_version == manifest["path"])
+    assert other.vector_index._base_size == manifest["rows"]
+    ids = [d["_id"] for d in main.collection.find({}, {"_id": 1})]
+    assert all(i in other.vector_index for i in ids)
@@ -0,0 +1,84 @@
+"""Ingestion job queue (app/jobs.py): the pending cap and shutdown."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.jobs import JobQueue, QueueFull
+
+
+class Store:
+    """Just enough of a MongoDB collection for the job records."""
+
+    def __init__(self):
+        self.records = {}
+
+    def replace_one(self, query, record, upsert=False):
+        self.records[query["_id"]] = record
+
+    def find_one(self, query):
+        return self.records.get(query["_id"])
+
+
+def test_run_counts_against_max_pending():
+    queue = JobQueue(max_workers=1, max_pending=1)
+    release = threading.Event()
+
+    async def main():
+        held = asyncio.ensure_future(queue.run(release.wait))
+        await asyncio.sleep(0.05)
+        assert queue.pending() == 1
+        with pytest.raises(QueueFull):
+            await queue.run(time.sleep, 0)
+        with pytest.raises(QueueFull):
+            queue.submit(lambda progress: {})
+        release.set()
+        await held
+
+    asyncio.run(main())
+    assert queue.pending() == 0
+    queue.shutdown()
+
+
+def test_shutdown_waits_for_running_jobs_and_fails_queued_ones():
+    queue = JobQueue(max_workers=1)
+    store = Store()
+    queue.attach(store)
+
+    def slow(progress):
+        time.sleep(0.2)
+        return {"ok": True}
+
+    running = queue.submit(slow)
+    queued = queue.submit(slow)
+    time.sleep(0.05)
+    queue.shutdown(timeout=5)
+    assert store.records[running.id]["status"] == "done"
+    assert store.records[queued.id]["status"] == "failed"
+    assert queue.pending() == 0
+
+
+def test_shutdown_gives_up_after_the_timeout():
+    queue = JobQueue(max_workers=1)
+    store = Store()
+    queue.attach(store)
+    release = threading.Event()
+    job = queue.submit(lambda progress: release.wait())
+    time.sleep(0.05)
+    started = time.monotonic()
+    queue.shutdown(timeout=0.1)
+    assert time.monotonic() - started < 1
+    assert store.records[job.id]["status"] == "failed"
+    assert store.records[job.id]["error"] == "interrupted by server shutdown"
+    release.set()
+
+
+def test_full_queue_answers_503(api, monkeypatch):
+    from app import main
+
+    monkeypatch.setattr(main.ingest_jobs, "max_pending", 0)
+    r = api.post("/api/ingest_text", json={"text": "Invoice INV-0099 total due 5.00 USD " * 10})
+    assert r.status_code == 503
+    r = api.post("/api/ingest_pdfs", files=[("files", ("a.pdf", b"%PDF-1.4", "application/pdf"))])
+    assert r.status_code == 503
@@ -0,0 +1,292 @@
+"""OpenAI request scheduling (app/scheduler.py) against httpx.MockTransport: ordering, backoff and shedding."""
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from app.scheduler import (
+    BULK,
+    INTERACTIVE,
+    AsyncScheduledTransport,
+    Overloaded,
+    RateScheduler,
+    ScheduledTransport,
+    overload_of,
+    priority,
+)
+
+URL = "https://api.openai.test/v1/embeddings"
+BODY = {"input": ["hello"], "model": "text-embedding-3-small"}
+
+
+class Body(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """A response body read from the network, unlike the in-memory content httpx reads eagerly."""
+
+    def __init__(self, data: bytes = b"{}"):
+        self.data = data
+
+    def __iter__(self):
+        yield self.data
+
+    async def __aiter__(self):
+        yield self.data
+
+
+def scheduler(**kwargs) -> RateScheduler:
+    # millisecond backoff keeps the retry tests fast
+    return RateScheduler(**{"backoff_base": 0.001, "backoff_max": 0.01, **kwargs})
+
+
+def client(handler, sched: RateScheduler) -> httpx.Client:
+    return httpx.Client(transport=ScheduledTransport(httpx.MockTransport(handler), sched))
+
+
+def responses(*statuses, headers=None):
+    """A handler answering with ``statuses`` in turn (the last one repeats), counting the calls."""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        status = statuses[min(len(calls), len(statuses) - 1)]
+        calls.append(time.monotonic())
+        return httpx.Response(status, headers=headers if status != 200 else None, json={"ok": status == 200})
+
+    return handler, calls
+
+
+def test_retries_429_after_retry_after_and_pauses_the_queue():
+    sched = scheduler()
+    handler, calls = responses(429, 200, headers={"retry-after-ms": "100"})
+    with client(handler, sched) as c:
+        r = c.post(URL, json=BODY)
+    assert r.status_code == 200
+    assert len(calls) == 2
+    # never sooner than Retry-After
+    assert calls[1] - calls[0] >= 0.1
+    assert sched.snapshot()["in_flight"] == 0
+
+
+def test_server_errors_are_retried_then_returned():
+    sched = scheduler(max_retries=2)
+    handler, calls = responses(502)
+    with client(handler, sched) as c:
+        r = c.post(URL, json=BODY)
+    assert r.status_code == 502
+    assert len(calls) == 3
+    assert sched.snapshot()["in_flight"] == 0
+
+
+def test_client_errors_are_not_retried():
+    sched = scheduler()
+    handler, calls = responses(400)
+    with client(handler, sched) as c:
+        assert c.post(URL, json=BODY).status_code == 400
+    assert len(calls) == 1
+
+
+def test_connection_errors_are_retried():
+    sched = scheduler()
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if len(calls) == 1:
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200, json={})
+
+    with client(handler, sched) as c:
+        assert c.post(URL, json=BODY).status_code == 200
+    assert len(calls) == 2
+    assert sched.snapshot()["in_flight"] == 0
+
+
+def test_backoff_is_jittered_and_capped():
+    sched = RateScheduler(backoff_base=0.5, backoff_max=2.0)
+    delays = [sched.backoff(attempt, None) for attempt in range(10) for _ in range(20)]
+    assert all(0.0 <= d <= 2.0 for d in delays)
+    assert len(set(delays)) > 1
+    assert sched.backoff(0, 3.0) == 3.0
+
+
+def test_persistent_429_is_shed_with_retry_after():
+    sched = scheduler(max_retries=0)
+    handler, calls = responses(429, headers={"retry-after": "7"})
+    with client(handler, sched) as c:
+        with pytest.raises(Overloaded) as exc:
+            c.post(URL, json=BODY)
+    assert len(calls) == 1
+    assert exc.value.retry_after_header == "7"
+    assert sched.snapshot()["in_flight"] == 0
+    # the 429s paused the queue for everyone
+    assert sched.snapshot()["paused_seconds"] > 0
+
+
+def test_full_queue_is_shed():
+    sched = scheduler(max_queue=0)
+    handler, calls = responses(200)
+    with client(handler, sched) as c:
+        with pytest.raises(Overloaded, match="queue is full"):
+            c.post(URL, json=BODY)
+    assert calls == []
+
+
+def test_request_waiting_too_long_is_shed():
+    sched = scheduler(max_wait={INTERACTIVE: 0.05})
+    sched.pause(5)
+    handler, calls = responses(200)
+    with client(handler, sched) as c, priority(INTERACTIVE):
+        started = time.monotonic()
+        with pytest.raises(Overloaded, match="gave up waiting") as exc:
+            c.post(URL, json=BODY)
+    assert time.monotonic() - started < 1
+    assert exc.value.retry_after >= 1
+    assert calls == []
+    assert sched.snapshot()["waiting"] == {INTERACTIVE: 0, BULK: 0}
+
+
+def test_rate_limit_headers_pause_the_queue():
+    sched = scheduler()
+    headers = {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "2s"}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers=headers, json={})
+
+    with client(handler, sched) as c:
+        c.post(URL, json=BODY)
+    assert 1.5 < sched.snapshot()["paused_seconds"] <= 2.0
+
+
+def test_interactive_requests_are_admitted_before_bulk():
+    sched = scheduler(max_in_flight=1)
+    order = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        order.append(request.headers.get("x-caller"))
+        return httpx.Response(200, stream=Body())
+
+    with client(handler, sched) as c:
+        # hold the only in-flight slot with an open streamed response
+        held = c.send(c.build_request("POST", URL, json=BODY, headers={"x-caller": "held"}), stream=True)
+        assert sched.snapshot()["in_flight"] == 1
+
+        def call(name: str, level: str) -> None:
+            with priority(level):
+                c.post(URL, json=BODY, headers={"x-caller": name})
+
+        threads = []
+        for name, level in (("bulk-1", BULK), ("bulk-2", BULK), ("query", INTERACTIVE)):
+            threads.append(threading.Thread(target=call, args=(name, level)))
+            threads[-1].start()
+            time.sleep(0.05)
+        assert sched.snapshot()["waiting"] == {INTERACTIVE: 1, BULK: 2}
+        held.close()
+        for thread in threads:
+            thread.join(5)
+    assert order == ["held", "query", "bulk-1", "bulk-2"]
+    assert sched.snapshot()["in_flight"] == 0
+
+
+def test_streamed_response_holds_its_slot_until_closed():
+    sched = scheduler(max_in_flight=1)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, stream=Body(b"data: token\n\n" * 3))
+
+    with client(handler, sched) as c:
+        with c.stream("POST", URL, json=BODY) as r:
+            assert sched.snapshot()["in_flight"] == 1
+            assert list(r.iter_bytes())
+        assert sched.snapshot()["in_flight"] == 0
+
+
+def test_requests_per_minute_budget_spaces_requests():
+    # 600 RPM: once the burst is spent, one request every 0.1s
+    sched = scheduler(rpm=600)
+    sched._requests.level = 0
+    handler, calls = responses(200)
+    with client(handler, sched) as c, priority(INTERACTIVE):
+        started = time.monotonic()
+        for _ in range(2):
+            c.post(URL, json=BODY)
+    assert 0.15 <= time.monotonic() - started < 1.0
+
+
+def test_bulk_requests_leave_a_reserve_for_queries():
+    sched = scheduler(rpm=600, bulk_reserve=0.2)
+    # 20.5 of the 100-request burst left: enough for a query, not for bulk (which keeps 20 + 1 free)
+    sched._requests.level = 20.5
+    assert sched._requests.wait(1, 0.0, time.monotonic()) == 0.0
+    assert sched._requests.wait(1, sched.bulk_reserve, time.monotonic()) > 0.0
+
+
+def test_async_transport_retries_and_releases_on_close():
+    sched = scheduler()
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(503 if len(calls) == 1 else 200, stream=Body())
+
+    async def run() -> int:
+        transport = AsyncScheduledTransport(httpx.MockTransport(handler), sched)
+        async with httpx.AsyncClient(transport=transport) as c:
+            async with c.stream("POST", URL, json=BODY) as r:
+                assert sched.snapshot()["in_flight"] == 1
+                await r.aread()
+            return r.status_code
+
+    assert asyncio.run(run()) == 200
+    assert len(calls) == 2
+    assert sched.snapshot()["in_flight"] == 0
+
+
+def test_async_persistent_429_is_shed():
+    sched = scheduler(max_retries=0)
+    handler, _ = responses(429, headers={"retry-after": "3"})
+
+    async def run() -> None:
+        transport = AsyncScheduledTransport(httpx.MockTransport(handler), sched)
+        async with httpx.AsyncClient(transport=transport) as c:
+            await c.post(URL, json=BODY)
+
+    with pytest.raises(Overloaded) as exc:
+        asyncio.run(run())
+    assert exc.value.retry_after == 3.0
+
+
+def test_overload_reaches_the_caller_through_the_openai_client():
+    openai = pytest.importorskip("openai")
+    sched = scheduler(max_queue=0)
+    handler, _ = responses(200)
+    sdk = openai.OpenAI(api_key="test", base_url="https://api.openai.test/v1", http_client=client(handler, sched), max_retries=0)
+    # depending on the SDK version it arrives as is or wrapped (APIConnectionError)
+    with pytest.raises(Exception) as exc:
+        sdk.embeddings.create(input=["hello"], model="text-embedding-3-small")
+    assert overload_of(exc.value) is not None
+
+
+def test_shed_query_answers_503_with_retry_after(api, monkeypatch):
+    from benchmarks.fakes import CannedChatModel
+
+    async def shed(self, *args, **kwargs):
+        raise Overloaded("OpenAI request queue is full", 4.2)
+
+    monkeypatch.setattr(CannedChatModel, "_agenerate", shed)
+    r = api.post("/api/query", json={"question": "What is the total of INV-0042?"})
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "5"
+
+
+def test_shed_stream_reports_retry_after(api, monkeypatch):
+    from benchmarks.fakes import CannedChatModel
+
+    async def shed(self, *args, **kwargs):
+        raise Overloaded("OpenAI rate limit reached", 2)
+        yield
+
+    monkeypatch.setattr(CannedChatModel, "_astream", shed)
+    r = api.post("/api/query/stream", json={"question": "When is INV-0042 due?"})
+    assert r.status_code == 200
+    events = [line for line in r.text.splitlines() if line]
+    assert '"type": "error"' in events[-1] and '"retry_after": "2"' in events[-1]
@@ -1,9 +1,15 @@
 import os
+import json
+import time
 import requests
 import streamlit as st
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 import uuid
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 
 # --- Global Styles ---
 st.markdown(
@@ -185,6 +191,251 @@ st.markdown(
 
 # Backend base URL
 API_BASE = os.environ.get("API_BASE_URL", "http://localhost:8000")
+# PDFs uploaded at once; each upload returns as soon as the backend has queued the file
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", "4"))
+# Give up waiting on ingestion jobs after this long (they keep running on the backend)
+INGEST_TIMEOUT_SECONDS = float(os.environ.get("INGEST_TIMEOUT_SECONDS", "600"))
+# Upload attempts when the backend answers 503 (ingestion queue full or not ready yet)
+UPLOAD_ATTEMPTS = 5
+# Chat messages per page of history; older pages are rendered only on request
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "20"))
+# The oldest messages are dropped from the session beyond this many
+HISTORY_MAX_MESSAGES = int(os.environ.get("HISTORY_MAX_MESSAGES", "500"))
+
+# Messages rendered from the end of the history; older ones are shown a page at a time on request
+if "history_shown" not in st.session_state:
+    st.session_state.history_shown = HISTORY_PAGE_SIZE
+# Sources whose full text the user asked for ("<message id>_<index>")
+if "loaded_sources" not in st.session_state:
+    st.session_state.loaded_sources = set()
+
+
+@st.cache_resource
+def http_session() -> requests.Session:
+    """One keep-alive connection pool to the backend, shared by every rerun and browser session.
+
+    Idempotent GETs (job polling) are retried on 502/503/504, honouring Retry-After.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=max(10, 2 * UPLOAD_CONCURRENCY),
+        max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=("GET",)),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def upload_pdf(name: str, data: bytes, mime: str) -> dict:
+    """POST one PDF to /api/ingest_pdf and return the response JSON (a job, or ``already_ingested``).
+
+    Runs on an upload worker thread, so it must not call Streamlit. A 503
+    is retried after the backend's Retry-After; other errors raise.
+    """
+    for attempt in range(UPLOAD_ATTEMPTS):
+        r = http_session().post(f"{API_BASE}/api/ingest_pdf", files={"file": (name, data, mime)}, timeout=(10, 60))
+        if r.status_code == 503 and attempt < UPLOAD_ATTEMPTS - 1:
+            time.sleep(min(30.0, float(r.headers.get("Retry-After") or 2 ** attempt)))
+            continue
+        if not r.ok:
+            raise RuntimeError(f"upload failed ({r.status_code}): {r.text[:200]}")
+        return r.json()
+    raise RuntimeError("upload failed: backend busy")
+
+
+def get_job(job_id: str) -> dict:
+    r = http_session().get(f"{API_BASE}/api/jobs/{job_id}", timeout=(5, 10))
+    if not r.ok:
+        return {"status": "failed", "error": f"status check failed ({r.status_code})"}
+    return r.json()
+
+
+def ingest_files(files, on_update) -> list:
+    """Upload ``files`` concurrently and follow their ingestion jobs until all finish or time out.
+
+    Every file gets a row (file, status, progress, chunks, seconds, detail);
+    ``on_update(rows)`` is called from this (the script) thread whenever rows
+    change. A slow or failing file only affects its own row.
+    """
+    rows = [
+        {"file": f.name, "status": "waiting", "progress": 0.0, "chunks": None, "seconds": None, "detail": ""}
+        for f in files
+    ]
+    started = [None] * len(files)
+
+    def finish(i, status, detail="", chunks=None):
+        rows[i].update(status=status, detail=detail, chunks=chunks, progress=1.0 if status != "failed" else rows[i]["progress"])
+        rows[i]["seconds"] = round(time.time() - (started[i] or time.time()), 1)
+
+    uploader = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="upload")
+    poller = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="poll")
+    uploads = {uploader.submit(upload_pdf, f.name, f.getvalue(), f.type or "application/pdf"): i for i, f in enumerate(files)}
+    polls = {}  # poll future -> row index
+    jobs = {}  # row index -> job id, for queued/running jobs
+    last_polled = {}
+    deadline = time.time() + INGEST_TIMEOUT_SECONDS
+    try:
+        while (uploads or jobs) and time.time() < deadline:
+            futures = list(uploads) + list(polls)
+            if futures:
+                done, _ = wait(futures, timeout=0.5, return_when=FIRST_COMPLETED)
+            else:
+                done = set()
+                time.sleep(0.5)
+            for fut, i in list(uploads.items()):
+                if fut.running() and started[i] is None:
+                    started[i] = time.time()
+                    rows[i]["status"] = "uploading"
+            for fut in done:
+                if fut in uploads:
+                    i = uploads.pop(fut)
+                    started[i] = started[i] or time.time()
+                    try:
+                        data = fut.result()
+                    except Exception as e:
+                        finish(i, "failed", str(e))
+                        continue
+                    if data.get("job_id"):
+                        jobs[i] = data["job_id"]
+                        rows[i]["status"] = data.get("status", "queued")
+                    else:
+                        finish(i, "already ingested", chunks=0)
+                else:
+                    i = polls.pop(fut)
+                    try:
+                        job = fut.result()
+                    except Exception:
+                        # transient polling error; try again on the next round
+                        continue
+                    status = job.get("status")
+                    if status == "done":
+                        result = job.get("result") or {}
+                        if result.get("status") == "already_ingested":
+                            finish(i, "already ingested", chunks=0)
+                        else:
+                            finish(i, "done", chunks=int(result.get("inserted_count") or 0))
+                        del jobs[i]
+                    elif status == "failed":
+                        finish(i, "failed", job.get("error") or "")
+                        del jobs[i]
+                    else:
+                        rows[i].update(status=status or "running", progress=float(job.get("progress") or 0.0), detail=job.get("stage") or "")
+            # poll each unfinished job about once a second, all jobs in parallel
+            polling = set(polls.values())
+            now = time.time()
+            for i, job_id in jobs.items():
+                if i not in polling and now - last_polled.get(i, 0.0) >= 1.0:
+                    last_polled[i] = now
+                    polls[poller.submit(get_job, job_id)] = i
+            on_update(rows)
+    finally:
+        uploader.shutdown(wait=False, cancel_futures=True)
+        poller.shutdown(wait=False, cancel_futures=True)
+    for i in list(jobs) + list(uploads.values()):
+        rows[i].update(status="still processing", detail="timed out waiting; the backend keeps ingesting")
+    on_update(rows)
+    return rows
+
+
+def stream_query(question: str, on_text) -> tuple:
+    """Call /api/query/stream and feed the answer-so-far to ``on_text`` as tokens arrive.
+
+    Returns ``(answer_text, sources)``.
+    """
+    answer = ""
+    sources = []
+    with http_session().post(
+        f"{API_BASE}/api/query/stream", json={"question": question, "top_k": 4}, stream=True, timeout=(10, 60)
+    ) as r:
+        if not r.ok:
+            return f"Query failed: {r.status_code} - {r.text}", []
+        for line in r.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            event = json.loads(line)
+            kind = event.get("type")
+            if kind == "sources":
+                sources = event.get("sources") or []
+            elif kind == "token":
+                answer += event.get("content", "")
+                on_text(answer)
+            elif kind == "error":
+                answer += f"\n\n(answer interrupted: {event.get('detail')})"
+    return answer or "(no answer returned)", sources
+
+
+@st.cache_data(max_entries=32, ttl=600, show_spinner=False)
+def fetch_source(source_id: str) -> dict:
+    """Full text of a source from /api/sources/{id} (cached for the most recently loaded sources)."""
+    r = http_session().get(f"{API_BASE}/api/sources/{source_id}", timeout=(5, 30))
+    r.raise_for_status()
+    return r.json()
+
+
+def add_message(msg):
+    """Append ``msg`` to the chat history, dropping the oldest messages beyond HISTORY_MAX_MESSAGES."""
+    messages = st.session_state.messages
+    messages.append(msg)
+    if len(messages) > HISTORY_MAX_MESSAGES:
+        del messages[: len(messages) - HISTORY_MAX_MESSAGES]
+
+
+def render_source(msg_id, i, source):
+    """Title and snippet of a source reference; its full text is fetched only once the user asks for it."""
+    title = source.get("title") or f"source {i+1}"
+    st.markdown(f"**{i+1}. {title}**")
+    if source.get("snippet"):
+        st.caption(source["snippet"])
+    key = f"{msg_id}_{i}"
+    loaded = st.session_state.loaded_sources
+    if key not in loaded and source.get("id"):
+        if st.button("Load full text", key=f"load_{key}"):
+            loaded.add(key)
+    if key in loaded:
+        try:
+            full = fetch_source(source["id"])
+        except Exception as e:
+            st.markdown(f"<div class='attachment'>📎 {title}: could not load ({e})</div>", unsafe_allow_html=True)
+            return
+        name = (source.get("metadata") or {}).get("source") or f"source_{i+1}"
+        st.download_button("Download full text", data=full.get("text") or "", file_name=f"{name}.txt", key=f"dl_{key}")
+
+
+def render_message(msg):
+    is_user = msg.get("role") == "user"
+    avatar_class = "avatar-user" if is_user else "avatar-assistant"
+    bubble_class = "msg-user" if is_user else "msg-assistant"
+
+    if is_user:
+        cols = st.columns([1, 9])
+        with cols[1]:
+            st.markdown(
+                f"<div class='msg-row'><div class='msg-bubble {bubble_class}'>" + msg.get("content", "") + "</div></div>",
+                unsafe_allow_html=True,
+            )
+            ts = msg.get("timestamp")
+            if ts:
+                st.markdown(f"<div class='timestamp' style='text-align:right'>{ts}</div>", unsafe_allow_html=True)
+    else:
+        cols = st.columns([1, 9])
+        with cols[0]:
+            st.markdown(f"<div class='avatar {avatar_class}'>A</div>", unsafe_allow_html=True)
+        with cols[1]:
+            st.markdown(
+                f"<div class='msg-row'><div class='msg-bubble {bubble_class}'>" + msg.get("content", "") + "</div></div>",
+                unsafe_allow_html=True,
+            )
+            ts = msg.get("timestamp")
+            if ts:
+                st.markdown(f"<div class='timestamp'>{ts}</div>", unsafe_allow_html=True)
+
+            # Sources are references (id, title, snippet); full texts are loaded on demand
+            sources = msg.get("attachments") or []
+            if sources:
+                with st.expander(f"Sources ({len(sources)})"):
+                    for i, s in enumerate(sources):
+                        render_source(msg.get("id"), i, s)
 
 
 # Note: chat attachments removed — ingestion is PDF-only via the section below
@@ -201,22 +452,26 @@ if ingest_button:
     if not pdfs_to_ingest:
         st.warning("Please select one or more PDF files to ingest.")
     else:
-        total_inserted = 0
+        table = st.empty()
+
+        def show_rows(rows):
+            table.dataframe(
+                rows,
+                use_container_width=True,
+                hide_index=True,
+                column_config={"progress": st.column_config.ProgressColumn("progress", min_value=0.0, max_value=1.0)},
+            )
+
+        rows = ingest_files(pdfs_to_ingest, show_rows)
+        total_inserted = sum(r["chunks"] or 0 for r in rows)
         details = []
-        for file in pdfs_to_ingest:
-            try:
-                with st.spinner(f"Uploading {file.name}..."):
-                    files = {"file": (file.name, file.getvalue(), file.type)}
-                    r = requests.post(f"{API_BASE}/api/ingest_pdf", files=files, timeout=120)
-                if r.ok:
-                    data = r.json()
-                    inserted = data.get("inserted_count", 0)
-                    total_inserted += int(inserted or 0)
-                    details.append(f"{file.name}: {inserted} chunks")
-                else:
-                    details.append(f"{file.name}: failed ({r.status_code})")
-            except Exception as e:
-                details.append(f"{file.name}: error ({e})")
+        for r in rows:
+            if r["status"] == "done":
+                details.append(f"{r['file']}: {r['chunks']} chunks")
+            elif r["status"] == "failed":
+                details.append(f"{r['file']}: failed ({r['detail']})")
+            else:
+                details.append(f"{r['file']}: {r['status']}")
 
         assistant_text = f"Ingestion complete. Total chunks inserted: {total_inserted}.\n" + "; ".join(details)
         assistant_msg = {
@@ -226,7 +481,7 @@ if ingest_button:
             "attachments": [],
             "timestamp": datetime.now(),
         }
-        st.session_state.messages.append(assistant_msg)
+        add_message(assistant_msg)
         # Clear the file uploader selection so the uploaded PDFs are 'unseated' and user can add new files
         try:
             st.session_state["ingest_pdfs"] = None
@@ -251,6 +506,8 @@ if st.sidebar.button("Clear chat"):
             "timestamp": datetime.now(),
         }
     ]
+    st.session_state.history_shown = HISTORY_PAGE_SIZE
+    st.session_state.loaded_sources = set()
 
 
 # --- Input form ---
@@ -258,8 +515,9 @@ with st.form("chat_form", clear_on_submit=True):
     user_input = st.text_area("Type your message here:", height=80)
     submit_button = st.form_submit_button("Send")
 
+pending_question = None
 if submit_button and user_input.strip():
-    # Add user message
+    # Add user message; the answer is streamed in below the chat history
     user_msg = {
         "id": str(uuid.uuid4()),
         "role": "user",
@@ -267,73 +525,49 @@ if submit_button and user_input.strip():
         "attachments": [],
         "timestamp": datetime.now(),
     }
-    st.session_state.messages.append(user_msg)
-
-    # Query the backend for an answer
-    try:
-        with st.spinner("Querying backend..."):
-            r = requests.post(f"{API_BASE}/api/query", json={"question": user_input, "top_k": 4}, timeout=60)
-        if r.ok:
-            data = r.json()
-            assistant_text = data.get("answer") or "(no answer returned)"
-            assistant_sources = data.get("sources") or []
-        else:
-            assistant_text = f"Query failed: {r.status_code} - {r.text}"
-            assistant_sources = []
-    except Exception as e:
-        assistant_text = f"Request failed: {e}"
-        assistant_sources = []
-
-    assistant_msg = {
-        "id": str(uuid.uuid4()),
-        "role": "assistant",
-        "content": assistant_text,
-        "attachments": assistant_sources,
-        "timestamp": datetime.now(),
-    }
-    st.session_state.messages.append(assistant_msg)
+    add_message(user_msg)
+    pending_question = user_input
 
 # Render messages (after input handling so newly appended messages appear immediately)
 chat_container = st.container()
 with chat_container:
     st.markdown('<div class="chat-container">', unsafe_allow_html=True)
-    for msg in st.session_state.messages:
-        is_user = msg.get("role") == "user"
-        avatar_class = "avatar-user" if is_user else "avatar-assistant"
-        bubble_class = "msg-user" if is_user else "msg-assistant"
-
-        if is_user:
-            cols = st.columns([1, 9])
-            with cols[1]:
-                st.markdown(
-                    f"<div class='msg-row'><div class='msg-bubble {bubble_class}'>" + msg.get("content", "") + "</div></div>",
-                    unsafe_allow_html=True,
-                )
-                ts = msg.get("timestamp")
-                if ts:
-                    st.markdown(f"<div class='timestamp' style='text-align:right'>{ts}</div>", unsafe_allow_html=True)
-        else:
-            cols = st.columns([1, 9])
-            with cols[0]:
-                st.markdown(f"<div class='avatar {avatar_class}'>A</div>", unsafe_allow_html=True)
-            with cols[1]:
-                st.markdown(
-                    f"<div class='msg-row'><div class='msg-bubble {bubble_class}'>" + msg.get("content", "") + "</div></div>",
-                    unsafe_allow_html=True,
-                )
-                ts = msg.get("timestamp")
-                if ts:
-                    st.markdown(f"<div class='timestamp'>{ts}</div>", unsafe_allow_html=True)
-
-                # If assistant provided sources, render download buttons
-                sources = msg.get("attachments") or []
-                if sources:
-                    for i, s in enumerate(sources):
-                        src_text = s.get("text") or s.get("content") or str(s)
-                        src_name = s.get("metadata", {}).get("source", f"source_{i}.txt")
-                        try:
-                            st.download_button(f"Download source {i+1}", data=src_text, file_name=f"{src_name}.txt")
-                        except Exception:
-                            st.markdown(f"<div class='attachment'>📎 {src_name}</div>", unsafe_allow_html=True)
+    messages = st.session_state.messages
+    hidden = max(0, len(messages) - st.session_state.history_shown)
+    if hidden:
+        if st.button(f"Show earlier messages ({hidden} hidden)", key="show_earlier"):
+            st.session_state.history_shown += HISTORY_PAGE_SIZE
+            st.rerun()
+    for msg in messages[hidden:]:
+        render_message(msg)
+
+    if pending_question:
+        # Render the assistant bubble incrementally as answer tokens arrive
+        stream_slot = st.empty()
+
+        def show_partial(text):
+            stream_slot.markdown(
+                "<div class='msg-row'><div class='avatar avatar-assistant'>A</div>"
+                f"<div class='msg-bubble msg-assistant'>{text}▌</div></div>",
+                unsafe_allow_html=True,
+            )
+
+        show_partial("")
+        try:
+            assistant_text, assistant_sources = stream_query(pending_question, show_partial)
+        except Exception as e:
+            assistant_text = f"Request failed: {e}"
+            assistant_sources = []
+        stream_slot.empty()
+
+        assistant_msg = {
+            "id": str(uuid.uuid4()),
+            "role": "assistant",
+            "content": assistant_text,
+            "attachments": assistant_sources,
+            "timestamp": datetime.now(),
+        }
+        add_message(assistant_msg)
+        render_message(assistant_msg)
 
     st.markdown('</div>', unsafe_allow_html=True)